@@ -1,5 +1,7 @@
 from board import P2
 from analogio import AnalogIn
+from time import monotonic_ns
+from timers import shared_timers
 
 class Battery:
     """
@@ -42,3 +44,157 @@ class PinADC:
         Converts the analog reading to supply voltage in volts.
         """
         return 0.00898 * self.read_analog()
+
+    def get_supply_millivolts(self):
+        """
+        Converts the analog reading to supply voltage in integer millivolts.
+        """
+        return self.read_analog() * 898 // 100
+
+
+class BatteryMonitor:
+    """
+    Watches the battery during the run.
+
+    The voltage is sampled at a low rate and smoothed by an integer exponential
+    moving average. The level switches between OK, WARN and CRITICAL with
+    hysteresis, so a sagging pack does not flicker between levels. The monitor
+    also publishes a speed scale, nominal over filtered voltage rounded to the
+    nearest 1/256, that keeps the wheel speeds consistent as the pack discharges.
+    The ControlUnit applies it to the duty above the motors' deadband.
+
+    update() can be called every tick: it does at most one ADC read, and only
+    once the sampling period has passed. The cost of each sample is measured.
+    """
+    OK = 0
+    WARN = 1
+    CRITICAL = 2
+    LEVEL_NAMES = ("ok", "warn", "critical")
+
+    PERIOD_MS = 1000
+    SMOOTHING_SHIFT = 2  # New samples weigh 1/4
+    NOMINAL_MV = 7400
+    WARN_MV = 6400
+    CRITICAL_MV = int(Battery.MIN_VOLTAGE * 1000)
+    HYSTERESIS_MV = 150
+    # Speed scale in 1/256 steps and its limits, 9.9 V and 4.9 V, beyond the pack's range
+    SCALE_ONE = 256
+    SCALE_MIN = 192
+    SCALE_MAX = 384
+
+    def __init__(self, battery, timers=None, period_ms=PERIOD_MS, smoothing_shift=SMOOTHING_SHIFT,
+                 nominal_mv=NOMINAL_MV, warn_mv=WARN_MV, critical_mv=CRITICAL_MV, hysteresis_mv=HYSTERESIS_MV):
+        """
+        Initialize the monitor.
+
+        Args:
+            battery: Battery to sample
+            timers: TimerService pacing the samples, the shared one when omitted
+            period_ms: Milliseconds between samples
+            smoothing_shift: Weight of a new sample is 1 / 2**smoothing_shift
+            nominal_mv: Voltage at which the speed scale is 1
+            warn_mv: Voltage below which the level is WARN
+            critical_mv: Voltage below which the level is CRITICAL
+            hysteresis_mv: How far the voltage has to recover above a threshold to leave its level
+        """
+        self.pin = battery.pin
+        self.timers = shared_timers() if timers is None else timers
+        self.timer = self.timers.register("battery")
+        self.period_ms = period_ms
+        self.shift = smoothing_shift
+        self.nominal_mv = nominal_mv
+        self.warn_mv = warn_mv
+        self.critical_mv = critical_mv
+        self.hysteresis_mv = hysteresis_mv
+        self.accumulator = 0  # Filtered voltage << shift
+        self.samples = 0
+        self.min_mv = 0
+        self.max_mv = 0
+        self.level = BatteryMonitor.OK
+        self.speed_scale = BatteryMonitor.SCALE_ONE
+        self.worst_sample_ns = 0
+
+    def update(self):
+        """
+        Take a sample if the sampling period has passed.
+
+        Returns:
+            bool: True if a sample was taken
+        """
+        timers = self.timers
+        if timers.running(self.timer) and not timers.expired(self.timer):
+            return False
+        timers.start(self.timer, self.period_ms)
+        self.sample()
+        return True
+
+    def sample(self):
+        """
+        Read the battery once and update the filter, the level and the speed scale.
+        """
+        start = monotonic_ns()
+        millivolts = self.pin.get_supply_millivolts()
+        if self.samples == 0:
+            self.accumulator = millivolts << self.shift
+            self.min_mv = millivolts
+            self.max_mv = millivolts
+        else:
+            self.accumulator += millivolts - (self.accumulator >> self.shift)
+            if millivolts < self.min_mv:
+                self.min_mv = millivolts
+            if millivolts > self.max_mv:
+                self.max_mv = millivolts
+        self.samples += 1
+        filtered = self.accumulator >> self.shift
+        self.level = self.__level(filtered)
+        if filtered > 0:
+            # Rounded to the nearest step, a floor biased every scale down by up to one
+            scale = (self.nominal_mv * BatteryMonitor.SCALE_ONE + filtered // 2) // filtered
+            self.speed_scale = min(max(scale, BatteryMonitor.SCALE_MIN), BatteryMonitor.SCALE_MAX)
+        duration = monotonic_ns() - start
+        if duration > self.worst_sample_ns:
+            self.worst_sample_ns = duration
+
+    def __level(self, filtered):
+        """
+        Returns the level for the filtered voltage, leaving a level only past its hysteresis.
+        """
+        level = self.level
+        if filtered < self.critical_mv:
+            return BatteryMonitor.CRITICAL
+        if level == BatteryMonitor.CRITICAL and filtered < self.critical_mv + self.hysteresis_mv:
+            return level
+        if filtered < self.warn_mv:
+            return BatteryMonitor.WARN
+        if level == BatteryMonitor.WARN and filtered < self.warn_mv + self.hysteresis_mv:
+            return level
+        return BatteryMonitor.OK
+
+    def millivolts(self):
+        """
+        Returns the filtered voltage in millivolts, 0 before the first sample.
+        """
+        return self.accumulator >> self.shift
+
+    def critical(self):
+        """
+        Returns True once the battery is too low to continue.
+        """
+        return self.level == BatteryMonitor.CRITICAL
+
+    def stats(self):
+        """
+        Get the monitor statistics.
+
+        Returns:
+            dict: Filtered, min and max voltage in millivolts, level, speed scale and worst sample cost
+        """
+        return {
+            "millivolts": self.millivolts(),
+            "min_mv": self.min_mv,
+            "max_mv": self.max_mv,
+            "level": BatteryMonitor.LEVEL_NAMES[self.level],
+            "speed_scale": self.speed_scale,
+            "samples": self.samples,
+            "worst_sample_us": self.worst_sample_ns // 1000,
+        }
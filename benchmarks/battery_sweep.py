@@ -0,0 +1,102 @@
+"""
+The default lap across battery voltages with the BatteryMonitor compensating the duties.
+
+The compensation should make every voltage drive the lap like the nominal one: the
+lap is driven once per voltage and its outcome, lap time and the monitor's speed
+scale are reported, with the lap time's deviation from the nominal voltage's, as JSON.
+With --discharge the lap is also driven from the highest voltage with the battery
+draining at that many volts per second, so the speed scale changes during the lap.
+Exits with status 1 if the lap does not finish at any of the voltages:
+
+    python benchmarks/battery_sweep.py [--voltages 6.2 7.4 8.2] [--nominal 7.4] [--discharge 0.05]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim import Simulation  # noqa: E402
+from sim.courses import DEFAULT_COURSE, DEFAULT_ROUTE  # noqa: E402
+
+# From a pack in the monitor's warning level to a freshly charged one
+VOLTAGES = [6.0, 6.2, 6.4, 6.6, 6.8, 7.0, 7.2, 7.4, 7.6, 7.8, 8.0, 8.2, 8.4]
+NOMINAL = 7.4
+
+
+def drive(voltage, discharge_rate=0.0):
+    """
+    Drive the default lap at a battery voltage.
+
+    Args:
+        voltage: Battery voltage at the start
+        discharge_rate: Battery voltage drop in volts per second of driving
+
+    Returns:
+        dict: Outcome, lap time and the monitor's filtered voltage and speed scale at the end
+    """
+    simulation = Simulation(DEFAULT_COURSE, DEFAULT_ROUTE, voltage=voltage, discharge_rate=discharge_rate)
+    result = simulation.run()
+    monitor = simulation.battery_monitor
+    return {
+        "voltage": voltage,
+        "final_voltage": round(simulation.world.voltage, 2),
+        "finished": result.finished,
+        "final_state": result.final_state,
+        "lap_time": round(result.lap_time, 2),
+        "millivolts": monitor.millivolts(),
+        "speed_scale": monitor.speed_scale,
+    }
+
+
+def run(voltages, nominal=NOMINAL, discharge_rate=0.0):
+    """
+    Drive the lap at every voltage and at the nominal one.
+
+    Args:
+        voltages: Battery voltages to drive the lap at
+        nominal: Voltage the lap times are compared to
+        discharge_rate: When not zero, one more lap from the highest voltage with the battery draining this fast
+
+    Returns:
+        list: One row per voltage, lap_delta is its lap time minus the nominal voltage's
+    """
+    reference = drive(nominal)["lap_time"]
+    laps = [(voltage, 0.0) for voltage in voltages]
+    if discharge_rate:
+        laps.append((max(voltages), discharge_rate))
+    rows = []
+    for voltage, rate in laps:
+        row = drive(voltage, rate)
+        row["lap_delta"] = round(row["lap_time"] - reference, 2)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the default lap across battery voltages.")
+    parser.add_argument("--voltages", type=float, nargs="+", default=VOLTAGES)
+    parser.add_argument("--nominal", type=float, default=NOMINAL, help="voltage the lap times are compared to")
+    parser.add_argument("--discharge", type=float, default=0.0,
+                        help="also drive from the highest voltage with the battery draining this many volts per second")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+    rows = run(args.voltages, args.nominal, args.discharge)
+    text = json.dumps(rows, indent=1)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    for row in rows:
+        print("{voltage:.1f} V to {final_voltage:.1f} V  {final_state}  lap {lap_time:6.2f} s ({lap_delta:+.2f} s)  "
+              "scale {speed_scale}/256".format(**row))
+    failed = [row["voltage"] for row in rows if not row["finished"]]
+    if failed:
+        print("not finished at " + ", ".join("{:.1f} V".format(voltage) for voltage in failed))
+        sys.exit(1)
+    finished = [row["lap_time"] for row in rows]
+    print("finished at every voltage, lap {:.2f} to {:.2f} s".format(min(finished), max(finished)))
+
+
+if __name__ == "__main__":
+    main()
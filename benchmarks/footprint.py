@@ -0,0 +1,153 @@
+"""
+Memory footprint of the robot stack and dispatch cost of the per-tick calls on the simulated hardware.
+
+The board reports its free heap with gc.mem_free() at startup, CPython has no such call,
+so the heap taken by building the stack is measured with tracemalloc instead. Instance
+bytes count the objects of the robot's own classes, including their attribute dicts.
+
+    python benchmarks/footprint.py [--output results.json] [--calls 20000]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim import Simulation  # noqa: E402
+from sim.courses import STRAIGHT_COURSE  # noqa: E402
+
+ROBOT_MODULES = ("battery", "control_unit", "display_renderer", "i2c_bus", "lights", "line_sensors", "motors",
+                 "navigation", "obstacle_sensor", "robot", "state", "telemetry", "timers")
+
+
+def simulation():
+    return Simulation(STRAIGHT_COURSE, ["S", "T"])
+
+
+def instance_bytes(robot):
+    """
+    Sum the size of every object of the robot's classes reachable from the robot.
+
+    Returns:
+        dict: Bytes per class name, including the instance dicts
+    """
+    sizes = {}
+    seen = set()
+    pending = [robot]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or type(obj).__module__ not in ROBOT_MODULES:
+            continue
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        if hasattr(obj, "__dict__"):
+            size += sys.getsizeof(obj.__dict__)
+            values = list(obj.__dict__.values())
+        else:
+            values = [getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name)]
+        name = type(obj).__name__
+        sizes[name] = sizes.get(name, 0) + size
+        for value in values:
+            pending.extend(value if isinstance(value, (list, tuple)) else (value,))
+    return sizes
+
+
+def heap_pass():
+    """
+    Build the robot stack under tracemalloc and measure what stays allocated.
+    The modules are imported by a first build, so only the objects are counted.
+    """
+    simulation().build()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        run = simulation()
+        robot = run.build()
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    sizes = instance_bytes(robot)
+    return {
+        "heap_bytes": after - before,
+        "heap_peak_bytes": peak - before,
+        "instance_bytes": sum(sizes.values()),
+        "instance_bytes_by_class": dict(sorted(sizes.items())),
+    }
+
+
+def per_call_ns(function, calls, repeats=5):
+    """
+    Best mean time per call of several repeats, the least disturbed by the host.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            function()
+        mean = (time.perf_counter_ns() - start) / calls
+        best = mean if best is None or mean < best else best
+    return best
+
+
+def dispatch_pass(calls):
+    """
+    Time the calls dispatching on state and command IDs, the robot following the straight line.
+    """
+    from control_unit import ControlUnit
+    from motors import Motors
+
+    run = simulation()
+    run.start()
+    robot = run.robot
+    control_unit = robot.control_unit
+    motors = control_unit.motors
+    with run.output():
+        for _ in range(25):
+            run.step()
+        control_unit.begin_tick()
+        try:
+            result = {
+                "motors_move_ns": per_call_ns(lambda: motors.move(Motors.LEFT, Motors.FORWARD, 90), calls),
+                "execute_forward_ns": per_call_ns(
+                    lambda: control_unit.execute_movement(ControlUnit.COMMAND_FORWARD), calls),
+                "execute_left_ns": per_call_ns(lambda: control_unit.execute_movement(ControlUnit.COMMAND_LEFT), calls),
+                "state_update_ns": per_call_ns(robot.robot_state.update, calls),
+            }
+        finally:
+            control_unit.end_tick()
+        ticks = []
+        for _ in range(250):
+            start = time.perf_counter_ns()
+            robot.drive()
+            ticks.append(time.perf_counter_ns() - start)
+            time.sleep(Simulation.TICK)
+    ticks.sort()
+    result["drive_ns_p50"] = ticks[len(ticks) // 2]
+    result["drive_ns_mean"] = sum(ticks) / len(ticks)
+    return {key: round(value) for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the robot stack's memory footprint and dispatch cost.")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--calls", type=int, default=20000, help="calls per dispatch measurement")
+    args = parser.parse_args()
+    report = {"python": platform.python_implementation() + " " + platform.python_version()}
+    report.update(heap_pass())
+    report.update(dispatch_pass(args.calls))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
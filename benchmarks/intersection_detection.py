@@ -0,0 +1,138 @@
+"""
+False and missed intersection detections across speeds and sensor noise.
+
+The robot drives straight over a ladder of crossings, every crossing should make it
+stop exactly once. A stop is matched to the crossing its line sensors are on, stops
+away from any crossing and repeated stops for one crossing are false positives,
+crossings the sensors passed without a stop are missed. Every combination of speed
+multiplier and noise level runs with a single sensor reading per tick and with the
+SensorSampler debouncing several readings per tick, as JSON:
+
+    python benchmarks/intersection_detection.py [--speeds 1 1.5 2] [--noise 0 0.02] [--seeds 3]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim import Simulation  # noqa: E402
+from sim.courses import GRID  # noqa: E402
+from sim.track import TrackMap  # noqa: E402
+from navigation import Navigation  # noqa: E402
+
+CROSSINGS = 8
+# A stop counts for a crossing while the sensors are within this distance of it
+MATCH_M = 0.03
+
+
+def ladder(crossings=CROSSINGS, line_width=TrackMap.LINE_WIDTH):
+    """
+    A straight line north with four-way crossings one grid unit apart and a finish bar.
+
+    Returns:
+        tuple: (TrackMap, route, y coordinates of the crossings and of the finish bar)
+    """
+    nodes = {str(index): (0.0, index * GRID) for index in range(crossings + 2)}
+    edges = [(str(index), str(index + 1)) for index in range(crossings + 1)]
+    for index in range(1, crossings + 1):
+        for side, x in (("W", -GRID / 2), ("E", GRID / 2)):
+            nodes[side + str(index)] = (x, index * GRID)
+            edges.append((str(index), side + str(index)))
+    track = TrackMap(nodes, edges, line_width=line_width, name="ladder")
+    route = [str(index) for index in range(crossings + 2)]
+    return track, route, [index * GRID for index in range(1, crossings + 2)]
+
+
+def drive(speed, noise, sampling, seed, crossings, line_width, timeout=120.0):
+    """
+    Drive over the ladder once.
+
+    Returns:
+        dict: Crossings passed, detected and missed, false positives, line loss and the simulated time
+    """
+    track, route, targets = ladder(crossings, line_width)
+    # Never finish, a false stop must not end the run early
+    turns = [Navigation.FORWARD] * 100
+    simulation = Simulation(track, route, turns=turns, sampling=sampling, sensor_noise=noise, seed=seed,
+                            speed_multiplier=speed)
+    simulation.start()
+    world = simulation.world
+    lookahead = world.car.sensor_lookahead
+    detected = set()
+    false_positives = 0
+    state = simulation.state
+    with simulation.output():
+        while simulation.elapsed() < timeout:
+            previous, state = state, simulation.step()
+            sensors_y = world.y + lookahead
+            if state == "B" and previous != "B":
+                nearest = min(targets, key=lambda y: abs(y - sensors_y))
+                if abs(nearest - sensors_y) <= MATCH_M and nearest not in detected:
+                    detected.add(nearest)
+                else:
+                    false_positives += 1
+            if state in Simulation.TERMINAL_STATES or sensors_y > targets[-1] + MATCH_M:
+                break
+        simulation.robot.stop()
+    sensors_y = world.y + lookahead
+    passed = [y for y in targets if sensors_y > y + MATCH_M or y in detected]
+    return {
+        "passed": len(passed),
+        "detected": len(detected),
+        "missed": len(passed) - len(detected),
+        "false_positives": false_positives,
+        # Ran off the line before the finish bar, the stop after it is expected
+        "lost_line": state == "E" and len(passed) < len(targets),
+        "final_state": state,
+        "time": round(simulation.elapsed(), 2),
+    }
+
+
+def run(speeds, noises, seeds, crossings=CROSSINGS, line_width=TrackMap.LINE_WIDTH):
+    """
+    Run every combination of speed, noise and sampling mode over several seeds.
+
+    Returns:
+        list: One row per combination with summed counts and the rates per passed crossing
+    """
+    rows = []
+    for speed in speeds:
+        for noise in noises:
+            for sampling in (False, True):
+                total = {"passed": 0, "detected": 0, "missed": 0, "false_positives": 0, "lost_line": 0}
+                for seed in range(seeds):
+                    result = drive(speed, noise, sampling, seed, crossings, line_width)
+                    for key in total:
+                        total[key] += result[key]
+                passed = total["passed"] or 1
+                rows.append(dict(
+                    speed=speed, noise=noise, mode="sampler" if sampling else "single", **total,
+                    missed_rate=round(total["missed"] / passed, 3),
+                    false_positive_rate=round(total["false_positives"] / passed, 3),
+                ))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure false and missed intersection detections.")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1.0, 1.5, 2.0, 2.5])
+    parser.add_argument("--noise", type=float, nargs="+", default=[0.0, 0.01, 0.03])
+    parser.add_argument("--seeds", type=int, default=3, help="runs per combination")
+    parser.add_argument("--crossings", type=int, default=CROSSINGS)
+    parser.add_argument("--line-width", type=float, default=TrackMap.LINE_WIDTH, help="in metres")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+    rows = run(args.speeds, args.noise, args.seeds, args.crossings, args.line_width)
+    text = json.dumps(rows, indent=1)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    for row in rows:
+        print("speed {speed:4} noise {noise:5} {mode:8} passed {passed:3} missed {missed:3} "
+              "false {false_positives:3} lost {lost_line}".format(**row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark comparing the legacy string based line sensor decoder with the
+precomputed state table used by LineSensors.
+
+Runs on CPython from the repository root:
+
+    python benchmarks/line_decoding.py
+"""
+import os
+import sys
+import types
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# line_sensors imports the I2C handle at module level, the decoder itself needs no hardware.
+if "picoed" not in sys.modules:
+    try:
+        import picoed  # noqa: F401
+    except ImportError:
+        placeholder = types.ModuleType("picoed")
+        placeholder.i2c = None
+        sys.modules["picoed"] = placeholder
+
+from line_sensors import LineSensors  # noqa: E402
+
+REPEAT = 200
+
+
+def legacy_decode(raw):
+    """
+    Decoder as it was in LineSensors.read() before the state table:
+    bin() string indexing followed by int()/bool() conversions and the get_state() dict.
+    """
+    buffer = bytearray(1)
+    buffer[0] = raw
+    data_bit_string = bin(int.from_bytes(buffer, "big"))
+    left, center, right = bool(int(data_bit_string[7])), bool(int(data_bit_string[6])), bool(int(data_bit_string[5]))
+    return {
+        "left": left,
+        "center": center,
+        "right": right,
+        "is_intersection": sum([left, center, right]) >= 2,
+    }
+
+
+def table_decode(raw, table=LineSensors.STATE_TABLE):
+    """
+    Decoder used by LineSensors.read_flags().
+    """
+    return table[raw]
+
+
+def run_all(decoder):
+    """
+    Decode every possible raw byte once.
+
+    Returns:
+        int: Number of bytes the decoder failed on
+    """
+    failures = 0
+    for raw in range(256):
+        try:
+            decoder(raw)
+        except (IndexError, ValueError):
+            failures += 1
+    return failures
+
+
+def allocations(decoder):
+    """
+    Measure the memory allocated on top of the baseline while decoding all 256 inputs once.
+    Transient objects are freed right away, so the peak is what the GC would have to deal with.
+
+    Returns:
+        int: Peak number of bytes allocated during the pass
+    """
+    run_all(decoder)
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    run_all(decoder)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - baseline
+
+
+def mismatches():
+    """
+    Count the raw bytes where both decoders succeed but disagree.
+    """
+    count = 0
+    for raw in range(256):
+        try:
+            legacy = legacy_decode(raw)
+        except (IndexError, ValueError):
+            continue
+        flags = table_decode(raw)
+        decoded = (
+            bool(flags & LineSensors.LEFT),
+            bool(flags & LineSensors.CENTER),
+            bool(flags & LineSensors.RIGHT),
+            bool(flags & LineSensors.INTERSECTION),
+        )
+        if decoded != (legacy["left"], legacy["center"], legacy["right"], legacy["is_intersection"]):
+            count += 1
+    return count
+
+
+def main():
+    print("Decoding all 256 sensor bytes, best of 5 x {} passes".format(REPEAT))
+    print("{:<8} {:>12} {:>10} {:>16}".format("decoder", "ns/byte", "failures", "peak alloc bytes"))
+    results = {}
+    for name, decoder in (("legacy", legacy_decode), ("table", table_decode)):
+        seconds = min(timeit.repeat(lambda: run_all(decoder), number=REPEAT, repeat=5))
+        per_byte = seconds / (REPEAT * 256) * 1e9
+        results[name] = per_byte
+        print("{:<8} {:>12.1f} {:>10} {:>16}".format(name, per_byte, run_all(decoder), allocations(decoder)))
+    print("speedup: {:.1f}x".format(results["legacy"] / results["table"]))
+    print("bytes decoded differently where legacy succeeds (0x20-0x7F shift the bin() string): {}".format(mismatches()))
+
+
+if __name__ == "__main__":
+    main()
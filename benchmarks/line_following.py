@@ -0,0 +1,161 @@
+"""
+Highest sustainable speed of the line following controllers on straights and curves.
+
+Every controller drives each course at rising speed multipliers until a run fails.
+A run fails when the robot stops before the finish bar, e.g. for a false crossing
+seen at a steep angle to the line, or when the line was lost: at the end of a tick
+it was beyond the reach of the outer sensors. The highest multiplier below the first failure and its time are reported
+per controller and course, as JSON:
+
+    python benchmarks/line_following.py [--speeds 1 1.5 2] [--courses straight curves]
+                                        [--max-speed 1.5] [--gain-p 16] [--gain-d 24] [--curve-slowdown 15]
+
+The stock car model reaches its full wheel speed at a multiplier of about 2.8 and
+holds the line up to there with either controller, the default car is three times
+as fast so the controllers' limits show below full duty.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim import CarModel, Simulation  # noqa: E402
+from sim.courses import STRAIGHT_COURSE, STRAIGHT_ROUTE  # noqa: E402
+from sim.hardware import install  # noqa: E402
+from sim.track import TrackMap  # noqa: E402
+
+# The robot modules need the stand-ins of the board's modules
+install()
+
+from control_unit import ControlUnit  # noqa: E402
+
+CONTROLLERS = {"bang-bang": ControlUnit.BANG_BANG, "proportional": ControlUnit.PROPORTIONAL}
+SPEEDS = [1.0, 1.25, 1.5, 1.75, 2.0, 2.25, 2.5, 2.75]
+MAX_SPEED = 1.5
+# The finish bar counts as reached within this distance
+MATCH_M = 0.02
+# Start pose off the line, the controller has to settle first: lateral offset in metres and heading error
+STRAIGHT_OFFSET = 0.006
+STRAIGHT_ANGLE = math.radians(5)
+# Sine courses: wavelength in metres, the amplitude is 0.12 m
+CURVES = {"curves": 1.2, "tight-curves": 1.0}
+CURVE_AMPLITUDE = 0.12
+
+
+def sine(wavelength, amplitude=CURVE_AMPLITUDE, length=3.2, step=0.02):
+    """
+    A sine shaped line north with a finish bar at its end, as a chain of short edges.
+
+    Returns:
+        tuple: (TrackMap, route, start pose, y coordinate of the finish bar)
+    """
+    count = int(length / step)
+    nodes = {str(index): (amplitude * math.sin(2 * math.pi * index * step / wavelength), index * step)
+             for index in range(count + 1)}
+    edges = [(str(index), str(index + 1)) for index in range(count)]
+    track = TrackMap(nodes, edges, name="sine{}".format(wavelength))
+    return track, ["0", "1"], None, count * step
+
+
+def straight():
+    """
+    The straight course, starting beside the line at an angle.
+
+    Returns:
+        tuple: (TrackMap, route, start pose, y coordinate of the finish bar)
+    """
+    (x, y), (_, end) = [STRAIGHT_COURSE.nodes[node] for node in STRAIGHT_ROUTE]
+    return STRAIGHT_COURSE, STRAIGHT_ROUTE, (x + STRAIGHT_OFFSET, y + 0.03, math.pi / 2 + STRAIGHT_ANGLE), end
+
+
+def course(name):
+    return straight() if name == "straight" else sine(CURVES[name])
+
+
+def drive(name, controller, speed, car, control_unit_args, timeout=60.0):
+    """
+    Drive one course until the robot stops for the first crossing, the finish bar if it followed the line.
+
+    Returns:
+        dict: Whether the finish bar was reached, the ticks the line was lost in and the simulated time
+    """
+    track, route, pose, end = course(name)
+    args = dict(control_unit_args, controller=controller)
+    simulation = Simulation(track, route, car=car, turns=[], pose=pose, speed_multiplier=speed,
+                            control_unit_args=args)
+    simulation.start()
+    world = simulation.world
+    car = world.car
+    # The line is within reach while it is no farther from the center sensor than the outer ones are
+    reach = car.sensor_spacing + car.sensor_radius
+    lost_ticks = 0
+    with simulation.output():
+        while simulation.elapsed() < timeout:
+            if simulation.step() != "D":
+                break
+            if not track.on_line(*world.sensor_positions()[1], margin=reach):
+                lost_ticks += 1
+        simulation.robot.stop()
+    finished = world.y + car.sensor_lookahead >= end - MATCH_M
+    return {
+        "finished": finished,
+        "lost_ticks": lost_ticks,
+        "sustained": finished and lost_ticks == 0,
+        "time": round(simulation.elapsed(), 2),
+    }
+
+
+def run(courses, speeds, car, control_unit_args):
+    """
+    Drive every course with every controller at rising speeds until a run fails.
+
+    Returns:
+        list: One row per controller and course with the highest sustained speed and its runs
+    """
+    rows = []
+    for name in courses:
+        for controller_name, controller in CONTROLLERS.items():
+            best = None
+            runs = {}
+            for speed in sorted(speeds):
+                result = drive(name, controller, speed, car, control_unit_args)
+                runs[str(speed)] = result
+                if not result["sustained"]:
+                    break
+                best = speed
+            rows.append({
+                "course": name,
+                "controller": controller_name,
+                "max_speed": best,
+                "time": runs[str(best)]["time"] if best else None,
+                "runs": runs,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the sustainable line following speed of the controllers.")
+    parser.add_argument("--speeds", type=float, nargs="+", default=SPEEDS)
+    parser.add_argument("--courses", nargs="+", choices=["straight"] + sorted(CURVES),
+                        default=["straight"] + sorted(CURVES))
+    parser.add_argument("--max-speed", type=float, default=MAX_SPEED, help="car's wheel speed at full duty in m/s")
+    parser.add_argument("--gain-p", type=float, default=ControlUnit.GAIN_P)
+    parser.add_argument("--gain-d", type=float, default=ControlUnit.GAIN_D)
+    parser.add_argument("--curve-slowdown", type=float, default=ControlUnit.CURVE_SLOWDOWN)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+    control_unit_args = {"gain_p": args.gain_p, "gain_d": args.gain_d, "curve_slowdown": args.curve_slowdown}
+    rows = run(args.courses, args.speeds, CarModel(max_speed=args.max_speed), control_unit_args)
+    text = json.dumps(rows, indent=1)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    for row in rows:
+        print("{course:13} {controller:13} max speed {max_speed} time {time} s".format(**row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Per-tick cost of Robot.drive() in scripted scenarios on the simulated hardware.
+
+For every scenario it reports the wall time per tick, I2C transactions per tick split
+by device address, NeoPixel refreshes, display writes, the peak memory allocated during
+a tick, the objects and bytes a tick leaves allocated and garbage collections, as JSON:
+
+    python benchmarks/tick_costs.py [--output results.json] [--scenario straight_line]
+
+CPython allocates every int above 256 while MicroPython keeps ints below 2**30 unboxed,
+so allocation sites that only store millisecond ticks or sensor readings cost nothing
+on the board.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim import Simulation  # noqa: E402
+from sim.courses import DEFAULT_COURSE, STRAIGHT_COURSE  # noqa: E402
+
+SENSORS = 0x38
+MOTORS = 0x70
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Skips the interpreter's own allocations before the traces are diffed
+ROBOT_CODE = [tracemalloc.Filter(True, os.path.join(ROOT, "*"))]
+# Allocation sites listed per scenario
+SITES = 5
+
+
+class Scenario:
+    """
+    A scripted situation: where the car starts on which course and which ticks are measured.
+    """
+
+    def __init__(self, name, track, route, ticks, warmup=0, turns=None, start_offset=0.03, pose=None):
+        """
+        Args:
+            name: Name of the scenario in the report
+            track: TrackMap to drive on
+            route: Route the navigation is compiled from
+            ticks: Number of measured ticks
+            warmup: Ticks run before the measurement starts
+            turns: Explicit turn list, compiled from the route when omitted
+            start_offset: Distance of the start pose from the first node in metres
+            pose: Explicit start pose
+        """
+        self.name = name
+        self.track = track
+        self.route = route
+        self.ticks = ticks
+        self.warmup = warmup
+        self.turns = turns
+        self.start_offset = start_offset
+        self.pose = pose
+
+    def simulation(self):
+        """
+        Build a fresh simulation for the scenario, started and warmed up.
+        """
+        simulation = Simulation(self.track, self.route, turns=self.turns, start_offset=self.start_offset, pose=self.pose)
+        simulation.start()
+        with simulation.output():
+            for _ in range(self.warmup):
+                simulation.step()
+        return simulation
+
+
+SCENARIOS = [
+    Scenario("straight_line", STRAIGHT_COURSE, ["S", "T"], ticks=250, warmup=25),
+    Scenario("intersection_approach", DEFAULT_COURSE, ["1,1", "2,1", "3,1"], ticks=75, start_offset=0.25),
+    Scenario("left_turn", DEFAULT_COURSE, ["1,1", "2,1", "2,2"], ticks=150, start_offset=0.25),
+    Scenario("right_turn", DEFAULT_COURSE, ["1,1", "2,1", "2,0"], ticks=150, start_offset=0.25),
+    Scenario("lost_line", STRAIGHT_COURSE, ["S", "T"], ticks=300, pose=(0.2, 0.8, math.pi / 2)),
+    Scenario("finish", DEFAULT_COURSE, ["1,1", "2,1"], ticks=100, start_offset=0.25),
+]
+
+
+def counters(hardware):
+    """
+    Snapshot of the hardware counters.
+    """
+    return {
+        "i2c_0x38": hardware.i2c.transactions(SENSORS),
+        "i2c_0x70": hardware.i2c.transactions(MOTORS),
+        "i2c_locks": hardware.i2c.locks,
+        "neopixel_writes": sum(pixels.writes for pixels in hardware.neopixels),
+        "display_writes": len(hardware.display.shown),
+    }
+
+
+def timing_pass(scenario):
+    """
+    Run the scenario measuring wall time per tick, hardware traffic and garbage collections.
+    The display is drawn between the ticks the way code.py's idle hook does, outside the timing.
+    """
+    simulation = scenario.simulation()
+    robot = simulation.robot
+    renderer = simulation.renderer
+    before = counters(simulation.hardware)
+    collections = []
+
+    def on_gc(phase, info):
+        if phase == "start":
+            collections.append(info["generation"])
+
+    durations = []
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    try:
+        with simulation.output():
+            for _ in range(scenario.ticks):
+                start = time.perf_counter_ns()
+                robot.drive()
+                durations.append(time.perf_counter_ns() - start)
+                renderer.service()
+                time.sleep(Simulation.TICK)
+    finally:
+        gc.callbacks.remove(on_gc)
+    after = counters(simulation.hardware)
+    durations.sort()
+    ticks = scenario.ticks
+    result = {
+        "ticks": ticks,
+        "final_state": robot.robot_state.name(),
+        "wall_us_mean": round(sum(durations) / ticks / 1000, 2),
+        "wall_us_p50": round(durations[ticks // 2] / 1000, 2),
+        "wall_us_p95": round(durations[int(ticks * 0.95)] / 1000, 2),
+        "wall_us_max": round(durations[-1] / 1000, 2),
+        "gc_collections": len(collections),
+    }
+    for key in before:
+        result[key + "_per_tick"] = round((after[key] - before[key]) / ticks, 3)
+    return result
+
+
+def allocation_pass(scenario):
+    """
+    Replay the scenario under tracemalloc. The simulation is deterministic, so this pass
+    drives exactly the same ticks.
+
+    Every drive() starts with tracemalloc.reset_peak(), the traced memory's peak above its
+    level at the start is what the tick allocated at its worst, temporaries it freed again
+    included, less what reading the peak costs itself. It also counts what the simulator's
+    stand-ins allocate during the tick, and on CPython the millisecond ticks are boxed ints.
+    Snapshots taken right before and after each drive() give the objects the tick allocated
+    and still holds when it returns, counted only where a robot module allocated them.
+    """
+    simulation = scenario.simulation()
+    robot = simulation.robot
+    renderer = simulation.renderer
+    peaks = []
+    retained = []
+    objects = []
+    sites = {}
+
+    def measure(call):
+        # Peak above the level at the start and the robot modules' traces around one call
+        before = tracemalloc.take_snapshot().filter_traces(ROBOT_CODE)
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        call()
+        peak = tracemalloc.get_traced_memory()[1] - start
+        return peak, before, tracemalloc.take_snapshot().filter_traces(ROBOT_CODE)
+
+    tracemalloc.start()
+    try:
+        with simulation.output():
+            # Reading the peak allocates too, measured around a call doing nothing
+            overhead = min(measure(lambda: None)[0] for _ in range(3))
+            for _ in range(scenario.ticks):
+                peak, before, after = measure(robot.drive)
+                peaks.append(max(0, peak - overhead))
+                size = 0
+                count = 0
+                for difference in after.compare_to(before, "lineno"):
+                    frame = difference.traceback[0]
+                    filename = os.path.normpath(frame.filename)
+                    # Allocations are counted where a robot module made them, not in the simulator's stand-ins
+                    if difference.size_diff > 0 and os.path.dirname(filename) == ROOT:
+                        size += difference.size_diff
+                        count += max(0, difference.count_diff)
+                        site = "{}:{}".format(os.path.basename(filename), frame.lineno)
+                        sites[site] = sites.get(site, 0) + difference.size_diff
+                retained.append(size)
+                objects.append(count)
+                renderer.service()
+                time.sleep(Simulation.TICK)
+    finally:
+        tracemalloc.stop()
+    ticks = len(peaks)
+    return {
+        "alloc_peak_bytes_per_tick": round(sum(peaks) / ticks, 1),
+        "alloc_peak_bytes_max": max(peaks),
+        "allocating_ticks": sum(1 for peak in peaks if peak > 0),
+        "retained_bytes_per_tick": round(sum(retained) / ticks, 1),
+        "retained_objects_per_tick": round(sum(objects) / ticks, 2),
+        "retained_objects_max": max(objects),
+        # Where the retained bytes were allocated, so a tick that allocates can be traced to its line
+        "retained_sites": dict(sorted(sites.items(), key=lambda item: -item[1])[:SITES]),
+    }
+
+
+def run(names=None):
+    """
+    Run the selected scenarios.
+
+    Returns:
+        dict: Report with one entry per scenario
+    """
+    report = {
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "tick_seconds": Simulation.TICK,
+        "scenarios": {},
+    }
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        result = timing_pass(scenario)
+        result.update(allocation_pass(scenario))
+        report["scenarios"][scenario.name] = result
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of one Robot.drive() tick.")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--scenario", action="append", choices=[scenario.name for scenario in SCENARIOS])
+    args = parser.parse_args()
+    report = run(args.scenario)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Time and overshoot of the turns at intersections with and without the TurnPredictor.
+
+The default lap is driven at several battery voltages, once with the turns spinning
+at the fixed turn duty until the sensor finds the line and once with the predictor
+tapering them and polling the sensors at their end. Every turn is timed from its
+start until the sensor found the new line (spin) and from there until the car drove
+straight along it (settle), the overshoot is how far the car rotated past the line's
+heading. The mean of both runs and the time saved per turn are reported per voltage,
+the time saved only over the turns both runs made before either stopped, as JSON.
+Exits with status 1 if the predictor does worse at any voltage: the lap ends in a
+state the fixed run did not end in, or the turns take longer:
+
+    python benchmarks/turn_completion.py [--voltages 6.8 7.4 8] [--window-ticks 6] [--duty-min 60]
+                                         [--learn-shift 1]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim import Simulation  # noqa: E402
+from sim.courses import DEFAULT_COURSE, DEFAULT_ROUTE  # noqa: E402
+from sim.hardware import install  # noqa: E402
+
+# The robot modules need the stand-ins of the board's modules
+install()
+
+from turn_predictor import TurnPredictor  # noqa: E402
+
+VOLTAGES = [6.6, 6.8, 7.0, 7.2, 7.4, 7.6, 7.8, 8.0, 8.2]
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def drive(voltage, predictor_args=None):
+    """
+    Drive the default lap, with a TurnPredictor configured by predictor_args unless None.
+
+    Returns:
+        dict: Outcome of the lap and the mean spin, settle, turn time and overshoot of its turns
+    """
+    simulation = Simulation(DEFAULT_COURSE, DEFAULT_ROUTE, voltage=voltage, turn_prediction=predictor_args is not None,
+                            turn_predictor_args=predictor_args)
+    result = simulation.run()
+    turns = result.turn_times
+    return {
+        "finished": result.finished,
+        "final_state": result.final_state,
+        "lap_time": round(result.lap_time, 2),
+        "turns": len(turns),
+        "spin": round(mean([spin for spin, _, _ in turns]), 3),
+        "settle": round(mean([settle for _, settle, _ in turns]), 3),
+        "turn_time": round(result.turn_time(), 3),
+        "overshoot_deg": round(result.overshoot(), 2),
+        "turn_times": [[round(value, 3) for value in turn] for turn in turns],
+    }
+
+
+def run(voltages, predictor_args):
+    """
+    Drive the lap at every voltage with and without the predictor.
+
+    Returns:
+        list: One row per voltage with both runs and the time saved per turn
+    """
+    rows = []
+    for voltage in voltages:
+        fixed = drive(voltage)
+        predicted = drive(voltage, predictor_args)
+        rows.append({
+            "voltage": voltage,
+            "fixed": fixed,
+            "predicted": predicted,
+            "saved_per_turn": round(mean([spin + settle - predicted_spin - predicted_settle
+                                          for (spin, settle, _), (predicted_spin, predicted_settle, _)
+                                          in zip(fixed["turn_times"], predicted["turn_times"])]), 3),
+        })
+    return rows
+
+
+def worse_than_fixed(row):
+    """
+    Returns True if the predicted run of a row did worse than the fixed one.
+    """
+    fixed, predicted = row["fixed"], row["predicted"]
+    if predicted["final_state"] != fixed["final_state"] and not predicted["finished"]:
+        return True
+    return row["saved_per_turn"] < 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the turns with and without the turn predictor.")
+    parser.add_argument("--voltages", type=float, nargs="+", default=VOLTAGES)
+    parser.add_argument("--window-ticks", type=int, default=TurnPredictor.WINDOW_TICKS)
+    parser.add_argument("--duty-min", type=int, default=TurnPredictor.DUTY_MIN)
+    parser.add_argument("--learn-shift", type=int, default=TurnPredictor.LEARN_SHIFT)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+    predictor_args = {"window_ticks": args.window_ticks, "duty_min": args.duty_min, "learn_shift": args.learn_shift}
+    rows = run(args.voltages, predictor_args)
+    text = json.dumps(rows, indent=1)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    for row in rows:
+        fixed, predicted = row["fixed"], row["predicted"]
+        print("{:.1f} V  fixed {:.3f} s {:5.2f} deg {}  predicted {:.3f} s {:5.2f} deg {}  saved {:.3f} s per turn"
+              .format(row["voltage"], fixed["turn_time"], fixed["overshoot_deg"], fixed["final_state"],
+                      predicted["turn_time"], predicted["overshoot_deg"], predicted["final_state"],
+                      row["saved_per_turn"]))
+    print("mean saved {:.3f} s per turn".format(mean([row["saved_per_turn"] for row in rows])))
+    worse = [row["voltage"] for row in rows if worse_than_fixed(row)]
+    if worse:
+        print("predictor worse than the fixed duty at " + ", ".join("{:.1f} V".format(voltage) for voltage in worse))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,203 @@
 from picoed import button_a, button_b, display # type: ignore
-from time import sleep
-from robot import Robot
-from line_sensors import LineSensors
-from motors import Motors
-from obstacle_sensor import ObstacleSensor
-from navigation import Navigation
-from control_unit import ControlUnit
-from lights import Lights
-import traceback  # Add this import for MicroPython error handling
-from battery import Battery
+import gc
+from time import sleep, monotonic_ns
+from battery import Battery, BatteryMonitor
+
+# Run the subsystems as asyncio tasks instead of the synchronous fixed-rate loop, without sampling and prediction
+USE_ASYNCIO = False
+# Time the subsystem calls of every tick and print a report after the run
+PROFILE = False
+# Record the sensors, state and duties of every tick for tools/decode_telemetry.py, saved after the run
+TELEMETRY = False
+# Print every change of state over the serial console, the telemetry records the states without that cost
+LOG_STATE_CHANGES = False
+# Pin wired to the line sensor expander's INT output, e.g. board.P1. None reads the expander every tick
+LINE_SENSOR_INT_PIN = None
+# Sample and debounce the line sensors in the slack between ticks, against specks and glare on the mat
+SENSOR_SAMPLING = False
+# Taper the turns towards the learned line acquisition and poll the sensors at its end, for less overshoot
+TURN_PREDICTION = False
+# Follow the line with the proportional controller instead of the bang-bang one, for higher speeds
+PROPORTIONAL_STEERING = False
+# Record the sensor inputs and the robot's reactions for python -m sim.replay, saved after the run
+RECORD_TRACE = False
+# Route compiled by tools/plan_route.py, the hand-written turn list below is used without it
+ROUTE_FILE = "/route.bin"
+
+
+def wait_for_battery(battery):
+    """
+    Block while the battery is too low to drive.
+    Imports what the failure path needs only when it is taken.
+
+    Args:
+        battery: Battery to check
+    """
+    if battery.ok():
+        return
+    from motors import Motors
+    from display_renderer import DisplayRenderer
+    motors = Motors()
+    renderer = DisplayRenderer(display)
+    while not battery.ok():
+        print("Battery is not ok. Stopping the robot.")
+        motors.stop()
+        renderer.show_blocking("LOW BATTERY " + str(battery.get_voltage()) + "V")
+        sleep(1)
+
 
 if __name__ == "__main__":
+    # Checked before the other modules are even imported, a flat battery does not wait for them
+    battery = Battery()
+    wait_for_battery(battery)
+
+    from robot import Robot
+    from line_sensors import LineSensors
+    from motors import Motors
+    from obstacle_sensor import ObstacleSensor
+    from navigation import Navigation, load_turns
+    from control_unit import ControlUnit
+    from lights import Lights
+    from scheduler import LoopScheduler
+    from display_renderer import DisplayRenderer
+    try:
+        # Keyword arguments found by tools/tune.py, the class defaults without them
+        from tuned import CONTROL_UNIT, ROBOT
+        print("Loaded the tuned parameters")
+    except ImportError:
+        CONTROL_UNIT = {}
+        ROBOT = {}
+    if PROPORTIONAL_STEERING:
+        CONTROL_UNIT["controller"] = ControlUnit.PROPORTIONAL
 
-    navigation = Navigation(turns=[
-        Navigation.FORWARD,
-        Navigation.LEFT,
-        Navigation.RIGHT,
-        Navigation.LEFT,
-        Navigation.FORWARD,
-        Navigation.LEFT,
-        Navigation.FORWARD,
-        Navigation.LEFT,
-        Navigation.FORWARD,
-        Navigation.RIGHT,
-        Navigation.LEFT,
-        Navigation.LEFT
-
-    ])
+    turns = None
+    try:
+        turns = load_turns(ROUTE_FILE)
+        print("Loaded " + str(len(turns)) + " turns from " + ROUTE_FILE)
+    except OSError:
+        pass
+    except ValueError as e:
+        # A corrupt or outdated route file must not keep the robot from booting
+        print("Ignoring the route file: " + str(e))
+    if turns is None:
+        turns = [
+            Navigation.FORWARD,
+            Navigation.LEFT,
+            Navigation.RIGHT,
+            Navigation.LEFT,
+            Navigation.FORWARD,
+            Navigation.LEFT,
+            Navigation.FORWARD,
+            Navigation.LEFT,
+            Navigation.FORWARD,
+            Navigation.RIGHT,
+            Navigation.LEFT,
+            Navigation.LEFT
+        ]
+    navigation = Navigation(turns=turns)
 
+    battery_monitor = BatteryMonitor(battery)
+    line_sensors = LineSensors(interrupt_pin=LINE_SENSOR_INT_PIN)
+    sampler = None
+    if SENSOR_SAMPLING:
+        from sensor_sampler import SensorSampler
+        sampler = SensorSampler(line_sensors)
     control_unit = ControlUnit(
-        LineSensors(),
+        line_sensors,
         Motors(),
         ObstacleSensor(),
-        Lights()
+        Lights(),
+        battery_monitor=battery_monitor,
+        **CONTROL_UNIT
     )
-    robot = Robot(control_unit, navigation)
-    battery = Battery()
+    turn_predictor = None
+    if TURN_PREDICTION:
+        from turn_predictor import TurnPredictor
+        turn_predictor = TurnPredictor(control_unit)
+    renderer = DisplayRenderer(display)
+    telemetry = None
+    if TELEMETRY:
+        from telemetry import Telemetry
+        telemetry = Telemetry(names=Robot.STATE_NAMES)
+    robot = Robot(control_unit, navigation, renderer, telemetry, log_states=LOG_STATE_CHANGES, **ROBOT)
 
-    while not battery.ok():
-        print("Battery is not ok. Stopping the robot.")
-        robot.stop()
-        display.show("LOW BATTERY " + str(battery.get_voltage()) + "V")
-        sleep(1)
+    profiler = None
+    if PROFILE:
+        from profiler import Profiler
+        profiler = Profiler()
+        profiler.attach(robot)
+    recorder = None
+    if RECORD_TRACE:
+        from trace_recorder import TraceRecorder
+        recorder = TraceRecorder()
+        recorder.attach(robot)
+    runtime = None
+    if USE_ASYNCIO:
+        # Built before the robot starts, it rejects the sampler and the predictor right at boot
+        from runtime import AsyncRuntime
+        runtime = AsyncRuntime(robot, battery_monitor, renderer, button_b)
+
+    def should_stop():
+        # Button B ends the run, a battery sagging to the critical level cuts it off
+        if button_b.was_pressed():
+            if recorder is not None:
+                recorder.button(TraceRecorder.BUTTON_B)
+            return True
+        return battery_monitor.critical()
 
     try:
         robot.start()
 
+        # Time since power-on, so on a cold boot the boot-to-ready time including the imports
+        gc.collect()
+        report = "Ready after " + str(monotonic_ns() // 1_000_000) + " ms"
+        if hasattr(gc, "mem_free"):  # Missing on CPython, e.g. in the simulator
+            report += ", free heap " + str(gc.mem_free()) + " bytes"
+        print(report)
         print("Press button A to start the robot.")
         while not button_a.was_pressed():
             sleep(0.1)
+        if recorder is not None:
+            recorder.button(TraceRecorder.BUTTON_A)
 
-        # Main loop – note there is only one sleep call here.
-        while not button_b.was_pressed():
-            robot.drive()
-            sleep(0.02)  # This sleep maintains a fixed update rate.
+        if runtime is not None:
+            runtime.run()
+        else:
+            # Main loop – the scheduler sleeps only for what is left of each 20 ms period,
+            # the display is drawn in that slack so it never delays a control tick.
+            scheduler = LoopScheduler(rate_hz=50, overrun_policy=LoopScheduler.SKIP)
+            idle = renderer.service
+            if sampler is not None or turn_predictor is not None:
+                # The turn predictor polls at the end of a turn, the sampler takes the rest of the slack
+                def idle(deadline):
+                    renderer.service(deadline)
+                    if turn_predictor is not None:
+                        turn_predictor.service(deadline)
+                    if sampler is not None:
+                        sampler.service(deadline)
+            scheduler.run(robot.drive, should_stop, idle)
 
-        robot.stop()
+            robot.stop()
+            scheduler.print_report()
+            if battery_monitor.critical():
+                print("Battery is not ok. Stopped the robot.")
+                renderer.show_blocking("LOW BATTERY " + str(battery_monitor.millivolts() / 1000) + "V")
+        print("Battery: " + str(battery_monitor.stats()))
+        if sampler is not None:
+            print("Sensor sampler: " + str(sampler.stats()))
+        if turn_predictor is not None:
+            print("Turn predictor: " + str(turn_predictor.stats()))
+
+        if profiler is not None:
+            profiler.print_report()
+        # Written only now, a dump during the run would distort its timing
+        if telemetry is not None:
+            telemetry.save()
+        if recorder is not None:
+            recorder.save()
     except Exception as e:
         print("An error occurred. Stopping the robot.")
         print("Error details:")
+        import traceback
         traceback.print_exception(e)  # Print full stack trace using MicroPython's method
         robot.stop()
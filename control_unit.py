@@ -1,17 +1,74 @@
+from micropython import const
 from motors import Motors
+from line_sensors import LineSensors
+from i2c_bus import shared_bus
+
+# Movement commands, used as indexes of ControlUnit's command handlers
+_COMMAND_FORWARD = const(0)
+_COMMAND_LEFT = const(1)
+_COMMAND_RIGHT = const(2)
+_COMMAND_FINISH = const(3)
+_COMMAND_BREAK = const(4)
+
+# Line following controllers
+_CONTROLLER_BANG_BANG = const(0)
+_CONTROLLER_PROPORTIONAL = const(1)
+# Line position error once the line is lost beyond an outer sensor, the errors range from -_ERROR_MAX to _ERROR_MAX
+_ERROR_MAX = const(3)
+_ERRORS = const(7)
+
+
 class ControlUnit:
     """
     Controls the robot's movement and behavior based on sensor inputs and commands.
     Manages motor control, line following, and obstacle avoidance.
+
+    Commands are small integers dispatched through a table of bound handlers. The
+    scaled duties are precomputed whenever the speed scale changes, line following
+    looks its (left, right) duty pair up by the sensor flags. The tables hold the
+    duties at nominal voltage, the battery compensation is applied to each duty as
+    it is looked up, so a new battery level costs the tick a few integer operations.
+
+    Two controllers follow the line. BANG_BANG slows the inner wheel whenever an
+    outer sensor sees the line and keeps the duties while no sensor does. PROPORTIONAL
+    turns the sensors into a signed line position error, negative left of the center,
+    and steers by gain_p times the error plus gain_d times its change since the
+    previous tick, slowing down by curve_slowdown per unit of error. When the line is
+    lost the error saturates on the side it was last seen. The duty pairs of every
+    (error, previous error) combination are precomputed with the other duties.
     """
-    COMMAND_FORWARD = "forward"
-    COMMAND_LEFT = "left"
-    COMMAND_RIGHT = "right"
-    COMMAND_FINISH = "finish"
-    COMMAND_BREAK = "break"
+    COMMAND_FORWARD = _COMMAND_FORWARD
+    COMMAND_LEFT = _COMMAND_LEFT
+    COMMAND_RIGHT = _COMMAND_RIGHT
+    COMMAND_FINISH = _COMMAND_FINISH
+    COMMAND_BREAK = _COMMAND_BREAK
+    BANG_BANG = _CONTROLLER_BANG_BANG
+    PROPORTIONAL = _CONTROLLER_PROPORTIONAL
     SPEED_MULTIPLIER = 1
 
-    def __init__(self, line_sensors, motors, obstacle_sensor, lights):
+    # Nominal duty cycles
+    DUTY_SLOW = 30
+    DUTY_CRUISE = 90
+    DUTY_TURN = 110
+    # Duty below which the wheels do not turn, the battery compensation scales the duty above it
+    DUTY_DEADBAND = 20
+    # Sensor flags deciding the line following duties
+    STEERING_MASK = LineSensors.LEFT | LineSensors.CENTER | LineSensors.RIGHT
+    # Line position error of the steering sensor flags, None without a line
+    LINE_ERRORS = (None, -2, 0, -1, 2, 0, 1, 0)
+    # Proportional controller gains in nominal duty per unit of error
+    GAIN_P = 16
+    GAIN_D = 24
+    CURVE_SLOWDOWN = 15
+
+    __slots__ = ("line_sensors", "motors", "obstacle_sensor", "lights", "bus", "battery_monitor", "duties",
+                 "base_scale", "speed_scale", "battery_scale", "deadband", "flush_lights", "sample_battery", "handlers",
+                 "steering", "turn_duty", "controller", "gains", "follow_duties", "line_error", "turn_predictor")
+
+    def __init__(self, line_sensors, motors, obstacle_sensor, lights, bus=None, battery_monitor=None,
+                 speed_multiplier=SPEED_MULTIPLIER, duty_slow=DUTY_SLOW, duty_cruise=DUTY_CRUISE, duty_turn=DUTY_TURN,
+                 duty_deadband=DUTY_DEADBAND, controller=BANG_BANG, gain_p=GAIN_P, gain_d=GAIN_D,
+                 curve_slowdown=CURVE_SLOWDOWN):
         """
         Initialize the control unit with required sensors and actuators.
 
@@ -20,11 +77,52 @@ class ControlUnit:
             motors: Motor control interface
             obstacle_sensor: Obstacle detection interface
             lights: Light control interface
+            bus: I2CBus held for the whole tick, the shared bus when omitted
+            battery_monitor: BatteryMonitor sampled during the run, its speed scale compensates the voltage
+            speed_multiplier: Factor applied to every duty cycle
+            duty_slow: Nominal duty of the inner wheel when steering back to the line
+            duty_cruise: Nominal duty when following the line
+            duty_turn: Nominal duty of both wheels turning on the spot
+            duty_deadband: Duty below which the wheels do not turn
+            controller: Line following controller, BANG_BANG or PROPORTIONAL
+            gain_p: Proportional controller's duty difference per unit of line position error
+            gain_d: Proportional controller's duty difference per unit of error change between ticks
+            curve_slowdown: Proportional controller's cruise duty reduction per unit of error
         """
+        if controller not in (_CONTROLLER_BANG_BANG, _CONTROLLER_PROPORTIONAL):
+            raise ValueError("Unknown line following controller")
         self.line_sensors = line_sensors
         self.motors = motors
         self.obstacle_sensor = obstacle_sensor
         self.lights = lights
+        self.bus = shared_bus() if bus is None else bus
+        self.battery_monitor = battery_monitor
+        # The light frame is sent at the end of every tick unless another task refreshes it
+        self.flush_lights = True
+        # The battery is sampled at the start of a tick unless another task samples it
+        self.sample_battery = True
+        # Command handlers indexed by command, bound once so dispatching allocates nothing
+        self.handlers = (
+            self.__follow_line if controller == _CONTROLLER_PROPORTIONAL else self.__move_forward,
+            self.__turn_left,
+            self.__turn_right,
+            self.__finish,
+            self.__break,
+        )
+        self.steering = None
+        self.follow_duties = None
+        self.line_error = 0
+        self.turn_duty = 0
+        # Set by a TurnPredictor attached to this control unit, it decides the turn duties
+        self.turn_predictor = None
+        self.controller = controller
+        self.duties = (duty_slow, duty_cruise, duty_turn)
+        self.gains = (gain_p, gain_d, curve_slowdown)
+        self.deadband = duty_deadband
+        # Duty scale and battery compensation in 1/256 steps
+        self.base_scale = int(speed_multiplier * 256)
+        self.battery_scale = 256
+        self.set_speed_scale(self.base_scale)
 
     def initialize(self):
         """
@@ -32,6 +130,35 @@ class ControlUnit:
         """
         self.motors.initialize_motors()
 
+    def begin_tick(self):
+        """
+        Prepare the sensors for a new control tick.
+        Takes the I2C bus for the whole tick, end_tick() releases it.
+        """
+        monitor = self.battery_monitor
+        if monitor is not None:
+            if self.sample_battery:
+                monitor.update()
+            self.battery_scale = monitor.speed_scale
+        self.bus.begin()
+        try:
+            self.line_sensors.begin_tick()
+        except Exception:
+            self.bus.end()
+            raise
+
+    def end_tick(self):
+        """
+        Send the motor commands and the light frame staged during the tick
+        and release the I2C bus.
+        """
+        try:
+            self.motors.flush()
+        finally:
+            self.bus.end()
+        if self.flush_lights:
+            self.lights.flush()
+
     def is_obstacle(self):
         """
         Check if an obstacle is detected.
@@ -46,23 +173,25 @@ class ControlUnit:
         Execute a movement command based on the given command.
 
         Args:
-            command: The movement command to execute
+            command: The movement command to execute, one of the COMMAND_ IDs
         """
-        if command != ControlUnit.COMMAND_BREAK:
+        if command != _COMMAND_BREAK:
             self.lights.break_off()
+        self.handlers[command]()
 
-        if command == ControlUnit.COMMAND_FORWARD:
-            self.__move_forward()
-        elif command == ControlUnit.COMMAND_LEFT:
-            self.__turn_left()
-        elif command == ControlUnit.COMMAND_RIGHT:
-            self.__turn_right()
-        elif command == ControlUnit.COMMAND_FINISH:
-            self.stop()
-            self.lights.blink_all()
-        elif command == ControlUnit.COMMAND_BREAK:
-            self.lights.break_on()
-            self.stop()
+    def line_lost(self):
+        """
+        Keep moving while no sensor sees the line. The bang-bang controller keeps the
+        duties of the previous tick, the proportional one steers towards the side the
+        line was lost on.
+        """
+        if self.controller == _CONTROLLER_PROPORTIONAL:
+            self.__follow_line()
+        elif self.motors.stopped():
+            # Standing, after a break or at the start, there are no duties to keep: drive straight on
+            duties = self.steering[LineSensors.CENTER]
+            self.motors.move(Motors.LEFT, Motors.FORWARD, self.compensate(duties[0]))
+            self.motors.move(Motors.RIGHT, Motors.FORWARD, self.compensate(duties[1]))
 
     def stop(self):
         """
@@ -70,21 +199,39 @@ class ControlUnit:
         """
         self.motors.stop()
 
+    def __finish(self):
+        """
+        Stand still and blink all indicators.
+        """
+        self.stop()
+        self.lights.blink_all()
+
+    def __break(self):
+        """
+        Stop with the brake lights on.
+        """
+        self.lights.break_on()
+        self.stop()
+
     def __turn_left(self):
         """
         Execute a left turn maneuver.
         """
         self.lights.indicate_left()
-        self.motors.move(Motors.LEFT, Motors.BACKWARD, self.speed(110))
-        self.motors.move(Motors.RIGHT, Motors.FORWARD, self.speed(110))
+        self.line_error = 0
+        duty = self.compensate(self.turn_duty) if self.turn_predictor is None else self.turn_predictor.duty()
+        self.motors.move(Motors.LEFT, Motors.BACKWARD, duty)
+        self.motors.move(Motors.RIGHT, Motors.FORWARD, duty)
 
     def __turn_right(self):
         """
         Execute a right turn maneuver.
         """
         self.lights.indicate_right()
-        self.motors.move(Motors.LEFT, Motors.FORWARD, self.speed(110))
-        self.motors.move(Motors.RIGHT, Motors.BACKWARD, self.speed(110))
+        self.line_error = 0
+        duty = self.compensate(self.turn_duty) if self.turn_predictor is None else self.turn_predictor.duty()
+        self.motors.move(Motors.LEFT, Motors.FORWARD, duty)
+        self.motors.move(Motors.RIGHT, Motors.BACKWARD, duty)
 
     def __move_forward(self):
         """
@@ -92,16 +239,116 @@ class ControlUnit:
         Adjusts motor speeds based on line sensor readings.
         """
         self.lights.turn_off()
-        line_sensors = self.line_sensors.get_state()
-        if line_sensors["left"]:
-            self.motors.move(Motors.LEFT, Motors.FORWARD, self.speed(30))
-            self.motors.move(Motors.RIGHT, Motors.FORWARD, self.speed(90))
-        elif line_sensors["right"]:
-            self.motors.move(Motors.LEFT, Motors.FORWARD, self.speed(90))
-            self.motors.move(Motors.RIGHT, Motors.FORWARD, self.speed(30))
-        elif line_sensors["center"]:
-            self.motors.move(Motors.LEFT, Motors.FORWARD, self.speed(90))
-            self.motors.move(Motors.RIGHT, Motors.FORWARD, self.speed(90))
+        duties = self.steering[self.line_sensors.get_flags() & ControlUnit.STEERING_MASK]
+        if duties is not None:
+            self.motors.move(Motors.LEFT, Motors.FORWARD, self.compensate(duties[0]))
+            self.motors.move(Motors.RIGHT, Motors.FORWARD, self.compensate(duties[1]))
+
+    def __follow_line(self):
+        """
+        Execute forward movement with the proportional line following controller.
+        Looks the duties up by the line position error and the previous tick's error.
+        """
+        self.lights.turn_off()
+        error = ControlUnit.LINE_ERRORS[self.line_sensors.get_flags() & ControlUnit.STEERING_MASK]
+        previous = self.line_error
+        if error is None:
+            # The line is beyond the outer sensor that saw it last, straight on if that was the center one
+            if previous < 0:
+                error = -_ERROR_MAX
+            elif previous > 0:
+                error = _ERROR_MAX
+            else:
+                error = 0
+        duties = self.follow_duties[(error + _ERROR_MAX) * _ERRORS + previous + _ERROR_MAX]
+        self.line_error = error
+        left = self.__compensated(duties[0])
+        right = self.__compensated(duties[1])
+        # Keep the difference when the outer wheel saturates, slow the inner one instead
+        excess = (left if left > right else right) - 255
+        if excess > 0:
+            left = left - excess if left > excess else 0
+            right = right - excess if right > excess else 0
+        self.motors.move(Motors.LEFT, Motors.FORWARD, left)
+        self.motors.move(Motors.RIGHT, Motors.FORWARD, right)
+
+    def set_speed_scale(self, scale):
+        """
+        Change the duty scale and precompute the duties of every movement at nominal
+        voltage. Called outside the control tick, a battery level change does not
+        rebuild the tables.
+
+        Args:
+            scale: Duty scale in 1/256 steps
+        """
+        self.speed_scale = scale
+        slow = self.__scaled(self.duties[0])
+        cruise = self.__scaled(self.duties[1])
+        steering = []
+        for flags in range(ControlUnit.STEERING_MASK + 1):
+            if flags & LineSensors.LEFT:
+                steering.append((slow, cruise))
+            elif flags & LineSensors.RIGHT:
+                steering.append((cruise, slow))
+            elif flags & LineSensors.CENTER:
+                steering.append((cruise, cruise))
+            else:
+                steering.append(None)
+        self.steering = tuple(steering)
+        self.turn_duty = self.__scaled(self.duties[2])
+        if self.controller == _CONTROLLER_PROPORTIONAL:
+            gain_p, gain_d, curve_slowdown = self.gains
+            follow_duties = []
+            for error in range(-_ERROR_MAX, _ERROR_MAX + 1):
+                for previous in range(-_ERROR_MAX, _ERROR_MAX + 1):
+                    base = self.duties[1] - curve_slowdown * abs(error)
+                    # Positive corrections steer right, the line is right of the center
+                    correction = gain_p * error + gain_d * (error - previous)
+                    # Not capped, __follow_line caps the pair once it is compensated
+                    follow_duties.append((self.__scaled(base + correction), self.__scaled(base - correction)))
+            self.follow_duties = tuple(follow_duties)
 
     def speed(self, speed):
-        return int(speed * ControlUnit.SPEED_MULTIPLIER)
+        """
+        Scale a nominal duty cycle, compensating the battery voltage when monitored.
+
+        Args:
+            speed: Duty cycle at nominal voltage (0-255)
+
+        Returns:
+            int: Duty cycle to send to the motors
+        """
+        return self.compensate(self.__scaled(speed))
+
+    def compensate(self, duty):
+        """
+        Compensate a scaled duty from the precomputed tables for the battery voltage.
+
+        Args:
+            duty: Duty cycle scaled by the speed scale at nominal voltage
+
+        Returns:
+            int: Duty cycle to send to the motors
+        """
+        duty = self.__compensated(duty)
+        return duty if duty < 255 else 255
+
+    def __scaled(self, speed):
+        """
+        Returns the duty for a nominal duty scaled by the speed scale, not compensated.
+        """
+        return max(0, int(speed * self.speed_scale)) >> 8
+
+    def __compensated(self, duty):
+        """
+        Returns a scaled duty compensated for the battery voltage but not capped.
+
+        The wheel speed grows with the duty above the deadband times the battery voltage,
+        so only that part is compensated, rounded to the nearest duty. Scaling the whole
+        duty would overcompensate a low battery and undercompensate a full one, the slow
+        inner wheel most of all.
+        """
+        deadband = self.deadband
+        if duty > deadband:
+            duty = deadband + (((duty - deadband) * self.battery_scale + 128) >> 8)
+        return duty
@@ -0,0 +1,104 @@
+from time import monotonic_ns, sleep
+
+class DisplayRenderer:
+    """
+    Draws text on the LED matrix in small slices between control ticks.
+
+    request() only records the latest content, so it is cheap enough to call from the
+    control tick. service() draws at most one character per call instead of letting
+    display.show() scroll the whole text in one blocking call. Content replaced before
+    it was drawn is dropped, longer text loops with a blank gap after the last character.
+    """
+    CHARACTER_MS = 350  # How long each character stays on the matrix
+
+    def __init__(self, display, character_ms=CHARACTER_MS):
+        """
+        Initialize the renderer.
+
+        Args:
+            display: Pico:ed display to draw on
+            character_ms: Milliseconds each character is shown
+        """
+        self.display = display
+        self.character_ns = character_ms * 1_000_000
+        self.content = None
+        self.position = 0
+        self.passes = 0  # Completed passes over the current content
+        self.done = True
+        self.next_frame = 0
+        self.draw_ns = 0  # Cost of the last frame, used to decide whether the next one fits
+        self.frames = 0
+        self.dropped = 0
+
+    def request(self, content):
+        """
+        Ask for content to be shown. Does not draw anything.
+
+        Args:
+            content: Text to show, replaces whatever was requested before
+        """
+        if content == self.content:
+            return
+        if self.passes == 0 and self.position == 0 and not self.done:
+            # The previous content never made it onto the matrix
+            self.dropped += 1
+        self.content = content
+        self.position = 0
+        self.passes = 0
+        self.done = False
+        self.next_frame = 0
+
+    def service(self, deadline=None):
+        """
+        Draw the next frame of the requested content if it is due.
+
+        Args:
+            deadline: monotonic_ns() time the frame has to be finished by, None for no limit
+
+        Returns:
+            bool: True if a frame was drawn
+        """
+        if self.done:
+            return False
+        now = monotonic_ns()
+        if now < self.next_frame:
+            return False
+        if deadline is not None and now + self.draw_ns > deadline:
+            return False
+
+        content = self.content
+        if self.position < len(content):
+            self.display.show(content[self.position])
+            self.position += 1
+        else:
+            self.display.clear()
+            self.position = 0
+        if self.position == 0 or (len(content) <= 1 and self.position == len(content)):
+            self.passes += 1
+            # A single character stays on the matrix, nothing left to draw
+            self.done = len(content) <= 1
+
+        end = monotonic_ns()
+        self.draw_ns = end - now
+        self.next_frame = now + self.character_ns
+        self.frames += 1
+        return True
+
+    def show_blocking(self, content):
+        """
+        Show content once from start to end, returning when it was drawn completely.
+        Only for when the robot is not driving.
+
+        Args:
+            content: Text to show
+        """
+        self.request(content)
+        self.position = 0
+        self.passes = 0
+        self.done = False
+        self.next_frame = 0
+        while self.passes == 0:
+            self.service()
+            slack = self.next_frame - monotonic_ns()
+            if slack > 0:
+                sleep(slack / 1_000_000_000)
@@ -0,0 +1,211 @@
+from picoed import i2c # type: ignore
+from time import monotonic_ns
+
+class I2CBusError(RuntimeError):
+    """
+    Raised when the I2C bus cannot be locked in time.
+    """
+
+
+class I2CBus:
+    """
+    Owns the shared I2C handle for all devices of the robot.
+
+    Every transaction takes the bus lock with a bounded timeout and is retried when
+    the device does not acknowledge. Between begin() and end() the lock is held
+    once for all transactions, so a control tick costs a single lock cycle.
+    Transactions that need not run right away are queued with queue_read() and
+    queue_write() into preallocated slots, flush() runs them in order under one
+    lock hold. Transactions and errors are counted per device address.
+    """
+    LOCK_TIMEOUT_MS = 100
+    RETRIES = 2
+    QUEUE_SIZE = 8
+
+    def __init__(self, handle=None, lock_timeout_ms=LOCK_TIMEOUT_MS, retries=RETRIES, queue_size=QUEUE_SIZE):
+        """
+        Initialize the bus manager.
+
+        Args:
+            handle: busio.I2C compatible bus, picoed.i2c when omitted
+            lock_timeout_ms: Milliseconds to wait for the lock before giving up
+            retries: How often a transaction is repeated after a NACK
+            queue_size: How many transactions can be queued before flush()
+        """
+        self.i2c = i2c if handle is None else handle
+        self.lock_timeout_ns = lock_timeout_ms * 1_000_000
+        self.retries = retries
+        self.depth = 0  # Nesting level of begin()
+        self.lock_cycles = 0
+        self.transactions = {}
+        self.errors = {}
+        # Queued transactions: address, buffer, start, end and whether it is a read, per slot
+        self.queue_addresses = [0] * queue_size
+        self.queue_buffers = [None] * queue_size
+        self.queue_starts = [0] * queue_size
+        self.queue_ends = [0] * queue_size
+        self.queue_reads = [False] * queue_size
+        self.queued = 0
+
+    def begin(self):
+        """
+        Take the lock for a batch of transactions, e.g. for a whole control tick.
+        Batches nest, the lock is released by the outermost end().
+        """
+        if self.depth == 0:
+            self.__acquire()
+        self.depth += 1
+
+    def end(self):
+        """
+        Finish a batch started by begin().
+        """
+        if self.depth == 0:
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            self.i2c.unlock()
+
+    def read_into(self, address, buffer, start=0, end=None):
+        """
+        Read from a device into a buffer.
+
+        Args:
+            address: 7 bit device address
+            buffer: Buffer receiving the bytes
+            start: First index of the buffer to fill
+            end: Index after the last one to fill, the end of the buffer when omitted
+        """
+        self.__transfer(address, buffer, start, len(buffer) if end is None else end, True)
+
+    def write(self, address, data):
+        """
+        Write bytes to a device.
+
+        Args:
+            address: 7 bit device address
+            data: Bytes to write, the first one usually selects the register
+        """
+        self.__transfer(address, data, 0, len(data), False)
+
+    def queue_read(self, address, buffer, start=0, end=None):
+        """
+        Queue a read from a device into a buffer, flush() runs it.
+        The buffer must stay untouched until then.
+
+        Args:
+            address: 7 bit device address
+            buffer: Buffer receiving the bytes
+            start: First index of the buffer to fill
+            end: Index after the last one to fill, the end of the buffer when omitted
+        """
+        self.__enqueue(address, buffer, start, len(buffer) if end is None else end, True)
+
+    def queue_write(self, address, data):
+        """
+        Queue a write to a device, flush() runs it.
+        The data is sent as it is at the time of the flush.
+
+        Args:
+            address: 7 bit device address
+            data: Bytes to write, the first one usually selects the register
+        """
+        self.__enqueue(address, data, 0, len(data), False)
+
+    def flush(self):
+        """
+        Run the queued transactions in order under one lock hold, no further lock cycle
+        inside a batch. The queue is emptied even if a transaction fails, the bus error
+        is raised after that.
+        """
+        count = self.queued
+        if count == 0:
+            return
+        self.begin()
+        try:
+            for index in range(count):
+                self.__transfer(self.queue_addresses[index], self.queue_buffers[index], self.queue_starts[index],
+                                self.queue_ends[index], self.queue_reads[index])
+        finally:
+            for index in range(count):
+                self.queue_buffers[index] = None
+            self.queued = 0
+            self.end()
+
+    def __enqueue(self, address, buffer, start, end, read):
+        """
+        Store a transaction in the next free queue slot.
+        """
+        index = self.queued
+        if index == len(self.queue_addresses):
+            raise I2CBusError("I2C transaction queue full")
+        self.queue_addresses[index] = address
+        self.queue_buffers[index] = buffer
+        self.queue_starts[index] = start
+        self.queue_ends[index] = end
+        self.queue_reads[index] = read
+        self.queued = index + 1
+
+    def __transfer(self, address, buffer, start, end, read):
+        """
+        Run one transaction, repeating it when the device does not acknowledge.
+        Raises the bus error once the retries are used up.
+        """
+        self.begin()
+        try:
+            attempt = 0
+            while True:
+                self.transactions[address] = self.transactions.get(address, 0) + 1
+                try:
+                    if read:
+                        self.i2c.readfrom_into(address, buffer, start=start, end=end)
+                    else:
+                        self.i2c.writeto(address, buffer, start=start, end=end)
+                    return
+                except OSError:
+                    # CircuitPython reports a missing acknowledge as an OSError
+                    self.errors[address] = self.errors.get(address, 0) + 1
+                    if attempt >= self.retries:
+                        raise
+                    attempt += 1
+        finally:
+            self.end()
+
+    def __acquire(self):
+        """
+        Take the bus lock, waiting at most the lock timeout.
+        """
+        self.lock_cycles += 1
+        if self.i2c.try_lock():
+            return
+        deadline = monotonic_ns() + self.lock_timeout_ns
+        while not self.i2c.try_lock():
+            if monotonic_ns() >= deadline:
+                raise I2CBusError("I2C bus lock not acquired within " + str(self.lock_timeout_ns // 1_000_000) + " ms")
+
+    def stats(self):
+        """
+        Get the bus statistics.
+
+        Returns:
+            dict: Lock cycles, and transactions and errors per device address
+        """
+        return {
+            "lock_cycles": self.lock_cycles,
+            "transactions": dict(self.transactions),
+            "errors": dict(self.errors),
+        }
+
+
+# Bus manager shared by all devices unless they are given their own
+BUS = None
+
+
+def shared_bus():
+    """
+    Returns the bus manager of picoed.i2c, created on first use.
+    """
+    global BUS
+    if BUS is None:
+        BUS = I2CBus()
+    return BUS
@@ -1,11 +1,50 @@
 from neopixel import NeoPixel
-from duration import Duration
+from timers import shared_timers, ticks_add, ticks_diff
 from board import P0
 
+PIXELS = 8
+COLOR_ORANGE = (255, 100, 0)
+COLOR_OFF = (0, 0, 0)
+COLOR_RED = (100, 0, 0)
+
+
+def frame(color, positions):
+    """
+    Build one animation frame: color on the given pixels, transparent everywhere else.
+
+    Args:
+        color: Color of the pixels
+        positions: Pixel indexes the frame lights
+
+    Returns:
+        tuple: One color or None (transparent) per pixel
+    """
+    return tuple(color if position in positions else None for position in range(PIXELS))
+
+
+def pattern(*steps):
+    """
+    Build a looping light pattern.
+
+    Args:
+        steps: (frame, hold ms) pairs, a hold of 0 keeps the frame forever
+
+    Returns:
+        tuple: (frame, hold ms) pairs
+    """
+    return tuple(steps)
+
+
 class Lights:
     """
     Manages the robot's LED lighting system, including indicators and brake lights.
     Controls individual LEDs through the NeoPixel interface.
+
+    Lights are driven by patterns: precomputed frame tables with a hold time per
+    frame, advanced from the tick timestamp. Every layer plays one pattern, higher
+    layers cover lower ones wherever their frame is not transparent, so the brake
+    lights stay on while an indicator blinks. flush() composes the frame only after
+    a layer changed and writes only the pixels that differ from what is displayed.
     """
     INDICATOR_LEFT_FORWARD = 3
     INDICATOR_LEFT_REVERSE = 6
@@ -13,128 +52,168 @@ class Lights:
     INDICATOR_RIGHT_REVERSE = 5
     BREAK_LEFT = 7
     BREAK_RIGHT = 4
-    DURATION_SECONDS = 0.5
+    BLINK_MS = 500
+
+    INDICATORS_LEFT = (INDICATOR_LEFT_FORWARD, INDICATOR_LEFT_REVERSE)
+    INDICATORS_RIGHT = (INDICATOR_RIGHT_FORWARD, INDICATOR_RIGHT_REVERSE)
+    INDICATORS_ALL = INDICATORS_LEFT + INDICATORS_RIGHT
+
+    # Patterns, lit frame first
+    PATTERN_LEFT = pattern(
+        (frame(COLOR_ORANGE, INDICATORS_LEFT), BLINK_MS),
+        (frame(COLOR_OFF, INDICATORS_LEFT), BLINK_MS),
+    )
+    PATTERN_RIGHT = pattern(
+        (frame(COLOR_ORANGE, INDICATORS_RIGHT), BLINK_MS),
+        (frame(COLOR_OFF, INDICATORS_RIGHT), BLINK_MS),
+    )
+    PATTERN_HAZARD = pattern(
+        (frame(COLOR_ORANGE, INDICATORS_ALL), BLINK_MS),
+        (frame(COLOR_OFF, INDICATORS_ALL), BLINK_MS),
+    )
+    PATTERN_BRAKE = pattern(
+        (frame(COLOR_RED, (BREAK_LEFT, BREAK_RIGHT)), 0),
+    )
 
-    def __init__(self):
+    # Layers from bottom to top
+    LAYER_BRAKE = 0
+    LAYER_INDICATORS = 1
+    LAYERS = 2
+
+    NEVER = -1
+
+    __slots__ = ("neopixel", "timers", "patterns", "indexes", "deadlines", "next_change", "shown", "dirty",
+                 "refreshes")
+
+    def __init__(self, timers=None):
         """
         Initialize the lighting system with NeoPixel control.
-        """
-        self.neopixel = NeoPixel(P0, 8)
-        self.left_forward = Light(Lights.INDICATOR_LEFT_FORWARD, self.neopixel, Light.COLOR_ORANGE)
-        self.left_reverse = Light(Lights.INDICATOR_LEFT_REVERSE, self.neopixel, Light.COLOR_ORANGE)
-        self.right_forward = Light(Lights.INDICATOR_RIGHT_FORWARD, self.neopixel, Light.COLOR_ORANGE)
-        self.right_reverse = Light(Lights.INDICATOR_RIGHT_REVERSE, self.neopixel, Light.COLOR_ORANGE)
-        self.break_left = Light(Lights.BREAK_LEFT, self.neopixel, Light.COLOR_RED)
-        self.break_right = Light(Lights.BREAK_RIGHT, self.neopixel, Light.COLOR_RED)
-        self.duration = None
-        self.mode = None
-        self.lights_on = False
-
-    def __toggle_indicators(self, left_on, right_on):
-        """
-        Toggle the state of the indicator lights.
-        
+
         Args:
-            left_on: Whether to turn on the left indicators
-            right_on: Whether to turn on the right indicators
+            timers: TimerService whose tick timestamp advances the patterns, the shared one when omitted
+        """
+        self.neopixel = NeoPixel(P0, PIXELS, auto_write=False)
+        self.timers = shared_timers() if timers is None else timers
+        self.patterns = [None] * Lights.LAYERS
+        self.indexes = [0] * Lights.LAYERS
+        self.deadlines = [Lights.NEVER] * Lights.LAYERS
+        self.next_change = Lights.NEVER
+        # None until the pixel was displayed, so the first frame is always sent
+        self.shown = [None] * PIXELS
+        self.dirty = True
+        self.refreshes = 0
+
+    def play(self, layer, pattern):
         """
-        if left_on:
-            self.left_forward.on()
-            self.left_reverse.on()
-        else:
-            self.left_forward.off()
-            self.left_reverse.off()
+        Play a pattern on a layer from its first frame.
+        Does nothing if the layer already plays the pattern.
 
-        if right_on:
-            self.right_forward.on()
-            self.right_reverse.on()
+        Args:
+            layer: Layer index
+            pattern: Pattern built by pattern(), None to clear the layer
+        """
+        if self.patterns[layer] is pattern:
+            return
+        self.patterns[layer] = pattern
+        self.indexes[layer] = 0
+        if pattern is None or pattern[0][1] == 0:
+            self.deadlines[layer] = Lights.NEVER
         else:
-            self.right_forward.off()
-            self.right_reverse.off()
+            self.deadlines[layer] = ticks_add(self.timers.now, pattern[0][1])
+        self.dirty = True
+        self.__schedule()
+
+    def flush(self):
+        """
+        Advance the patterns and send the frame to the NeoPixels if it changed.
+        """
+        now = self.timers.now
+        if self.next_change != Lights.NEVER and ticks_diff(now, self.next_change) >= 0:
+            self.__advance(now)
+        if not self.dirty:
+            return
+        self.dirty = False
+        changed = False
+        patterns = self.patterns
+        for pixel in range(PIXELS):
+            color = COLOR_OFF
+            for layer in range(Lights.LAYERS):
+                pattern = patterns[layer]
+                if pattern is not None:
+                    value = pattern[self.indexes[layer]][0][pixel]
+                    if value is not None:
+                        color = value
+            if color != self.shown[pixel]:
+                self.neopixel[pixel] = color
+                self.shown[pixel] = color
+                changed = True
+        if changed:
+            self.neopixel.write()
+            self.refreshes += 1
+
+    def __advance(self, now):
+        """
+        Move every layer whose frame is over to its next frame, staying on the pattern's time grid.
+        """
+        for layer in range(Lights.LAYERS):
+            deadline = self.deadlines[layer]
+            if deadline == Lights.NEVER or ticks_diff(now, deadline) < 0:
+                continue
+            pattern = self.patterns[layer]
+            index = self.indexes[layer]
+            while deadline != Lights.NEVER and ticks_diff(now, deadline) >= 0:
+                index += 1
+                if index == len(pattern):
+                    index = 0
+                hold = pattern[index][1]
+                deadline = ticks_add(deadline, hold) if hold else Lights.NEVER
+            self.indexes[layer] = index
+            self.deadlines[layer] = deadline
+            self.dirty = True
+        self.__schedule()
+
+    def __schedule(self):
+        """
+        Find the earliest frame change of all layers.
+        """
+        next_change = Lights.NEVER
+        for deadline in self.deadlines:
+            if deadline != Lights.NEVER and (next_change == Lights.NEVER or ticks_diff(deadline, next_change) < 0):
+                next_change = deadline
+        self.next_change = next_change
 
     def indicate_left(self):
         """
         Activate the left turn indicators with blinking behavior.
         """
-        self.mode = 'left'
-        if self.duration is None or self.duration.done():
-            self.duration = Duration(Lights.DURATION_SECONDS)
-            self.lights_on = not self.lights_on
-            self.__toggle_indicators(self.lights_on, False)
+        self.play(Lights.LAYER_INDICATORS, Lights.PATTERN_LEFT)
 
     def indicate_right(self):
         """
         Activate the right turn indicators with blinking behavior.
         """
-        self.mode = 'right'
-        if self.duration is None or self.duration.done():
-            self.duration = Duration(Lights.DURATION_SECONDS)
-            self.lights_on = not self.lights_on
-            self.__toggle_indicators(False, self.lights_on)
+        self.play(Lights.LAYER_INDICATORS, Lights.PATTERN_RIGHT)
 
     def turn_off(self):
         """
         Turn off all indicator lights.
         """
-        self.mode = None
-        self.lights_on = False
-        self.__toggle_indicators(False, False)
+        self.play(Lights.LAYER_INDICATORS, None)
 
     def blink_all(self):
         """
         Blink all indicator lights simultaneously.
         """
-        self.mode = 'all'
-        if self.duration is None or self.duration.done():
-            self.duration = Duration(Lights.DURATION_SECONDS)
-            self.lights_on = not self.lights_on
-            self.__toggle_indicators(self.lights_on, self.lights_on)
+        self.play(Lights.LAYER_INDICATORS, Lights.PATTERN_HAZARD)
 
     def break_on(self):
         """
         Turn on the brake lights.
         """
-        self.break_left.on()
-        self.break_right.on()
+        self.play(Lights.LAYER_BRAKE, Lights.PATTERN_BRAKE)
 
     def break_off(self):
         """
         Turn off the brake lights.
         """
-        self.break_left.off()
-        self.break_right.off()
-
-class Light:
-    """
-    Represents a single LED with position and color control.
-    """
-    COLOR_ORANGE = (255, 100, 0)
-    COLOR_OFF = (0, 0, 0)
-    COLOR_RED = (100, 0, 0)
-
-    def __init__(self, position, neo, color):
-        """
-        Initialize a single LED.
-        
-        Args:
-            position: LED position in the NeoPixel array
-            neo: NeoPixel control interface
-            color: Default color for the LED
-        """
-        self.position = position
-        self.neo = neo
-        self.color = color
-
-    def on(self):
-        """
-        Turn on the LED with its configured color.
-        """
-        self.neo[self.position] = self.color
-        self.neo.write()
-
-    def off(self):
-        """
-        Turn off the LED.
-        """
-        self.neo[self.position] = Light.COLOR_OFF
-        self.neo.write()
+        self.play(Lights.LAYER_BRAKE, None)
@@ -1,98 +1,231 @@
-from picoed import i2c # type: ignore
+from i2c_bus import shared_bus
+
+# Bits of the raw 0x38 expander byte wired to the individual line sensors.
+RAW_LEFT = 0x04
+RAW_CENTER = 0x08
+RAW_RIGHT = 0x10
+
 
 class LineSensors:
     """
     Manages the line following sensors and provides methods to read and interpret their states.
     Handles I2C communication with the sensor hardware.
+
+    In snapshot mode the sensors are latched once per control tick by begin_tick()
+    and every predicate in that tick answers from the latched reading.
+
+    Readings are decoded through a precomputed table into bit flags, so the hot
+    path reads into a single reused buffer and allocates nothing.
+
+    With an interrupt pin the expander is only read after its INT output signalled
+    a change, counted by countio in the background. Otherwise the last byte is
+    served without touching the bus. The expander does not latch its inputs, so a
+    line crossing that came and went between two reads is counted in transients.
+
+    A SensorSampler can read the sensors between ticks and debounce them.
     """
+    # Decoded sensor flags
+    LEFT = 0x01
+    CENTER = 0x02
+    RIGHT = 0x04
+    INTERSECTION = 0x08
+    NO_LINE = 0x10
+    ADDRESS = 0x38
+
+    # Raw sensor byte -> decoded flags, filled in below the class
+    STATE_TABLE = b""
+
+    def __init__(self, snapshot=True, bus=None, interrupt_pin=None):
+        """
+        Initialize the line sensors.
+
+        Args:
+            snapshot: Serve all predicates within a tick from a single latched reading
+            bus: I2CBus the expander is on, the shared bus when omitted
+            interrupt_pin: Pin wired to the expander's INT output, None to read on every request
+        """
+        self.snapshot = snapshot
+        self.bus = shared_bus() if bus is None else bus
+        self.buffer = bytearray(1)
+        self.raw = 0  # Last raw byte read from the expander
+        self.latched = None
+        self.tick_reads = 0
+        self.last_tick_reads = 0
+        self.edges = None
+        self.edge_count = 0
+        self.cached = False
+        self.transients = 0
+        # SensorSampler debouncing the sensors between ticks, it attaches itself
+        self.sampler = None
+        if interrupt_pin is not None:
+            import countio # type: ignore
+            import digitalio # type: ignore
+            # INT is open drain and pulled low while the inputs differ from the last read
+            self.edges = countio.Counter(interrupt_pin, edge=countio.Edge.FALL, pull=digitalio.Pull.UP)
+
+    def begin_tick(self):
+        """
+        Start a new control tick.
+        Records the number of bus reads done by the previous tick and, in snapshot
+        mode, latches the sensors for the rest of this tick. With a sampler the
+        latched flags are the debounced ones.
+        """
+        self.last_tick_reads = self.tick_reads
+        self.tick_reads = 0
+        if self.sampler is not None:
+            self.latched = self.sampler.latch()
+        else:
+            self.latched = self.read_flags() if self.snapshot else None
+
+    def read_raw(self):
+        """
+        Read the raw sensor byte from the I2C device.
+        In interrupt mode the bus is only used when the expander signalled a change.
+
+        Returns:
+            int: The raw byte reported by the sensor expander
+        """
+        if self.edges is not None:
+            count = self.edges.count
+            if self.cached and count == self.edge_count:
+                return self.raw
+            previous = self.raw
+            self.__read()
+            if self.cached and self.raw == previous:
+                # INT fired but the inputs are back to what was read last time
+                self.transients += 1
+            self.edge_count = count
+            self.cached = True
+            return self.raw
+        self.__read()
+        return self.raw
+
+    def __read(self):
+        """
+        Read the expander over the bus into raw.
+        """
+        self.tick_reads += 1
+        self.bus.read_into(LineSensors.ADDRESS, self.buffer)
+        self.raw = self.buffer[0]
+
+    def read_flags(self):
+        """
+        Read the sensors and decode them into flags.
+
+        Returns:
+            int: Combination of the LEFT, CENTER, RIGHT, INTERSECTION and NO_LINE flags
+        """
+        return LineSensors.STATE_TABLE[self.read_raw()]
+
     def read(self):
         """
         Read the raw sensor values from the I2C device.
-        
+
         Returns:
             tuple: Three boolean values representing left, center, and right sensor states
         """
-        while not i2c.try_lock():
-            pass
-        try:
-            buffer = bytearray(1)
-            i2c.readfrom_into(0x38, buffer, start=0, end=1)
-            data_bit_string = self.byte_to_bits(buffer)
-            # Return three booleans corresponding to the left, center, and right sensors.
-            return bool(int(data_bit_string[7])), bool(int(data_bit_string[6])), bool(int(data_bit_string[5]))
-        finally:
-            i2c.unlock()
-
-    def byte_to_bits(self, buffer):
-        """
-        Convert a byte buffer to a binary string representation.
-        
-        Args:
-            buffer: Byte buffer to convert
-            
+        flags = self.read_flags()
+        return bool(flags & LineSensors.LEFT), bool(flags & LineSensors.CENTER), bool(flags & LineSensors.RIGHT)
+
+    def get_flags(self):
+        """
+        Get the decoded sensor flags for the current tick.
+
         Returns:
-            str: Binary string representation of the byte
+            int: The latched flags if available, otherwise the flags of a fresh read
         """
-        data_int = int.from_bytes(buffer, "big")
-        data_bit_string = bin(data_int)
-        return data_bit_string
+        if self.latched is not None:
+            return self.latched
+        return self.read_flags()
 
     def get_state(self):
         """
         Get the current state of all line sensors.
-        
+        Allocates a new dictionary, prefer get_flags() in the control loop.
+
         Returns:
             dict: Dictionary containing sensor states and intersection detection
         """
-        left, center, right = self.read()
+        flags = self.get_flags()
         return {
-            "left": left,
-            "center": center,
-            "right": right,
-            "is_intersection": sum([left, center, right]) >= 2,
+            "left": bool(flags & LineSensors.LEFT),
+            "center": bool(flags & LineSensors.CENTER),
+            "right": bool(flags & LineSensors.RIGHT),
+            "is_intersection": bool(flags & LineSensors.INTERSECTION),
         }
 
     def is_intersection(self):
         """
         Check if the robot is at an intersection.
-        
+
         Returns:
             bool: True if at least two sensors detect a line
         """
-        return self.get_state()["is_intersection"]
+        return self.get_flags() & LineSensors.INTERSECTION != 0
 
     def is_left(self):
         """
         Check if the left sensor detects a line.
-        
+
         Returns:
             bool: True if left sensor detects a line
         """
-        return self.get_state()["left"]
+        return self.get_flags() & LineSensors.LEFT != 0
 
     def is_center(self):
         """
         Check if the center sensor detects a line.
-        
+
         Returns:
             bool: True if center sensor detects a line
         """
-        return self.get_state()["center"]
+        return self.get_flags() & LineSensors.CENTER != 0
 
     def is_right(self):
         """
         Check if the right sensor detects a line.
-        
+
         Returns:
             bool: True if right sensor detects a line
         """
-        return self.get_state()["right"]
+        return self.get_flags() & LineSensors.RIGHT != 0
 
     def no_line(self):
         """
         Check if no sensors detect a line.
-        
+
         Returns:
             bool: True if no sensors detect a line
         """
-        return not self.is_left() and not self.is_center() and not self.is_right()
+        return self.get_flags() & LineSensors.NO_LINE != 0
+
+
+def build_state_table():
+    """
+    Precompute the decoded sensor flags for every possible raw sensor byte.
+
+    Returns:
+        bytes: 256 entries of LineSensors flag bits, indexed by the raw byte
+    """
+    table = bytearray(256)
+    for raw in range(256):
+        flags = 0
+        count = 0
+        if raw & RAW_LEFT:
+            flags |= LineSensors.LEFT
+            count += 1
+        if raw & RAW_CENTER:
+            flags |= LineSensors.CENTER
+            count += 1
+        if raw & RAW_RIGHT:
+            flags |= LineSensors.RIGHT
+            count += 1
+        if count >= 2:
+            flags |= LineSensors.INTERSECTION
+        if count == 0:
+            flags |= LineSensors.NO_LINE
+        table[raw] = flags
+    return bytes(table)
+
+
+LineSensors.STATE_TABLE = build_state_table()
@@ -1,59 +1,109 @@
-from picoed import i2c # type: ignore
+from micropython import const
 from time import sleep
+from i2c_bus import shared_bus
+
+# Motor sides and directions, added up they index Motors.CHANNELS
+_LEFT = const(0)
+_RIGHT = const(2)
+_FORWARD = const(0)
+_BACKWARD = const(1)
+
 
 class Motors:
     """
     Controls the robot's motor system through I2C communication.
     Manages motor initialization, movement, and stopping.
+
+    The PWM duties are staged in a frame buffer and compared against a shadow copy
+    of what the controller last received. flush() sends the changed frame to both
+    motors in a single auto-incrementing write, or nothing at all if it is unchanged.
+    The write is queued on the bus and flushed together with whatever else other
+    devices queued, under the lock the tick already holds.
     """
-    LEFT = "left"
-    RIGHT = "right"
-    FORWARD = "forward"
-    BACKWARD = "backward"
+    LEFT = _LEFT
+    RIGHT = _RIGHT
+    FORWARD = _FORWARD
+    BACKWARD = _BACKWARD
+    # (driven, released) frame indexes of the PWM registers 0x05/0x04 (left) and 0x03/0x02 (right),
+    # indexed by side + direction
+    CHANNELS = ((4, 3), (3, 4), (2, 1), (1, 2))
+
+    __slots__ = ("bus", "frame", "shadow", "shadow_valid")
+    ADDRESS = 0x70
+    # Control byte: auto-increment over the PWM registers 0x02..0x05, starting at 0x02
+    PWM_AUTO_INCREMENT = 0xA2
+
+    def __init__(self, bus=None):
+        """
+        Initialize the frame buffer and the shadow registers.
+
+        Args:
+            bus: I2CBus the motor controller is on, the shared bus when omitted
+        """
+        self.bus = shared_bus() if bus is None else bus
+        # frame[0] is the control byte, frame[1:5] are the duties of PWM registers 0x02..0x05
+        self.frame = bytearray(5)
+        self.frame[0] = Motors.PWM_AUTO_INCREMENT
+        self.shadow = bytearray(5)
+        self.shadow_valid = False
 
     def initialize_motors(self):
         """
         Initialize the motor control system through I2C.
         Sets up the motor controller with proper configuration.
         """
-        while not i2c.try_lock():
-            pass
-        try:
-            i2c.writeto(0x70, b'\x00\x01')
-            i2c.writeto(0x70, b'\xE8\xAA')
-            sleep(0.1)  # It is acceptable for initialization to block briefly.
-        finally:
-            i2c.unlock()
+        self.bus.queue_write(Motors.ADDRESS, b'\x00\x01')
+        self.bus.queue_write(Motors.ADDRESS, b'\xE8\xAA')
+        self.bus.flush()
+        sleep(0.1)  # It is acceptable for initialization to block briefly.
+        self.force_refresh()
 
     def move(self, side, direction, speed):
         """
         Control a specific motor with given direction and speed.
-        
+        Only stages the duty cycle, flush() sends it to the controller.
+
         Args:
             side: Which motor to control (LEFT or RIGHT)
             direction: Movement direction (FORWARD or BACKWARD)
             speed: Motor speed value (0-255)
         """
-        # Determine the appropriate channels for the motor action.
-        if side == Motors.LEFT:
-            channel_on, channel_off = (b'\x05', b'\x04') if direction == Motors.FORWARD else (b'\x04', b'\x05')
-        elif side == Motors.RIGHT:
-            channel_on, channel_off = (b'\x03', b'\x02') if direction == Motors.FORWARD else (b'\x02', b'\x03')
-        else:
+        channel_on, channel_off = Motors.CHANNELS[side + direction]
+        self.frame[channel_off] = 0
+        self.frame[channel_on] = speed
+
+    def flush(self):
+        """
+        Send the staged duty cycles of both motors in one transaction.
+        Skips the bus entirely when the controller already holds the staged values.
+        """
+        if self.shadow_valid and self.frame == self.shadow:
             return
+        self.bus.queue_write(Motors.ADDRESS, self.frame)
+        self.bus.flush()
+        for index in range(5):
+            self.shadow[index] = self.frame[index]
+        self.shadow_valid = True
 
-        while not i2c.try_lock():
-            pass
-        try:
-            i2c.writeto(0x70, channel_off + bytes([0]))
-            i2c.writeto(0x70, channel_on + bytes([speed]))
-        finally:
-            i2c.unlock()
+    def force_refresh(self):
+        """
+        Forget the shadow registers so the next flush() rewrites every channel,
+        e.g. after the motor controller was reset.
+        """
+        self.shadow_valid = False
+
+    def stopped(self):
+        """
+        Returns True if the staged frame drives neither motor.
+        """
+        frame = self.frame
+        return not (frame[1] or frame[2] or frame[3] or frame[4])
 
     def stop(self):
         """
         Stop all motor movement by setting speed to zero.
         """
-        # Stop both motors.
+        # Stop both motors right away, stopping must not wait for the end of a tick.
         self.move(Motors.LEFT, Motors.FORWARD, 0)
         self.move(Motors.RIGHT, Motors.FORWARD, 0)
+        self.flush()
@@ -1,12 +1,26 @@
+from micropython import const
+
+# Header of a precompiled route file, followed by one turn code per intersection
+ROUTE_MAGIC = b"JCR1"
+
+# Turn IDs, FORWARD, LEFT and RIGHT are also their codes in a route file
+_FORWARD = const(0)
+_LEFT = const(1)
+_RIGHT = const(2)
+_FINISH = const(3)
+
+
 class Navigation:
     """
     Manages the robot's navigation through a predefined sequence of turns.
     Maintains the current state of navigation and determines the next movement.
     """
-    LEFT = "left"
-    RIGHT = "right"
-    FORWARD = "forward"
-    FINISH = "finish"
+    LEFT = _LEFT
+    RIGHT = _RIGHT
+    FORWARD = _FORWARD
+    FINISH = _FINISH
+    # Turn names indexed by turn ID
+    NAMES = ("forward", "left", "right", "finish")
 
     def __init__(self, turns=None):
         """
@@ -25,10 +39,44 @@ class Navigation:
         Determine the next turn direction based on the predefined sequence.
         
         Returns:
-            str: The next turn direction or FINISH if sequence is complete
+            int: The next turn direction or FINISH if sequence is complete
         """
         if self.current_index >= len(self.turns):
             return Navigation.FINISH
         direction = self.turns[self.current_index]
         self.current_index += 1
         return direction
+
+
+def encode_turns(turns):
+    """
+    Compile a turn list into the contents of a route file.
+
+    Args:
+        turns: Navigation.FORWARD, LEFT and RIGHT constants, one per intersection
+
+    Returns:
+        bytes: The route file contents
+    """
+    return ROUTE_MAGIC + bytes(turns)
+
+
+def load_turns(path):
+    """
+    Load a route file compiled by tools/plan_route.py.
+
+    Args:
+        path: Path of the route file
+
+    Returns:
+        list: Turn constants for Navigation
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if data[:len(ROUTE_MAGIC)] != ROUTE_MAGIC:
+        raise ValueError("Not a route file: " + path)
+    turns = list(data[len(ROUTE_MAGIC):])
+    for turn in turns:
+        if turn >= _FINISH:
+            raise ValueError("Invalid turn code " + str(turn) + " in " + path)
+    return turns
@@ -0,0 +1,156 @@
+from time import monotonic_ns
+
+def patch(owner, name, function):
+    """
+    Replace a method of one object, other objects of its class keep the original.
+
+    Args:
+        owner: Object whose method is replaced
+        name: Name of the method
+        function: Replacement, called with the arguments of the method but without self
+    """
+    try:
+        setattr(owner, name, function)
+    except AttributeError:
+        # Objects with __slots__ have no instance dict on CPython, the board ignores
+        # __slots__. Move the object to a subclass of its own that holds the replacement.
+        cls = type(owner)
+        if not cls.__dict__.get("patched", False):
+            cls = type(cls.__name__, (cls,), {"__slots__": (), "patched": True})
+            owner.__class__ = cls
+        setattr(cls, name, staticmethod(function))
+
+
+class CallSite:
+    """
+    Timing statistics of one profiled method.
+    """
+    # Upper bounds of the histogram buckets in microseconds, the last bucket takes the rest
+    BUCKETS_US = (10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self, label):
+        self.label = label
+        self.calls = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.histogram = [0] * (len(CallSite.BUCKETS_US) + 1)
+
+    def add(self, duration_ns):
+        """
+        Account one call.
+
+        Args:
+            duration_ns: Duration of the call in nanoseconds
+        """
+        self.calls += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        duration_us = duration_ns // 1000
+        bucket = 0
+        for bound in CallSite.BUCKETS_US:
+            if duration_us < bound:
+                break
+            bucket += 1
+        self.histogram[bucket] += 1
+
+
+class Profiler:
+    """
+    Measures how long the subsystem calls of the control tick take.
+
+    Profiling works by replacing methods of the robot's objects with timing wrappers
+    once at startup. Nothing is checked in the hot path, so a robot that was never
+    passed to attach() runs exactly the code it runs without a profiler.
+    Durations are inclusive: a profiled method calling another one counts its time too.
+    """
+
+    def __init__(self, clock=monotonic_ns):
+        """
+        Initialize the profiler.
+
+        Args:
+            clock: Function returning nanoseconds, e.g. time.perf_counter_ns on CPython
+        """
+        self.clock = clock
+        self.sites = []
+
+    def wrap(self, owner, name, label=None):
+        """
+        Replace a method of an object with a wrapper timing every call.
+
+        Args:
+            owner: Object whose method is wrapped
+            name: Name of the method
+            label: Name of the call site in the report, "Class.method" when omitted
+
+        Returns:
+            CallSite: Statistics of the wrapped method
+        """
+        method = getattr(owner, name)
+        site = CallSite(label or type(owner).__name__ + "." + name)
+        clock = self.clock
+
+        def timed(*args):
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                site.add(clock() - start)
+
+        patch(owner, name, timed)
+        self.sites.append(site)
+        return site
+
+    def attach(self, robot):
+        """
+        Wrap the entry points of the control tick.
+        Robot.drive is wrapped too, so pass robot.drive to the loop only after attaching.
+
+        Args:
+            robot: Robot to profile
+        """
+        control_unit = robot.control_unit
+        self.wrap(robot, "drive")
+        self.wrap(control_unit.line_sensors, "read_raw")
+        self.wrap(control_unit.motors, "move")
+        self.wrap(control_unit.motors, "flush")
+        self.wrap(control_unit.lights, "flush")
+        self.wrap(robot.robot_state, "update")
+        self.wrap(robot.robot_state, "set_state")
+        self.wrap(robot.navigation, "decide_turn")
+
+    def report(self):
+        """
+        Get the statistics of all call sites, the most expensive first.
+
+        Returns:
+            list: One dict per call site with calls, total, mean, min and max in microseconds
+        """
+        rows = []
+        for site in sorted(self.sites, key=lambda site: site.total_ns, reverse=True):
+            rows.append({
+                "site": site.label,
+                "calls": site.calls,
+                "total_us": site.total_ns // 1000,
+                "mean_us": site.total_ns // (site.calls or 1) // 1000,
+                "min_us": (site.min_ns or 0) // 1000,
+                "max_us": site.max_ns // 1000,
+                "histogram": list(site.histogram),
+            })
+        return rows
+
+    def print_report(self):
+        """
+        Print the ranked statistics and the latency histogram of every call site.
+        """
+        bounds = "/".join("<" + str(bound) for bound in CallSite.BUCKETS_US) + "/more us"
+        print("Profile, most expensive first (histogram " + bounds + "):")
+        for row in self.report():
+            print("  " + row["site"] + ": calls " + str(row["calls"]) + ", total " + str(row["total_us"])
+                  + " us, mean " + str(row["mean_us"]) + " us, min " + str(row["min_us"])
+                  + " us, max " + str(row["max_us"]) + " us, histogram "
+                  + "/".join(str(count) for count in row["histogram"]))
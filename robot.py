@@ -1,35 +1,117 @@
-from state import State
-from duration import Duration
+from state import StateMachine
+from timers import shared_timers, ticks_diff
 from control_unit import ControlUnit
-from navigation import Navigation
+from line_sensors import LineSensors
 
 class Robot:
     """
     Main robot control class that implements the state machine for autonomous navigation.
     Manages the robot's behavior through different states and handles transitions between them.
     """
-    # State constants representing different robot behaviors
-    STATE_DRIVING = "D"  # Normal line following state
-    STATE_MOVE_TO_INTERSECTION = "MTI"  # Moving through an intersection
-    STATE_RESOLVE_INTERSECTION = "RI"  # Deciding which way to turn at intersection
-    STATE_TURN_LEFT = "TL"  # Executing left turn
-    STATE_TURN_RIGHT = "TR"  # Executing right turn
-    STATE_FINISH = "F"  # Mission complete state
-    STATE_BREAK = "B"  # Temporary stop state
-    STATE_ERROR = "E"  # Error state (e.g., lost line)
-
-    def __init__(self, control_unit, navigation):
+    # State constants representing different robot behaviors, used as table indexes
+    STATE_DRIVING = 0  # Normal line following state
+    STATE_MOVE_TO_INTERSECTION = 1  # Moving through an intersection
+    STATE_RESOLVE_INTERSECTION = 2  # Deciding which way to turn at intersection
+    STATE_TURN_LEFT = 3  # Executing left turn
+    STATE_TURN_RIGHT = 4  # Executing right turn
+    STATE_FINISH = 5  # Mission complete state
+    STATE_BREAK = 6  # Temporary stop state
+    STATE_ERROR = 7  # Error state (e.g., lost line)
+    STATE_NAMES = ("D", "MTI", "RI", "TL", "TR", "F", "B", "E")
+
+    # Guards in addition to the state machine's built-in ones
+    GUARD_LINE_LEFT = 3
+    GUARD_LINE_RIGHT = 4
+    GUARD_NAMES = ("line left", "line right")
+
+    # Transition table: (source state, trigger, target state, guard, guard target, timeout ms)
+    TRANSITION_BREAK = 0
+    TRANSITION_MOVE_THROUGH = 1
+    TRANSITION_TURN_LEFT = 2
+    TRANSITION_TURN_RIGHT = 3
+    TRANSITION_FORWARD = 4
+    TRANSITION_FINISH = 5
+    TRANSITION_LOST_LINE = 6
+    BREAK_MS = 500  # Standing in front of an intersection
+    MOVE_THROUGH_MS = 400  # Driving onto the intersection before resolving it
+    TRANSITIONS = (
+        (STATE_DRIVING, "intersection", STATE_BREAK, StateMachine.GUARD_TIMER, STATE_MOVE_TO_INTERSECTION, BREAK_MS),
+        (STATE_MOVE_TO_INTERSECTION, "entered", STATE_DRIVING, StateMachine.GUARD_TIMER, STATE_RESOLVE_INTERSECTION,
+         MOVE_THROUGH_MS),
+        (STATE_RESOLVE_INTERSECTION, "left", STATE_TURN_LEFT, GUARD_LINE_LEFT, STATE_DRIVING, 0),
+        (STATE_RESOLVE_INTERSECTION, "right", STATE_TURN_RIGHT, GUARD_LINE_RIGHT, STATE_DRIVING, 0),
+        (STATE_RESOLVE_INTERSECTION, "forward", STATE_DRIVING, StateMachine.GUARD_ALWAYS, StateMachine.NO_STATE, 0),
+        (STATE_RESOLVE_INTERSECTION, "finish", STATE_FINISH, StateMachine.GUARD_NEVER, StateMachine.NO_STATE, 0),
+        (STATE_DRIVING, "line lost", STATE_ERROR, StateMachine.GUARD_NEVER, StateMachine.NO_STATE, 0),
+    )
+    LOST_LINE_MS = 5000
+    # Transition taken for each Navigation turn ID: FORWARD, LEFT, RIGHT, FINISH
+    TURN_TRANSITIONS = (TRANSITION_FORWARD, TRANSITION_TURN_LEFT, TRANSITION_TURN_RIGHT, TRANSITION_FINISH)
+
+    __slots__ = ("control_unit", "navigation", "telemetry", "timers", "robot_state", "lost_line_timer", "lost_line_ms",
+                 "handlers", "turn_transitions")
+
+    def __init__(self, control_unit, navigation, renderer=None, telemetry=None, timers=None, break_ms=BREAK_MS,
+                 move_through_ms=MOVE_THROUGH_MS, lost_line_ms=LOST_LINE_MS, log_states=False):
         """
         Initialize the robot with control unit and navigation system.
 
         Args:
             control_unit: ControlUnit instance for motor and sensor control
             navigation: Navigation instance for route planning
+            renderer: DisplayRenderer the current state is shown on
+            telemetry: Telemetry recorder receiving one sample per tick
+            timers: TimerService ticked by drive(), the shared one when omitted
+            break_ms: Milliseconds to stand in front of an intersection
+            move_through_ms: Milliseconds to drive onto an intersection before resolving it
+            lost_line_ms: Milliseconds without the line before giving up
+            log_states: Print every change of state, distorts the timing of the ticks it happens in
         """
         self.control_unit = control_unit
         self.navigation = navigation
-        self.robot_state = State(Robot.STATE_DRIVING, display_state=True)
-        self.no_line_duration = None
+        self.telemetry = telemetry
+        self.timers = shared_timers() if timers is None else timers
+        line_sensors = control_unit.line_sensors
+        guards = (line_sensors.is_left, line_sensors.is_right)
+        predictor = control_unit.turn_predictor
+        enter_left = enter_right = None
+        if predictor is not None:
+            # Turns also end on a line the predictor found between ticks
+            guards = (predictor.found_left, predictor.found_right)
+            enter_left = self.__enter_turn_left
+            enter_right = self.__enter_turn_right
+        # The transition table with the timeouts of this robot
+        timeouts = {Robot.TRANSITION_BREAK: break_ms, Robot.TRANSITION_MOVE_THROUGH: move_through_ms}
+        transitions = tuple(row[:5] + (timeouts.get(index, row[5]),) for index, row in enumerate(Robot.TRANSITIONS))
+        self.robot_state = StateMachine(
+            Robot.STATE_NAMES,
+            transitions,
+            self.timers,
+            default_state=Robot.STATE_DRIVING,
+            guards=guards,
+            guard_names=Robot.GUARD_NAMES,
+            renderer=renderer,
+            # Indexed by state like the tick handlers
+            entry_handlers=(None, None, None, enter_left, enter_right, self.__enter_finish, self.__enter_break,
+                            self.__enter_finish),
+            exit_handlers=(self.__exit_driving, None, None, None, None, None, None, None),
+            log_changes=log_states,
+        )
+        # Runs while the line is not visible, the robot gives up once it expired
+        self.lost_line_timer = self.timers.register("lost line")
+        self.lost_line_ms = lost_line_ms
+        # Tick handlers indexed by state, bound once so dispatching allocates nothing
+        self.handlers = (
+            self.__drive_state,
+            self.__move_to_intersection_state,
+            self.__resolve_intersection_state,
+            self.__turn_left_state,
+            self.__turn_right_state,
+            self.__stopped_state,
+            self.__stopped_state,
+            self.__stopped_state,
+        )
+        self.turn_transitions = Robot.TURN_TRANSITIONS
 
     def start(self):
         """
@@ -37,6 +119,7 @@ class Robot:
         Turns off all lights and initializes the control unit.
         """
         self.control_unit.lights.turn_off()
+        self.control_unit.lights.flush()
         self.control_unit.initialize()
 
     def drive(self):
@@ -56,73 +139,130 @@ class Robot:
         - DRIVING -> ERROR (when line is lost for too long)
         - Any state -> FINISH (when mission is complete)
 
-        Each state has specific conditions for transitions and associated actions.
+        The transitions are rows of Robot.TRANSITIONS, each state has a tick handler and
+        may have an entry handler run on its first tick and an exit handler run when it is left.
+        """
+        # Read the clock once, every timer of the tick answers from this reading
+        self.timers.tick()
+        # Latch the sensors so the whole tick decides on one reading
+        self.control_unit.begin_tick()
+        try:
+            self.__update()
+        finally:
+            # Send everything the tick staged for the actuators
+            self.control_unit.end_tick()
+
+        telemetry = self.telemetry
+        if telemetry is not None:
+            # Millisecond ticks, the nanosecond clock would allocate a big int every tick
+            control_unit = self.control_unit
+            timers = self.timers
+            telemetry.record(timers.now, control_unit.line_sensors.raw, self.robot_state.current_state,
+                             control_unit.motors.frame, ticks_diff(timers.ticks(), timers.now))
+
+    def __update(self):
+        """
+        Run one step of the state machine on the sensor reading latched for this tick.
         """
         # Check for obstacles
         obstacle = self.control_unit.is_obstacle()
 
-        # Update the state machine
+        # Update the state machine and run the handler of the current state
         self.robot_state.update()
+        self.handlers[self.robot_state.current_state]()
 
-        # Handle terminal states (FINISH and ERROR)
-        if self.robot_state.current_state == Robot.STATE_FINISH or self.robot_state.current_state == Robot.STATE_ERROR:
-            self.control_unit.execute_movement(ControlUnit.COMMAND_FINISH)
-            return
+    def __enter_finish(self):
+        """
+        Entering the terminal states (FINISH and ERROR): stop and blink.
+        """
+        self.control_unit.execute_movement(ControlUnit.COMMAND_FINISH)
 
-        # Handle break state (temporary stop)
-        if self.robot_state.current_state == Robot.STATE_BREAK:
-            self.control_unit.execute_movement(ControlUnit.COMMAND_BREAK)
-            return
+    def __enter_break(self):
+        """
+        Entering the temporary stop in front of an intersection: stop with the brake lights on.
+        """
+        self.control_unit.execute_movement(ControlUnit.COMMAND_BREAK)
 
-        # Handle moving through intersection
-        if self.robot_state.current_state == Robot.STATE_MOVE_TO_INTERSECTION:
-            self.robot_state.duration = Duration(0.4)
-            self.robot_state.set_state(Robot.STATE_DRIVING, condition=lambda: self.robot_state.duration.done(), next_state=Robot.STATE_RESOLVE_INTERSECTION)
-            return
+    def __enter_turn_left(self):
+        """
+        Entering a left turn: the turn predictor starts timing it.
+        """
+        self.control_unit.turn_predictor.begin(LineSensors.LEFT)
 
-        # Handle intersection resolution (deciding which way to turn)
-        if self.robot_state.current_state == Robot.STATE_RESOLVE_INTERSECTION:
-            turn_direction = self.navigation.decide_turn()
-            if turn_direction == Navigation.LEFT:
-                self.robot_state.set_state(Robot.STATE_TURN_LEFT, condition=lambda: self.control_unit.line_sensors.is_left(), next_state=Robot.STATE_DRIVING)
-            elif turn_direction == Navigation.RIGHT:
-                self.robot_state.set_state(Robot.STATE_TURN_RIGHT, condition=lambda: self.control_unit.line_sensors.is_right(), next_state=Robot.STATE_DRIVING)
-            elif turn_direction == Navigation.FORWARD:
-                self.robot_state.set_state(Robot.STATE_DRIVING)
-            elif turn_direction == Navigation.FINISH:
-                self.robot_state.set_state(Robot.STATE_FINISH, condition=lambda: False)
-            return
+    def __enter_turn_right(self):
+        """
+        Entering a right turn: the turn predictor starts timing it.
+        """
+        self.control_unit.turn_predictor.begin(LineSensors.RIGHT)
 
-        # Handle left turn execution
-        if self.robot_state.current_state == Robot.STATE_TURN_LEFT:
-            self.control_unit.execute_movement(ControlUnit.COMMAND_LEFT)
-            return
+    def __exit_driving(self):
+        """
+        Leaving DRIVING: the line is no longer being searched for.
+        """
+        self.timers.cancel(self.lost_line_timer)
 
-        # Handle right turn execution
-        if self.robot_state.current_state == Robot.STATE_TURN_RIGHT:
-            self.control_unit.execute_movement(ControlUnit.COMMAND_RIGHT)
-            return
+    def __stopped_state(self):
+        """
+        Standing still (BREAK, FINISH and ERROR), the entry handler stopped the motors.
+        """
+
+    def __move_to_intersection_state(self):
+        """
+        Keep driving for a moment to get onto the intersection, then resolve it.
+        """
+        self.robot_state.fire(Robot.TRANSITION_MOVE_THROUGH)
+
+    def __resolve_intersection_state(self):
+        """
+        Decide which way to go at the intersection.
+        """
+        self.robot_state.fire(self.turn_transitions[self.navigation.decide_turn()])
+
+    def __turn_left_state(self):
+        """
+        Turn left until the left sensor finds the line.
+        """
+        self.control_unit.execute_movement(ControlUnit.COMMAND_LEFT)
 
-        # Detect intersection and initiate turn sequence
-        if self.control_unit.line_sensors.is_intersection() and self.robot_state.current_state == Robot.STATE_DRIVING:
-            self.robot_state.duration = Duration(0.5)
-            self.robot_state.set_state(Robot.STATE_BREAK, condition=lambda: self.robot_state.duration.done(), next_state=Robot.STATE_MOVE_TO_INTERSECTION)
+    def __turn_right_state(self):
+        """
+        Turn right until the right sensor finds the line.
+        """
+        self.control_unit.execute_movement(ControlUnit.COMMAND_RIGHT)
+
+    def __drive_state(self):
+        """
+        Follow the line, stop at intersections and give up when the line is lost for too long.
+        """
+        line_sensors = self.control_unit.line_sensors
+
+        # Detect intersection and initiate turn sequence, unless driving onto the one stopped at
+        if line_sensors.is_intersection() and self.robot_state.next_state != Robot.STATE_RESOLVE_INTERSECTION:
+            self.robot_state.fire(Robot.TRANSITION_BREAK)
             return
 
         # Handle lost line condition
-        if self.control_unit.line_sensors.no_line():
-            if self.no_line_duration is None:
-                self.no_line_duration = Duration(5.0)
-            elif self.no_line_duration.done():
-                self.robot_state.set_state(Robot.STATE_ERROR, condition=lambda: False)
+        if line_sensors.no_line():
+            if not self.timers.running(self.lost_line_timer):
+                self.timers.start(self.lost_line_timer, self.lost_line_ms)
+            elif self.timers.expired(self.lost_line_timer):
+                self.robot_state.fire(Robot.TRANSITION_LOST_LINE)
+                return
+            self.control_unit.line_lost()
             return
-        else:
-            self.no_line_duration = None
+        self.timers.cancel(self.lost_line_timer)
 
         # Normal line following behavior
-        if self.robot_state.current_state == Robot.STATE_DRIVING:
-            self.control_unit.execute_movement(ControlUnit.COMMAND_FORWARD)
-            return
+        self.control_unit.execute_movement(ControlUnit.COMMAND_FORWARD)
+
+    def transition_graph(self):
+        """
+        Describe the state machine's transition graph.
+
+        Returns:
+            list: One line per edge, e.g. "B --timer 500 ms--> MTI"
+        """
+        return self.robot_state.dump()
 
     def stop(self):
         """
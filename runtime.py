@@ -0,0 +1,118 @@
+import asyncio
+from time import monotonic_ns
+
+class AsyncRuntime:
+    """
+    Cooperative asyncio runtime that splits the robot into independent periodic tasks.
+    Sensing and control run at a high rate, lights, display and battery monitoring run
+    at their own slower rates so they never hold up the control path.
+
+    The sensor sampler and the turn predictor block in the slack between control ticks,
+    which would stall the other tasks, so they run with the synchronous loop only.
+    """
+    CONTROL_PERIOD = 0.01
+    LIGHTS_PERIOD = 0.05
+    DISPLAY_PERIOD = 0.05
+    BATTERY_PERIOD = 1.0
+    BUTTON_PERIOD = 0.05
+
+    def __init__(self, robot, battery_monitor, renderer, stop_button,
+                 control_period=CONTROL_PERIOD, lights_period=LIGHTS_PERIOD, display_period=DISPLAY_PERIOD,
+                 battery_period=BATTERY_PERIOD, button_period=BUTTON_PERIOD):
+        """
+        Initialize the runtime.
+
+        Args:
+            robot: Robot instance driven by the control task
+            battery_monitor: BatteryMonitor sampled by the battery task
+            renderer: DisplayRenderer the robot state is shown on
+            stop_button: Button that ends the run when pressed
+            control_period: Seconds between control ticks
+            lights_period: Seconds between NeoPixel refreshes
+            display_period: Seconds between display renderer slices
+            battery_period: Seconds between battery samples
+            button_period: Seconds between stop button polls
+
+        Raises:
+            ValueError: If the robot has a sensor sampler or a turn predictor
+        """
+        control_unit = robot.control_unit
+        if control_unit.line_sensors.sampler is not None or control_unit.turn_predictor is not None:
+            raise ValueError("Sensor sampling and turn prediction need the synchronous loop")
+        self.robot = robot
+        self.battery_monitor = battery_monitor
+        self.renderer = renderer
+        self.stop_button = stop_button
+        self.control_period = control_period
+        self.lights_period = lights_period
+        self.display_period = display_period
+        self.battery_period = battery_period
+        self.button_period = button_period
+        self.running = False
+        self.low_battery = False
+
+    def run(self):
+        """
+        Run all tasks until the stop button is pressed or the battery runs low.
+        """
+        asyncio.run(self.main())
+
+    async def main(self):
+        """
+        Start the tasks and wait for all of them to finish.
+        """
+        # The lights are refreshed and the battery is sampled by their own tasks, not by the control tick.
+        self.robot.control_unit.flush_lights = False
+        self.robot.control_unit.sample_battery = False
+        self.running = True
+        try:
+            await asyncio.gather(
+                asyncio.create_task(self.__every(self.control_period, self.robot.drive)),
+                asyncio.create_task(self.__every(self.lights_period, self.robot.control_unit.lights.flush)),
+                asyncio.create_task(self.__every(self.display_period, self.renderer.service)),
+                asyncio.create_task(self.__every(self.battery_period, self.__check_battery)),
+                asyncio.create_task(self.__every(self.button_period, self.__check_button)),
+            )
+        finally:
+            self.running = False
+            self.robot.stop()
+        if self.low_battery:
+            self.renderer.show_blocking("LOW BATTERY " + str(self.battery_monitor.millivolts() / 1000) + "V")
+
+    async def __every(self, period, work):
+        """
+        Call work() every period seconds against absolute deadlines until the run ends.
+        A late task drops the periods it missed instead of bursting to catch up.
+
+        Args:
+            period: Seconds between calls
+            work: Function to call
+        """
+        period_ns = int(period * 1_000_000_000)
+        deadline = monotonic_ns()
+        while self.running:
+            work()
+            deadline += period_ns
+            slack = deadline - monotonic_ns()
+            if slack < 0:
+                deadline -= slack
+                slack = 0
+            await asyncio.sleep(slack / 1_000_000_000)
+
+    def __check_battery(self):
+        """
+        Sample the battery and end the run when it drops to the critical level.
+        The control tick picks the new speed scale up from the monitor.
+        """
+        self.battery_monitor.sample()
+        if self.battery_monitor.critical():
+            print("Battery is not ok. Stopping the robot.")
+            self.low_battery = True
+            self.running = False
+
+    def __check_button(self):
+        """
+        End the run when the stop button was pressed.
+        """
+        if self.stop_button.was_pressed():
+            self.running = False
@@ -0,0 +1,144 @@
+from time import monotonic_ns, sleep
+
+class LoopScheduler:
+    """
+    Runs the control step at a fixed rate against absolute monotonic_ns() deadlines.
+    Sleeps only for the slack left in each period and keeps running timing statistics.
+    """
+    # What to do when a step runs past the deadline of the next period
+    SKIP = "skip"  # Drop the missed periods and stay aligned to the original grid
+    CATCH_UP = "catch_up"  # Run the missed periods back to back until on schedule again
+
+    def __init__(self, rate_hz=50, overrun_policy=SKIP, max_catch_up=5):
+        """
+        Initialize the scheduler.
+
+        Args:
+            rate_hz: Target number of steps per second
+            overrun_policy: SKIP or CATCH_UP
+            max_catch_up: Most periods CATCH_UP will replay before it resynchronises
+        """
+        self.period_ns = 1_000_000_000 // rate_hz
+        self.overrun_policy = overrun_policy
+        self.max_catch_up = max_catch_up
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the statistics and restart the deadline grid at the next step.
+        """
+        self.next_deadline = None
+        self.last_start = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.worst_tick_ns = 0
+        self.total_tick_ns = 0
+        self.min_period_ns = None
+        self.max_period_ns = 0
+        self.max_jitter_ns = 0
+        self.total_jitter_ns = 0
+
+    def run(self, step, should_stop, idle=None):
+        """
+        Call step() once per period until should_stop() returns True.
+
+        Args:
+            step: Function doing the work of one period, e.g. Robot.drive
+            should_stop: Function returning True when the loop should end
+            idle: Function called with the next deadline in the slack after each step
+        """
+        while not should_stop():
+            self.tick(step, idle)
+
+    def tick(self, step, idle=None):
+        """
+        Run a single step and wait for the deadline of the following one.
+
+        Args:
+            step: Function doing the work of one period
+            idle: Function called with the next deadline in the slack after the step,
+                it must return before the deadline, e.g. DisplayRenderer.service
+        """
+        start = monotonic_ns()
+        if self.next_deadline is None:
+            self.next_deadline = start
+        self.__record_period(start)
+
+        step()
+
+        end = monotonic_ns()
+        tick_ns = end - start
+        self.ticks += 1
+        self.total_tick_ns += tick_ns
+        if tick_ns > self.worst_tick_ns:
+            self.worst_tick_ns = tick_ns
+
+        self.next_deadline += self.period_ns
+        if end > self.next_deadline:
+            self.__handle_overrun(end)
+
+        if idle is not None and self.next_deadline > end:
+            idle(self.next_deadline)
+
+        slack = self.next_deadline - monotonic_ns()
+        if slack > 0:
+            sleep(slack / 1_000_000_000)
+
+    def __record_period(self, start):
+        """
+        Update the period and jitter statistics with the start of a new step.
+        """
+        if self.last_start is not None:
+            period = start - self.last_start
+            jitter = abs(period - self.period_ns)
+            if self.min_period_ns is None or period < self.min_period_ns:
+                self.min_period_ns = period
+            if period > self.max_period_ns:
+                self.max_period_ns = period
+            if jitter > self.max_jitter_ns:
+                self.max_jitter_ns = jitter
+            self.total_jitter_ns += jitter
+        self.last_start = start
+
+    def __handle_overrun(self, now):
+        """
+        Move the next deadline according to the overrun policy after a step ran late.
+        """
+        self.overruns += 1
+        missed = (now - self.next_deadline) // self.period_ns + 1
+        if self.overrun_policy == LoopScheduler.CATCH_UP and missed <= self.max_catch_up:
+            # Leave the deadline in the past, the following steps run without sleeping.
+            return
+        self.skipped += missed
+        self.next_deadline += missed * self.period_ns
+
+    def stats(self):
+        """
+        Get the statistics collected so far.
+
+        Returns:
+            dict: Tick count, overruns, skipped periods and timing figures in microseconds
+        """
+        periods = self.ticks - 1 if self.ticks > 1 else 1
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "target_period_us": self.period_ns // 1000,
+            "min_period_us": (self.min_period_ns or 0) // 1000,
+            "max_period_us": self.max_period_ns // 1000,
+            "mean_jitter_us": self.total_jitter_ns // periods // 1000,
+            "max_jitter_us": self.max_jitter_ns // 1000,
+            "mean_tick_us": self.total_tick_ns // (self.ticks or 1) // 1000,
+            "worst_tick_us": self.worst_tick_ns // 1000,
+        }
+
+    def print_report(self):
+        """
+        Print the collected statistics, one figure per line.
+        """
+        stats = self.stats()
+        print("Loop statistics:")
+        for key in sorted(stats):
+            print("  " + key + ": " + str(stats[key]))
@@ -0,0 +1,178 @@
+from micropython import const
+from time import sleep
+from timers import shared_timers
+from line_sensors import LineSensors, RAW_LEFT, RAW_CENTER, RAW_RIGHT
+
+# Edge events, also the bit positions of their pending flags
+_LINE_ACQUIRED = const(0)
+_LINE_LOST = const(1)
+_INTERSECTION_ENTERED = const(2)
+_INTERSECTION_EXITED = const(3)
+
+# Number of set bits of every byte, for counting the hits in a sensor's window
+POPCOUNT = bytes(bin(value).count("1") for value in range(256))
+
+
+class SensorSampler:
+    """
+    Samples the line sensors several times per control period and debounces them.
+
+    Every sample shifts one bit per sensor into a small history register. A sensor
+    counts as on once at least threshold of the last window samples saw the line and
+    as off once at most window - threshold did, in between it keeps its state. The
+    debounced sensors are decoded like a raw reading, changes of the decoded flags
+    become edge events with the timestamp of the sample that caused them.
+
+    service() takes the samples in the slack between control ticks, begin_tick() of
+    the line sensors latches the debounced flags through latch(). The latched
+    INTERSECTION flag marks the edge: it is set for the one tick following the
+    entry into an intersection, even if it was already left again, so a crossing
+    shorter than a control period still stops the robot and a robot that came to
+    a halt on the crossing does not stop for it a second time.
+    """
+    LINE_ACQUIRED = _LINE_ACQUIRED
+    LINE_LOST = _LINE_LOST
+    INTERSECTION_ENTERED = _INTERSECTION_ENTERED
+    INTERSECTION_EXITED = _INTERSECTION_EXITED
+    EVENT_NAMES = ("line acquired", "line lost", "intersection entered", "intersection exited")
+
+    PERIOD_MS = 2
+    WINDOW = 5
+    THRESHOLD = 4  # Four of the last five samples switch a sensor
+    SENSOR_BITS = (RAW_LEFT, RAW_CENTER, RAW_RIGHT)
+
+    __slots__ = ("line_sensors", "clock", "period_ns", "mask", "threshold", "histories", "stable", "flags",
+                 "pending", "tick_events", "event_ns", "next_sample", "samples", "events")
+
+    def __init__(self, line_sensors, timers=None, period_ms=PERIOD_MS, window=WINDOW, threshold=THRESHOLD):
+        """
+        Initialize the sampler and attach it to the line sensors.
+
+        Args:
+            line_sensors: LineSensors to sample, their begin_tick() latches the debounced flags afterwards
+            timers: TimerService whose clock timestamps the samples, the shared one when omitted
+            period_ms: Milliseconds between samples
+            window: Number of samples a sensor is debounced over, at most 8
+            threshold: Samples of the window that must agree to switch a sensor
+        """
+        if not 0 < window <= 8 or not window / 2 < threshold <= window:
+            raise ValueError("Threshold must be a majority of a window of 1 to 8 samples")
+        self.line_sensors = line_sensors
+        self.clock = (shared_timers() if timers is None else timers).clock
+        self.period_ns = period_ms * 1_000_000
+        self.mask = (1 << window) - 1
+        self.threshold = threshold
+        self.histories = bytearray(len(SensorSampler.SENSOR_BITS))
+        self.stable = 0
+        self.flags = LineSensors.NO_LINE
+        self.pending = 0
+        self.tick_events = 0
+        self.event_ns = [0] * len(SensorSampler.EVENT_NAMES)
+        self.next_sample = 0
+        self.samples = 0
+        self.events = 0
+        # Start from the current reading, not from a window of misses
+        raw = line_sensors.read_raw()
+        for index, bit in enumerate(SensorSampler.SENSOR_BITS):
+            if raw & bit:
+                self.histories[index] = self.mask
+                self.stable |= bit
+        self.flags = LineSensors.STATE_TABLE[self.stable]
+        line_sensors.sampler = self
+
+    def sample(self, now):
+        """
+        Read the sensors once, debounce them and record the edge events.
+
+        Args:
+            now: Timestamp of the sample in nanoseconds
+        """
+        raw = self.line_sensors.read_raw()
+        self.samples += 1
+        mask = self.mask
+        threshold = self.threshold
+        histories = self.histories
+        stable = self.stable
+        index = 0
+        for bit in SensorSampler.SENSOR_BITS:
+            history = (histories[index] << 1 | (1 if raw & bit else 0)) & mask
+            histories[index] = history
+            hits = POPCOUNT[history]
+            if hits >= threshold:
+                stable |= bit
+            elif hits <= POPCOUNT[mask] - threshold:
+                stable &= ~bit
+            index += 1
+        if stable == self.stable:
+            return
+        self.stable = stable
+        flags = LineSensors.STATE_TABLE[stable]
+        changed = flags ^ self.flags
+        self.flags = flags
+        if changed & LineSensors.NO_LINE:
+            self.__event(_LINE_LOST if flags & LineSensors.NO_LINE else _LINE_ACQUIRED, now)
+        if changed & LineSensors.INTERSECTION:
+            self.__event(_INTERSECTION_ENTERED if flags & LineSensors.INTERSECTION else _INTERSECTION_EXITED, now)
+
+    def __event(self, event, now):
+        self.pending |= 1 << event
+        self.event_ns[event] = now
+        self.events += 1
+
+    def service(self, deadline):
+        """
+        Take the samples due before the deadline, sleeping in between.
+        Stops half a period early, the next control tick takes a sample of its own.
+
+        Args:
+            deadline: monotonic_ns() timestamp by which the call returns
+        """
+        clock = self.clock
+        period = self.period_ns
+        last = deadline - period // 2
+        while self.next_sample < last:
+            now = clock()
+            if now < self.next_sample:
+                sleep((self.next_sample - now) / 1_000_000_000)
+                now = self.next_sample
+            self.sample(now)
+            self.next_sample += period
+            if self.next_sample <= now:
+                # Fell behind, stay on a grid starting now
+                self.next_sample = now + period
+
+    def latch(self):
+        """
+        Sample once more and hand the debounced flags to a control tick.
+        The events since the previous latch move to tick_events.
+
+        Returns:
+            int: LineSensors flags, INTERSECTION set only if one was entered since the previous tick
+        """
+        now = self.clock()
+        self.sample(now)
+        self.next_sample = now + self.period_ns
+        flags = self.flags & ~LineSensors.INTERSECTION
+        if self.pending & (1 << _INTERSECTION_ENTERED):
+            flags |= LineSensors.INTERSECTION
+        self.tick_events = self.pending
+        self.pending = 0
+        return flags
+
+    def happened(self, event):
+        """
+        Returns True if the event occurred between the previous control tick and this one.
+        """
+        return self.tick_events & (1 << event) != 0
+
+    def event_time(self, event):
+        """
+        Returns the timestamp in nanoseconds of the latest occurrence of an event.
+        """
+        return self.event_ns[event]
+
+    def stats(self):
+        """
+        Returns the number of samples taken and events recorded.
+        """
+        return {"samples": self.samples, "events": self.events}
@@ -0,0 +1,18 @@
+"""
+Headless simulator for running the robot on CPython faster than real time.
+
+Provides stand-ins for the CircuitPython modules (picoed, board, neopixel, analogio),
+a virtual I2C bus with the motor controller and the line sensor expander, a
+differential-drive model of the car on a track map and a virtual clock.
+
+    from sim import Simulation
+    from sim.courses import DEFAULT_COURSE, DEFAULT_ROUTE
+
+    result = Simulation(DEFAULT_COURSE, DEFAULT_ROUTE).run()
+"""
+from sim.hardware import install, uninstall
+from sim.simulation import Result, Simulation
+from sim.track import TrackMap
+from sim.world import CarModel, World
+
+__all__ = ["CarModel", "Result", "Simulation", "TrackMap", "World", "install", "uninstall"]
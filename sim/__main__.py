@@ -0,0 +1,78 @@
+"""
+Run the robot over a simulated course:
+
+    python -m sim [--course default] [--code] [--verbose] [--telemetry run.bin] [--profile]
+                  [--sensor-interrupt] [--sampling] [--noise 0.02] [--speed 1.5] [--record trace.bin]
+                  [--proportional] [--turn-prediction]
+"""
+import argparse
+import json
+import time
+
+from sim.courses import COURSES
+from sim.hardware import install
+from sim.simulation import Simulation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the robot over a simulated course.")
+    parser.add_argument("--course", choices=sorted(COURSES), default="default")
+    parser.add_argument("--timeout", type=float, default=120.0, help="simulated seconds before giving up")
+    parser.add_argument("--code", action="store_true", help="run code.py unmodified instead of building the stack")
+    parser.add_argument("--verbose", action="store_true", help="show the robot's print() output")
+    parser.add_argument("--telemetry", help="write the telemetry dump of the run to this file")
+    parser.add_argument("--profile", action="store_true", help="time the subsystem calls and print a report")
+    parser.add_argument("--sensor-interrupt", action="store_true", help="read the line sensors on INT edges only")
+    parser.add_argument("--sampling", action="store_true", help="debounce the line sensors between ticks")
+    parser.add_argument("--noise", type=float, default=0.0, help="probability of a line sensor bit being misread")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed multiplier of the motor duties")
+    parser.add_argument("--record", help="record a trace of the run to this file, python -m sim.replay replays it")
+    parser.add_argument("--proportional", action="store_true", help="follow the line with the proportional controller")
+    parser.add_argument("--turn-prediction", action="store_true", help="taper the turns and poll at their end")
+    args = parser.parse_args()
+
+    track, route = COURSES[args.course]
+    profiler = None
+    if args.profile:
+        from profiler import Profiler
+
+        # Wall time, the robot's monotonic_ns() runs on the virtual clock
+        profiler = Profiler(clock=time.perf_counter_ns)
+    control_unit_args = None
+    if args.proportional:
+        install()
+        from control_unit import ControlUnit
+
+        control_unit_args = {"controller": ControlUnit.PROPORTIONAL}
+    recorder = None
+    if args.record:
+        # Imported on the virtual clock, the recorder timestamps with monotonic_ns()
+        install()
+        from trace_recorder import TraceRecorder
+
+        recorder = TraceRecorder(capacity=1 << 20)
+    simulation = Simulation(track, route, quiet=not args.verbose, profiler=profiler,
+                            sensor_interrupt=args.sensor_interrupt, sampling=args.sampling, sensor_noise=args.noise,
+                            speed_multiplier=args.speed, recorder=recorder, control_unit_args=control_unit_args,
+                            turn_prediction=args.turn_prediction,
+                            robot_args={"log_states": True} if args.verbose else None)
+    if args.code:
+        shown = simulation.run_code(timeout=args.timeout, telemetry_path=args.telemetry)
+        states = [value for index, value in enumerate(shown) if index == 0 or shown[index - 1] != value]
+        print(json.dumps({"displayed": states, "simulated_time": round(simulation.world.time_ns / 1e9, 3)}))
+        return
+    result = simulation.run(timeout=args.timeout)
+    if args.telemetry:
+        with simulation.output():
+            simulation.telemetry.save(args.telemetry)
+    if recorder is not None:
+        recorder.save(args.record)
+    print(json.dumps(result.as_dict(), indent=2))
+    for at, state in result.transitions:
+        print("{:8.2f}s  {}".format(at, state))
+    if profiler is not None:
+        profiler.print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Virtual clock that stands in for time.monotonic_ns(), time.monotonic(), time.sleep() and
+supervisor.ticks_ms().
+"""
+import time
+
+
+class VirtualClock:
+    """
+    Monotonic nanosecond clock that only moves when the code under simulation sleeps.
+    Every advance is forwarded to the listeners, e.g. the physics of the simulated world.
+    """
+
+    def __init__(self, start_ns=1_000_000_000):
+        self.now_ns = start_ns
+        self.listeners = []
+        self.saved = None
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+    def ticks_ms(self):
+        # Wraps at 2**29 like the board's
+        return (self.now_ns // 1_000_000) & ((1 << 29) - 1)
+
+    def monotonic(self):
+        return self.now_ns / 1_000_000_000
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance_ns(int(seconds * 1_000_000_000))
+
+    def advance_ns(self, delta_ns):
+        """
+        Move the clock forward and let the listeners catch up.
+
+        Args:
+            delta_ns: Nanoseconds to advance by
+        """
+        self.now_ns += delta_ns
+        for listener in self.listeners:
+            listener(delta_ns)
+
+    def install(self):
+        """
+        Patch the time module so that code imported afterwards runs on this clock.
+        """
+        if self.saved is None:
+            self.saved = (time.monotonic_ns, time.monotonic, time.sleep)
+        time.monotonic_ns = self.monotonic_ns
+        time.monotonic = self.monotonic
+        time.sleep = self.sleep
+
+    def uninstall(self):
+        """
+        Restore the real time functions.
+        """
+        if self.saved is not None:
+            time.monotonic_ns, time.monotonic, time.sleep = self.saved
+            self.saved = None
@@ -0,0 +1,39 @@
+"""
+Courses for the simulator.
+"""
+from sim.track import TrackMap
+
+GRID = 0.4
+
+
+def grid_track(points, edges, name):
+    """
+    Build a track from nodes given in grid units.
+    """
+    return TrackMap({node: (x * GRID, y * GRID) for node, (x, y) in points.items()}, edges, name=name)
+
+
+def grid(columns, rows):
+    """
+    Build a full grid of lines like a city mat, every inner node is a four-way crossing.
+    Node names are "x,y" in grid units.
+    """
+    points = {"{},{}".format(x, y): (x, y) for x in range(columns) for y in range(rows)}
+    edges = [("{},{}".format(x, y), "{},{}".format(x + 1, y)) for x in range(columns - 1) for y in range(rows)]
+    edges += [("{},{}".format(x, y), "{},{}".format(x, y + 1)) for x in range(columns) for y in range(rows - 1)]
+    return grid_track(points, edges, "grid{}x{}".format(columns, rows))
+
+
+# The lap driven by the turn list in code.py on a 6x6 grid mat: it starts on the crossing
+# 1,1 heading east, drives the loop anticlockwise and finishes on 2,1, the first crossing.
+DEFAULT_COURSE = grid(6, 6)
+DEFAULT_ROUTE = ["1,1", "2,1", "3,1", "3,2", "4,2", "4,3", "4,4", "3,4", "2,4", "2,3", "2,2", "1,2", "1,1", "2,1"]
+
+# A single straight line with a finish bar, for line following and finish tests.
+STRAIGHT_COURSE = grid_track({"S": (0, 0), "T": (0, 4)}, [("S", "T")], "straight")
+STRAIGHT_ROUTE = ["S", "T"]
+
+COURSES = {
+    "default": (DEFAULT_COURSE, DEFAULT_ROUTE),
+    "straight": (STRAIGHT_COURSE, STRAIGHT_ROUTE),
+}
@@ -0,0 +1,437 @@
+"""
+Drop-in stand-ins for the CircuitPython modules used by the robot:
+picoed (i2c, display, buttons), board, neopixel, analogio, countio and digitalio.
+
+The micropython module is registered as soon as the simulator is imported: it has no
+hardware behind it and the robot modules import it at the top, e.g. for the track
+maps and tools that use Navigation without a simulation.
+"""
+import random
+import sys
+import types
+
+from sim.clock import VirtualClock
+
+
+class MotorController:
+    """
+    The PWM controller at 0x70 driving the motors.
+    Decodes register writes including the auto-increment modes of the control byte.
+    """
+    ADDRESS = 0x70
+    REGISTERS = 13
+    LEDOUT = 0x08
+    PWM_ENABLED = 0xAA
+    # Auto-increment flags of the control byte -> (first, last) register of the roll-over range
+    AUTO_INCREMENT = {
+        0x80: (0x00, 0x0C),
+        0xA0: (0x02, 0x05),
+        0xC0: (0x06, 0x07),
+        0xE0: (0x02, 0x07),
+    }
+
+    def __init__(self, hardware):
+        self.hardware = hardware
+        self.reset()
+
+    def reset(self):
+        self.registers = bytearray(self.REGISTERS)
+        # MODE1 powers up with the oscillator asleep
+        self.registers[0] = 0x11
+
+    def write(self, data, start, end):
+        if end <= start:
+            return
+        control = data[start]
+        register = control & 0x1F
+        increment = self.AUTO_INCREMENT.get(control & 0xE0)
+        for index in range(start + 1, end):
+            if register >= self.REGISTERS:
+                raise OSError(5)
+            self.registers[register] = data[index]
+            if increment:
+                register = increment[0] if register >= increment[1] else register + 1
+        self.update()
+
+    def read(self, buffer, start, end):
+        for index in range(start, end):
+            buffer[index] = 0
+
+    def update(self):
+        """
+        Push the duties to the world, the outputs only drive PWM once configured and awake.
+        """
+        registers = self.registers
+        active = registers[self.LEDOUT] == self.PWM_ENABLED and not registers[0] & 0x10
+        left = registers[5] - registers[4] if active else 0
+        right = registers[3] - registers[2] if active else 0
+        self.hardware.world.set_duties(left, right)
+
+
+class SensorExpander:
+    """
+    The 8 bit I/O expander at 0x38 the line sensors are wired to.
+    The inputs are sampled whenever the world moves, so reads do not allocate.
+
+    Its open drain INT output is pulled low while the inputs differ from the value
+    last read and released by a read or when the inputs return to that value.
+    Once a pin watches INT, the inputs are sampled at every physics step.
+
+    With noise, every line sensor bit of a read is flipped with that probability,
+    independently per read, like specks and reflections on the mat.
+    """
+    ADDRESS = 0x38
+    # Unused inputs float high
+    IDLE_BITS = 0xE3
+    LINE_BITS = (0x04, 0x08, 0x10)
+
+    def __init__(self, hardware):
+        self.hardware = hardware
+        self.reset()
+
+    def reset(self, noise=0.0, seed=0):
+        self.value = self.IDLE_BITS
+        self.last_read = self.IDLE_BITS
+        self.interrupt = False
+        self.falling_edges = 0
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.flips = 0
+
+    def watch(self):
+        """
+        Sample at the physics step rate so short pulses on INT are modelled.
+        """
+        world = self.hardware.world
+        if self.step not in world.step_listeners:
+            world.step_listeners.append(self.step)
+
+    def step(self):
+        self.sample()
+        self.__update_interrupt()
+
+    def sample(self, delta_ns=0):
+        value = self.IDLE_BITS
+        for bit, on_line in zip(self.LINE_BITS, self.hardware.world.sensors()):
+            if on_line:
+                value |= bit
+        self.value = value
+
+    def __update_interrupt(self):
+        asserted = self.value != self.last_read
+        if asserted and not self.interrupt:
+            self.falling_edges += 1
+        self.interrupt = asserted
+
+    def write(self, data, start, end):
+        pass
+
+    def read(self, buffer, start, end):
+        value = self.value
+        if self.noise:
+            for bit in self.LINE_BITS:
+                if self.random.random() < self.noise:
+                    value ^= bit
+                    self.flips += 1
+        for index in range(start, end):
+            buffer[index] = value
+        self.last_read = self.value
+        self.interrupt = False
+
+
+class Counter:
+    """
+    countio.Counter compatible edge counter, the only pin it can watch is the
+    sensor expander's INT output.
+    """
+
+    def __init__(self, hardware, pin, edge=None, pull=None):
+        self.hardware = hardware
+        self.pin = pin
+        self.offset = hardware.sensor_expander.falling_edges
+        hardware.sensor_expander.watch()
+
+    @property
+    def count(self):
+        return self.hardware.sensor_expander.falling_edges - self.offset
+
+    def reset(self):
+        self.offset = self.hardware.sensor_expander.falling_edges
+
+    def deinit(self):
+        pass
+
+
+class VirtualI2C:
+    """
+    busio.I2C compatible bus routing transactions to the simulated devices.
+    Counts read and write transactions per device address.
+    """
+
+    def __init__(self):
+        self.devices = {}
+        self.locked = False
+        self.reset()
+
+    def reset(self):
+        self.locked = False
+        self.reads = {}
+        self.writes = {}
+        self.locks = 0
+        self.nacks = {}
+
+    def nack(self, address, count=1):
+        """
+        Make the next count transactions addressed to a device fail as not acknowledged.
+        """
+        self.nacks[address] = self.nacks.get(address, 0) + count
+
+    def transactions(self, address):
+        """
+        Returns the number of read and write transactions addressed to a device.
+        """
+        return self.reads.get(address, 0) + self.writes.get(address, 0)
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        self.locks += 1
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def __device(self, address):
+        device = self.devices.get(address)
+        if self.nacks.get(address):
+            self.nacks[address] -= 1
+            raise OSError(19)
+        if device is None:
+            # CircuitPython reports a NACK as ENODEV
+            raise OSError(19)
+        return device
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self.writes[address] = self.writes.get(address, 0) + 1
+        self.__device(address).write(buffer, start, len(buffer) if end is None else end)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        self.reads[address] = self.reads.get(address, 0) + 1
+        self.__device(address).read(buffer, start, len(buffer) if end is None else end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        self.writeto(address, buffer_out, start=out_start, end=out_end)
+        self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+
+class Display:
+    """
+    The Pico:ed LED matrix, records what was shown.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.shown = []
+
+    def show(self, value, *args, **kwargs):
+        self.shown.append(str(value))
+
+    def scroll(self, value, *args, **kwargs):
+        self.shown.append(str(value))
+
+    def clear(self):
+        self.shown.append("")
+
+
+class Button:
+    """
+    A Pico:ed button. Presses are latched until was_pressed() reports them,
+    a trigger function can press the button when a condition is met.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pressed = False
+        self.trigger = None
+
+    def press(self):
+        self.pressed = True
+
+    def is_pressed(self):
+        return self.pressed or bool(self.trigger and self.trigger())
+
+    def was_pressed(self):
+        pressed = self.is_pressed()
+        self.pressed = False
+        return pressed
+
+
+class NeoPixel:
+    """
+    neopixel.NeoPixel compatible pixel strip.
+    """
+
+    def __init__(self, hardware, pin, n, *, auto_write=True, brightness=1.0, pixel_order=None, bpp=3):
+        self.hardware = hardware
+        self.pin = pin
+        self.n = n
+        self.auto_write = auto_write
+        self.brightness = brightness
+        self.pixels = [(0, 0, 0)] * n
+        self.displayed = list(self.pixels)
+        self.writes = 0
+        hardware.neopixels.append(self)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = tuple(color)
+        if self.auto_write:
+            self.show()
+
+    def fill(self, color):
+        self.pixels = [tuple(color)] * self.n
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        self.writes += 1
+        self.displayed = list(self.pixels)
+
+    def write(self):
+        self.show()
+
+
+class AnalogIn:
+    """
+    analogio.AnalogIn compatible input. P2 measures the battery through the board's divider.
+    """
+    VOLTS_PER_STEP = 0.00898
+
+    def __init__(self, hardware, pin):
+        self.hardware = hardware
+        self.pin = pin
+
+    @property
+    def value(self):
+        if self.pin != "P2":
+            return 0
+        steps = int(self.hardware.world.voltage / self.VOLTS_PER_STEP)
+        return min(max(steps, 0), 1023) * 64
+
+
+class Hardware:
+    """
+    The simulated Pico:ed board with the car's peripherals, all running on one virtual clock.
+    """
+
+    def __init__(self):
+        self.clock = VirtualClock()
+        self.i2c = VirtualI2C()
+        self.display = Display()
+        self.button_a = Button()
+        self.button_b = Button()
+        self.neopixels = []
+        self.world = None
+        self.motor_controller = MotorController(self)
+        self.sensor_expander = SensorExpander(self)
+        self.i2c.devices[MotorController.ADDRESS] = self.motor_controller
+        self.i2c.devices[SensorExpander.ADDRESS] = self.sensor_expander
+
+    def attach(self, world):
+        """
+        Put a new world under the board and reset the peripherals to their power-on state.
+        """
+        self.world = world
+        self.clock.listeners = [world.advance, self.sensor_expander.sample]
+        self.motor_controller.reset()
+        self.sensor_expander.reset()
+        self.i2c.reset()
+        self.display.reset()
+        self.button_a.reset()
+        self.button_b.reset()
+        self.sensor_expander.sample()
+        del self.neopixels[:]
+
+    def modules(self):
+        """
+        Build the stand-in modules.
+
+        Returns:
+            dict: Module name to module object
+        """
+        picoed = types.ModuleType("picoed")
+        picoed.i2c = self.i2c
+        picoed.display = self.display
+        picoed.button_a = self.button_a
+        picoed.button_b = self.button_b
+
+        board = types.ModuleType("board")
+        for number in range(21):
+            setattr(board, "P" + str(number), "P" + str(number))
+
+        neopixel = types.ModuleType("neopixel")
+        neopixel.NeoPixel = lambda pin, n, **kwargs: NeoPixel(self, pin, n, **kwargs)
+
+        analogio = types.ModuleType("analogio")
+        analogio.AnalogIn = lambda pin: AnalogIn(self, pin)
+
+        countio = types.ModuleType("countio")
+        countio.Counter = lambda pin, **kwargs: Counter(self, pin, **kwargs)
+        countio.Edge = types.SimpleNamespace(RISE="rise", FALL="fall", RISE_AND_FALL="rise_and_fall")
+
+        digitalio = types.ModuleType("digitalio")
+        digitalio.Pull = types.SimpleNamespace(UP="up", DOWN="down")
+
+        supervisor = types.ModuleType("supervisor")
+        supervisor.ticks_ms = self.clock.ticks_ms
+
+        return {"picoed": picoed, "board": board, "neopixel": neopixel, "analogio": analogio,
+                "countio": countio, "digitalio": digitalio, "supervisor": supervisor}
+
+
+# const() marks compile time constants on the board, plain values on CPython
+MICROPYTHON = types.ModuleType("micropython")
+MICROPYTHON.const = lambda value: value
+sys.modules.setdefault("micropython", MICROPYTHON)
+
+HARDWARE = None
+
+
+def install():
+    """
+    Register the stand-in modules and patch the time module with the virtual clock.
+    Must run before the robot modules are imported.
+
+    Returns:
+        Hardware: The simulated board, shared by all simulations in the process
+    """
+    global HARDWARE
+    if HARDWARE is None:
+        HARDWARE = Hardware()
+    sys.modules.update(HARDWARE.modules())
+    HARDWARE.clock.install()
+    return HARDWARE
+
+
+def uninstall():
+    """
+    Restore the real time functions and remove the stand-in modules.
+    """
+    if HARDWARE is None:
+        return
+    HARDWARE.clock.uninstall()
+    for name in ("picoed", "board", "neopixel", "analogio", "countio", "digitalio", "supervisor"):
+        sys.modules.pop(name, None)
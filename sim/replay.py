@@ -0,0 +1,495 @@
+"""
+Replay a trace recorded by trace_recorder.TraceRecorder through the unmodified robot stack.
+
+The recorded sensor bytes and battery readings are served by stand-in devices in the
+order the robot read them, the virtual clock jumps to the recorded time of every tick,
+so the robot takes the same decisions without physics or real time. The states it
+enters and the duties it sends are checked against the recording, the first
+difference raises ReplayMismatch. Without the check the replay serves as a benchmark
+of the control tick on real-world input:
+
+    python -m sim.replay trace.bin [--repeat 5] [--profile] [--no-verify]
+
+Accepts the binary file written to flash, or a captured serial log containing the hex
+dump between the trace markers.
+"""
+import argparse
+import binascii
+import contextlib
+import io
+import json
+import struct
+import time
+
+from sim.hardware import VirtualI2C, install
+
+HARDWARE = install()
+
+import trace_recorder  # noqa: E402
+from robot import Robot  # noqa: E402
+from trace_recorder import BATTERY, BUTTON, KIND_MASK, MOTORS, READ, SAME, STATE, TICK, TraceRecorder  # noqa: E402
+
+INPUT_NAMES = {TICK: "a tick", READ: "the sensors", BATTERY: "the battery", BUTTON: "a button press"}
+# Keyword arguments of the recorded constants, in trace_recorder.CONSTANTS order
+CONTROL_UNIT_CONSTANTS = ("duty_slow", "duty_cruise", "duty_turn", "duty_deadband", "gain_p", "gain_d",
+                          "curve_slowdown")
+ROBOT_CONSTANTS = ("break_ms", "move_through_ms", "lost_line_ms")
+
+
+class ReplayMismatch(AssertionError):
+    """
+    The replayed robot read or did something else than the recorded one.
+    """
+
+
+class Trace:
+    """
+    A decoded trace: the recording's configuration and its records in order.
+    Every record is a (kind, time_ns, payload) tuple, time_ns is None for outputs.
+    """
+
+    def __init__(self, flags, initial_raw, speed_scale, constants, turns, start_ns, dropped, records):
+        self.flags = flags
+        self.initial_raw = initial_raw
+        self.speed_scale = speed_scale
+        self.constants = constants
+        self.turns = turns
+        self.start_ns = start_ns
+        self.dropped = dropped
+        self.records = records
+
+    @property
+    def sampling(self):
+        return bool(self.flags & trace_recorder.FLAG_SAMPLING)
+
+    @property
+    def battery(self):
+        return bool(self.flags & trace_recorder.FLAG_BATTERY)
+
+    @property
+    def proportional(self):
+        return bool(self.flags & trace_recorder.FLAG_PROPORTIONAL)
+
+    @property
+    def turn_prediction(self):
+        return bool(self.flags & trace_recorder.FLAG_TURN_PREDICTION)
+
+    @property
+    def full(self):
+        return bool(self.flags & trace_recorder.FLAG_FULL)
+
+    def control_unit_args(self):
+        return dict(zip(CONTROL_UNIT_CONSTANTS, self.constants))
+
+    def robot_args(self):
+        return dict(zip(ROBOT_CONSTANTS, self.constants[len(CONTROL_UNIT_CONSTANTS):]))
+
+    def changed_constants(self):
+        """
+        Returns the recorded constants that differ from the current defaults, as
+        {name: [recorded, default]}. The replay uses the recorded ones.
+        """
+        from control_unit import ControlUnit
+
+        defaults = (ControlUnit.DUTY_SLOW, ControlUnit.DUTY_CRUISE, ControlUnit.DUTY_TURN, ControlUnit.DUTY_DEADBAND,
+                    ControlUnit.GAIN_P, ControlUnit.GAIN_D, ControlUnit.CURVE_SLOWDOWN, Robot.BREAK_MS,
+                    Robot.MOVE_THROUGH_MS, Robot.LOST_LINE_MS)
+        names = CONTROL_UNIT_CONSTANTS + ROBOT_CONSTANTS
+        return {name: [recorded, default] for name, recorded, default in zip(names, self.constants, defaults)
+                if recorded != default}
+
+    def complete(self):
+        """
+        Returns the records of the complete ticks. Once the buffer ran full the last
+        tick may lack records, it is cut off with everything after it.
+        """
+        if not self.full:
+            return self.records
+        last = max((index for index, record in enumerate(self.records) if record[0] == TICK), default=0)
+        return self.records[:last]
+
+    def inputs(self):
+        """
+        Returns the input records of the complete ticks.
+        """
+        return [record for record in self.complete() if record[1] is not None]
+
+    def outputs(self):
+        """
+        Returns the output records of the complete ticks as (tick number, kind, payload) tuples.
+        Outputs before the first tick come from robot.start() and have tick number 0.
+        """
+        return tick_outputs(self.complete())
+
+
+def tick_outputs(records):
+    outputs = []
+    ticks = 0
+    for kind, at, payload in records:
+        if kind == TICK:
+            ticks += 1
+        elif at is None:
+            outputs.append((ticks, kind, payload))
+    return outputs
+
+
+def extract(data):
+    """
+    Returns the binary trace, unwrapping the hex lines of a serial log.
+    """
+    if data.startswith(trace_recorder.MAGIC):
+        return data
+    text = data.decode("utf-8", "replace")
+    begin = text.find(trace_recorder.SERIAL_BEGIN)
+    end = text.find(trace_recorder.SERIAL_END, begin)
+    if begin < 0 or end < 0:
+        raise ValueError("neither a trace nor a serial log containing one")
+    lines = text[begin + len(trace_recorder.SERIAL_BEGIN):end].split()
+    return binascii.unhexlify("".join(lines))
+
+
+def decode(data):
+    """
+    Decode a trace.
+
+    Returns:
+        Trace: The configuration and the records, with absolute times
+    """
+    data = extract(data)
+    (magic, version, flags, initial_raw, speed_scale, turn_count, length, dropped,
+     start_ns) = struct.unpack_from(trace_recorder.HEADER, data)
+    if magic != trace_recorder.MAGIC or version != trace_recorder.VERSION:
+        raise ValueError("unsupported trace version")
+    offset = struct.calcsize(trace_recorder.HEADER)
+    constants = struct.unpack_from(trace_recorder.CONSTANTS, data, offset)
+    offset += struct.calcsize(trace_recorder.CONSTANTS)
+    turns = list(data[offset:offset + turn_count])
+    offset += turn_count
+    end = offset + length
+    if end > len(data):
+        raise ValueError("trace is truncated")
+    records = []
+    now = start_ns
+    raw = None
+    while offset < end:
+        head = data[offset]
+        offset += 1
+        kind = head & KIND_MASK
+        at = None
+        if kind in (TICK, READ, BATTERY, BUTTON):
+            delta = shift = 0
+            while True:
+                byte = data[offset]
+                offset += 1
+                delta |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            now += delta
+            at = now
+        if kind == READ:
+            if not head & SAME:
+                raw = data[offset]
+                offset += 1
+            payload = raw
+        elif kind == BATTERY:
+            payload = data[offset] | data[offset + 1] << 8
+            offset += 2
+        elif kind == MOTORS:
+            payload = bytes(data[offset:offset + 4])
+            offset += 4
+        elif kind in (BUTTON, STATE):
+            payload = head & ~KIND_MASK
+        elif kind == TICK:
+            payload = None
+        else:
+            raise ValueError("unknown record 0x{:02x} at byte {}".format(head, offset - 1))
+        records.append((kind, at, payload))
+    return Trace(flags, initial_raw, speed_scale, constants, turns, start_ns, dropped, records)
+
+
+def load(path):
+    with open(path, "rb") as file:
+        return decode(file.read())
+
+
+def describe(kind, payload):
+    """
+    Returns a record's output in words, for the mismatch report.
+    """
+    if kind == STATE:
+        return "state " + Robot.STATE_NAMES[payload]
+    if kind == MOTORS:
+        # Registers 0x02..0x05: right backward, right forward, left backward, left forward
+        return "duties left {}/{} right {}/{} (forward/backward)".format(payload[3], payload[2], payload[1], payload[0])
+    return "record 0x{:02x}".format(kind)
+
+
+class TraceExpander:
+    """
+    Sensor expander at 0x38 answering every read with the next recorded sensor byte.
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def write(self, data, start, end):
+        pass
+
+    def read(self, buffer, start, end):
+        value = self.replay.take(READ)
+        for index in range(start, end):
+            buffer[index] = value
+
+
+class MotorSink:
+    """
+    Motor controller at 0x70 accepting every write, the outputs are checked on the recorder's records.
+    """
+
+    def write(self, data, start, end):
+        pass
+
+    def read(self, buffer, start, end):
+        for index in range(start, end):
+            buffer[index] = 0
+
+
+class TraceADC:
+    """
+    analogio.AnalogIn stand-in returning the next recorded battery reading.
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    @property
+    def value(self):
+        return self.replay.take(BATTERY) * 64
+
+
+class Replay:
+    """
+    Feeds a trace to a freshly built robot stack on the virtual clock.
+    """
+
+    def __init__(self, trace, verify=True, profiler=None, quiet=True):
+        """
+        Args:
+            trace: Trace to replay
+            verify: Record the replayed run and compare its outputs with the trace
+            profiler: Profiler attached to the robot once it is built
+            quiet: Swallow the robot's print() output
+        """
+        self.trace = trace
+        self.verify = verify
+        self.profiler = profiler
+        self.quiet = quiet
+        self.inputs = trace.inputs()
+        self.position = 0
+        self.running = False
+        self.recorder = None
+        self.robot = None
+        self.sampler = None
+        self.turn_predictor = None
+        self.battery_monitor = None
+
+    def take(self, kind):
+        """
+        Returns the payload of the next input record, which must be of the given kind.
+        Before the run starts the sensors answer with the byte read before the recording.
+        """
+        if not self.running:
+            if kind == READ:
+                return self.trace.initial_raw
+            raise ReplayMismatch("battery read before the run")
+        if self.position >= len(self.inputs):
+            raise ReplayMismatch("read past the end of the trace")
+        record = self.inputs[self.position]
+        if record[0] != kind:
+            raise ReplayMismatch("{:.3f} s: the robot read {} where the trace has {}".format(
+                self.elapsed(record[1]), INPUT_NAMES[kind], INPUT_NAMES[record[0]]))
+        self.position += 1
+        return record[2]
+
+    def elapsed(self, at):
+        return (at - self.trace.start_ns) / 1_000_000_000
+
+    def build(self):
+        """
+        Construct the robot stack the way code.py does, on the trace's devices and with
+        the recorded constants.
+
+        Returns:
+            Robot: The robot
+        """
+        from battery import Battery, BatteryMonitor
+        from control_unit import ControlUnit
+        from display_renderer import DisplayRenderer
+        from i2c_bus import I2CBus
+        from lights import Lights
+        from line_sensors import LineSensors
+        from motors import Motors
+        from navigation import Navigation
+        from obstacle_sensor import ObstacleSensor
+        from sim.hardware import Display, MotorController, SensorExpander
+        from timers import TimerService
+
+        i2c = VirtualI2C()
+        i2c.devices[SensorExpander.ADDRESS] = TraceExpander(self)
+        i2c.devices[MotorController.ADDRESS] = MotorSink()
+        bus = I2CBus(i2c)
+        timers = TimerService()
+        if self.trace.battery:
+            battery = Battery()
+            battery.pin.pin = TraceADC(self)
+            self.battery_monitor = BatteryMonitor(battery, timers)
+        line_sensors = LineSensors(bus=bus)
+        controller = ControlUnit.PROPORTIONAL if self.trace.proportional else ControlUnit.BANG_BANG
+        control_unit = ControlUnit(line_sensors, Motors(bus=bus), ObstacleSensor(), Lights(timers), bus,
+                                   self.battery_monitor, self.trace.speed_scale / 256, controller=controller,
+                                   **self.trace.control_unit_args())
+        if self.trace.sampling:
+            from sensor_sampler import SensorSampler
+
+            self.sampler = SensorSampler(line_sensors, timers)
+        if self.trace.turn_prediction:
+            from turn_predictor import TurnPredictor
+
+            self.turn_predictor = TurnPredictor(control_unit, timers)
+        self.robot = Robot(control_unit, Navigation(turns=list(self.trace.turns)), DisplayRenderer(Display()),
+                           None, timers, **self.trace.robot_args())
+        if self.verify:
+            self.recorder = TraceRecorder(capacity=max(len(self.trace.records) * 16, 4096))
+            self.recorder.attach(self.robot)
+        if self.profiler is not None:
+            self.profiler.attach(self.robot)
+        return self.robot
+
+    def run(self):
+        """
+        Replay the whole trace.
+
+        Returns:
+            dict: Ticks, simulated and wall time, the cost of Robot.drive and the states entered
+        """
+        with contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext():
+            return self.__run()
+
+    def __run(self):
+        clock = HARDWARE.clock
+        # No world moves under a replay
+        clock.listeners = []
+        clock.now_ns = self.trace.start_ns
+        robot = self.robot or self.build()
+        robot.start()
+        self.running = True
+        drive_ns = []
+        wall_start = time.perf_counter_ns()
+        inputs = self.inputs
+        while self.position < len(inputs):
+            kind, at, payload = inputs[self.position]
+            clock.now_ns = at
+            if kind == TICK:
+                if self.battery_monitor is not None and self.battery_monitor.critical():
+                    raise ReplayMismatch("{:.3f} s: the robot stopped for a low battery, the trace goes on".format(
+                        self.elapsed(at)))
+                self.position += 1
+                start = time.perf_counter_ns()
+                robot.drive()
+                drive_ns.append(time.perf_counter_ns() - start)
+            elif kind == READ and self.turn_predictor is not None and self.turn_predictor.polling:
+                # Polled by the turn predictor at the end of a turn
+                self.turn_predictor.poll(at)
+            elif kind == READ and self.sampler is not None:
+                # Read by the sampler between two ticks
+                self.sampler.sample(at)
+            elif kind == BATTERY and self.battery_monitor is not None:
+                # Sampled by a task of its own, as in the asyncio runtime
+                self.battery_monitor.sample()
+            elif kind == BUTTON:
+                self.position += 1
+                if payload == TraceRecorder.BUTTON_B:
+                    break
+            else:
+                raise ReplayMismatch("{:.3f} s: the trace has a read the robot did not make".format(self.elapsed(at)))
+        if not self.trace.full:
+            # The run ended, not the recording
+            robot.stop()
+        wall_ns = time.perf_counter_ns() - wall_start
+        if self.recorder is not None:
+            self.check()
+        simulated = (clock.now_ns - self.trace.start_ns) / 1_000_000_000
+        drive_ns.sort()
+        count = len(drive_ns) or 1
+        return {
+            "ticks": len(drive_ns),
+            "simulated_time": round(simulated, 3),
+            "wall_time": round(wall_ns / 1e9, 4),
+            "speedup": round(simulated / (wall_ns / 1e9), 1) if wall_ns else None,
+            "drive_us_mean": round(sum(drive_ns) / count / 1000, 2),
+            "drive_us_p50": round(drive_ns[len(drive_ns) // 2] / 1000, 2) if drive_ns else 0,
+            "drive_us_p99": round(drive_ns[len(drive_ns) * 99 // 100] / 1000, 2) if drive_ns else 0,
+            "drive_us_max": round(drive_ns[-1] / 1000, 2) if drive_ns else 0,
+            "final_state": Robot.STATE_NAMES[robot.robot_state.current_state],
+            "transitions": sum(1 for _, kind, _ in self.trace.outputs() if kind == STATE),
+            # Whether this run compared its outputs, the timed runs do not
+            "outputs_checked": self.recorder is not None,
+        }
+
+    def check(self):
+        """
+        Compare the outputs of the replayed run with the recorded ones.
+        """
+        stream = io.BytesIO()
+        self.recorder.write(stream)
+        replayed = tick_outputs(decode(stream.getvalue()).records)
+        recorded = self.trace.outputs()
+        for index, (expected, actual) in enumerate(zip(recorded, replayed)):
+            if expected != actual:
+                raise ReplayMismatch("output {} in tick {}: recorded {}, replayed {} in tick {}".format(
+                    index, expected[0], describe(expected[1], expected[2]), describe(actual[1], actual[2]),
+                    actual[0]))
+        if len(recorded) != len(replayed):
+            raise ReplayMismatch("recorded {} outputs, replayed {}".format(len(recorded), len(replayed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded trace and check the robot behaves the same.")
+    parser.add_argument("trace", help="trace file or serial log")
+    parser.add_argument("--repeat", type=int, default=3, help="unverified replays timed as a benchmark, the best counts")
+    parser.add_argument("--profile", action="store_true", help="time the subsystem calls in one more replay")
+    parser.add_argument("--no-verify", action="store_true", help="skip comparing the outputs")
+    args = parser.parse_args()
+
+    trace = load(args.trace)
+    print("{} records, {} turns{}{}".format(len(trace.records), len(trace.turns),
+                                             ", sampler" if trace.sampling else "",
+                                             ", cut off after a full buffer" if trace.full else ""))
+    for name, (recorded, default) in trace.changed_constants().items():
+        print("{} {} as recorded, the default is {}".format(name, recorded, default))
+    verification = "skipped"
+    if not args.no_verify:
+        Replay(trace).run()
+        print("Replay matches the recording")
+        verification = "matched"
+    best = None
+    for _ in range(args.repeat):
+        result = Replay(trace, verify=False).run()
+        if best is None or result["drive_us_mean"] < best["drive_us_mean"]:
+            best = result
+    if best is not None:
+        # The verifying replay's outcome, the timed runs only repeat the same ticks
+        best["verification"] = verification
+        print(json.dumps(best, indent=2))
+    if args.profile:
+        from profiler import Profiler
+
+        # Wall time, the robot's monotonic_ns() runs on the virtual clock
+        profiler = Profiler(clock=time.perf_counter_ns)
+        Replay(trace, verify=False, profiler=profiler).run()
+        profiler.print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Runs the unmodified robot stack over a simulated course.
+"""
+import contextlib
+import io
+import math
+import runpy
+import time
+
+from sim.hardware import SensorExpander, install
+from sim.world import World
+
+
+class Result:
+    """
+    Outcome of a simulated run.
+    """
+
+    def __init__(self, finished, final_state, lap_time, ticks, transitions, distance, wall_time, sensor_reads=0,
+                 transients=0, turn_times=()):
+        self.finished = finished
+        self.final_state = final_state
+        self.lap_time = lap_time
+        self.ticks = ticks
+        self.transitions = transitions
+        self.distance = distance
+        self.wall_time = wall_time
+        self.sensor_reads = sensor_reads
+        self.transients = transients
+        # (spin seconds, settle seconds, overshoot degrees) of every turn
+        self.turn_times = list(turn_times)
+
+    def turn_time(self):
+        """
+        Returns the mean seconds a turn took from its start until the car drove straight along the new line.
+        """
+        if not self.turn_times:
+            return 0.0
+        return sum(spin + settle for spin, settle, _ in self.turn_times) / len(self.turn_times)
+
+    def overshoot(self):
+        """
+        Returns the mean degrees the turns rotated past the new line's heading.
+        """
+        if not self.turn_times:
+            return 0.0
+        return sum(overshoot for _, _, overshoot in self.turn_times) / len(self.turn_times)
+
+    def as_dict(self):
+        return {
+            "finished": self.finished,
+            "final_state": self.final_state,
+            "lap_time": round(self.lap_time, 3),
+            "ticks": self.ticks,
+            "transitions": len(self.transitions),
+            "distance": round(self.distance, 3),
+            "wall_time": round(self.wall_time, 4),
+            "sensor_reads": self.sensor_reads,
+            "transients": self.transients,
+            "turns": len(self.turn_times),
+            "turn_time": round(self.turn_time(), 3),
+            "overshoot_deg": round(self.overshoot(), 2),
+        }
+
+
+class Simulation:
+    """
+    Builds Robot, ControlUnit and Navigation on the simulated hardware and drives them
+    through a course on the virtual clock, as fast as the CPU allows.
+    """
+    TICK = 0.02
+    TERMINAL_STATES = ("F", "E")
+    TELEMETRY_CAPACITY = 6000  # Two minutes of ticks, a whole run
+    INTERRUPT_PIN = "P1"  # Pin the simulated expander's INT output is wired to
+    TURN_STATES = ("TL", "TR")
+    # A turn is settled once the center sensor saw the line, the heading was within SETTLE_DEG of the
+    # line's and changed by less than SETTLE_RATE_DEG per tick for SETTLE_TICKS ticks in a row. The
+    # bang-bang controller drives on with a small heading error while the center sensor sees the line.
+    SETTLE_TICKS = 3
+    SETTLE_DEG = 5.0
+    SETTLE_RATE_DEG = 0.5
+
+    def __init__(self, track, route, car=None, voltage=7.4, discharge_rate=0.0, turns=None, quiet=True,
+                 start_offset=0.03, pose=None, profiler=None, sensor_interrupt=False, sampling=False, sensor_noise=0.0,
+                 seed=0, speed_multiplier=1.0, recorder=None, control_unit_args=None, robot_args=None,
+                 turn_prediction=False, turn_predictor_args=None):
+        """
+        Args:
+            track: TrackMap to drive on
+            route: Node names from the start to the goal, the start pose is on the first edge
+            car: CarModel of the simulated car
+            voltage: Battery voltage at the start
+            discharge_rate: Battery voltage drop in volts per second of driving
+            turns: Turn list for Navigation, compiled from the route when omitted
+            quiet: Swallow the robot's print() output
+            start_offset: Distance of the start pose from the first node in metres
+            pose: Explicit (x, y, heading) start pose, overrides the route's start
+            profiler: Profiler attached to the robot once it is built
+            sensor_interrupt: Read the line sensors only after the expander's INT pin signalled a change
+            sampling: Sample and debounce the line sensors between ticks with a SensorSampler
+            sensor_noise: Probability of every line sensor bit of a read being flipped
+            seed: Seed of the sensor noise
+            speed_multiplier: ControlUnit speed multiplier
+            recorder: TraceRecorder attached to the robot once it is built, for sim/replay.py
+            control_unit_args: Further ControlUnit keyword arguments, e.g. tuned duties
+            robot_args: Further Robot keyword arguments, e.g. tuned timeouts
+            turn_prediction: Taper and end the turns with a TurnPredictor, polling the sensors between ticks
+            turn_predictor_args: Further TurnPredictor keyword arguments, e.g. its window
+        """
+        self.hardware = install()
+        self.track = track
+        self.route = route
+        if pose is None:
+            pose = track.start_pose(route[0], route[1], start_offset)
+        self.world = World(track, pose, car=car, voltage=voltage, discharge_rate=discharge_rate)
+        self.hardware.attach(self.world)
+        self.hardware.sensor_expander.reset(sensor_noise, seed)
+        self.turns = track.route_turns(route) if turns is None else turns
+        self.quiet = quiet
+        self.profiler = profiler
+        self.recorder = recorder
+        self.control_unit_args = control_unit_args or {}
+        self.robot_args = robot_args or {}
+        self.sensor_interrupt = sensor_interrupt
+        self.sampling = sampling
+        self.turn_prediction = turn_prediction
+        self.turn_predictor_args = turn_predictor_args or {}
+        self.turn_predictor = None
+        self.speed_multiplier = speed_multiplier
+        self.sampler = None
+        self.robot = None
+        self.renderer = None
+        self.bus = None
+        self.timers = None
+        self.battery_monitor = None
+        self.telemetry = None
+        self.start_ns = None
+        self.state = None
+        self.ticks = 0
+        self.transitions = []
+        self.turn_times = []
+        self.turn_started = None
+        self.turn_acquired = None
+        self.turn_sign = 0
+        self.overshoot = 0.0
+        self.heading = 0.0
+        self.settled = 0
+
+    def build(self):
+        """
+        Construct the robot stack the way code.py does.
+
+        Returns:
+            Robot: The robot wired to the simulated hardware
+        """
+        from battery import Battery, BatteryMonitor
+        from control_unit import ControlUnit
+        from display_renderer import DisplayRenderer
+        from i2c_bus import I2CBus
+        from lights import Lights
+        from line_sensors import LineSensors
+        from motors import Motors
+        from navigation import Navigation
+        from obstacle_sensor import ObstacleSensor
+        from robot import Robot
+        from telemetry import Telemetry
+        from timers import TimerService
+
+        self.bus = I2CBus(self.hardware.i2c)
+        self.timers = TimerService()
+        self.battery_monitor = BatteryMonitor(Battery(), self.timers)
+        line_sensors = LineSensors(bus=self.bus, interrupt_pin=self.INTERRUPT_PIN if self.sensor_interrupt else None)
+        control_unit_args = dict({"speed_multiplier": self.speed_multiplier}, **self.control_unit_args)
+        control_unit = ControlUnit(line_sensors, Motors(bus=self.bus), ObstacleSensor(), Lights(self.timers), self.bus,
+                                   self.battery_monitor, **control_unit_args)
+        if self.sampling:
+            from sensor_sampler import SensorSampler
+
+            self.sampler = SensorSampler(line_sensors, self.timers)
+        if self.turn_prediction:
+            from turn_predictor import TurnPredictor
+
+            self.turn_predictor = TurnPredictor(control_unit, self.timers, **self.turn_predictor_args)
+        self.renderer = DisplayRenderer(self.hardware.display)
+        self.telemetry = Telemetry(capacity=self.TELEMETRY_CAPACITY, names=Robot.STATE_NAMES)
+        self.robot = Robot(control_unit, Navigation(turns=list(self.turns)), self.renderer, self.telemetry,
+                           self.timers, **self.robot_args)
+        if self.profiler is not None:
+            self.profiler.attach(self.robot)
+        if self.recorder is not None:
+            self.recorder.attach(self.robot)
+        return self.robot
+
+    def output(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+    def start(self):
+        """
+        Start the robot the way code.py does before entering the main loop.
+        """
+        robot = self.robot or self.build()
+        with self.output():
+            robot.start()
+        self.start_ns = self.hardware.clock.now_ns
+        self.state = robot.robot_state.name()
+        self.ticks = 0
+        self.transitions = []
+        self.turn_times = []
+        self.turn_started = None
+        self.turn_acquired = None
+        self.turn_sign = 0
+        self.overshoot = 0.0
+        self.heading = 0.0
+        self.settled = 0
+
+    def elapsed(self):
+        """
+        Returns the simulated seconds since start().
+        """
+        return (self.hardware.clock.now_ns - self.start_ns) / 1_000_000_000
+
+    def step(self, tick=TICK):
+        """
+        Run one control tick, then let the world move for one period.
+        The turn predictor and the sampler, if any, read the sensors in that period the way
+        code.py's idle hook does.
+
+        Returns:
+            str: The robot state after the tick
+        """
+        clock = self.hardware.clock
+        deadline = clock.now_ns + int(tick * 1_000_000_000)
+        self.robot.drive()
+        self.renderer.service()
+        if self.turn_predictor is not None:
+            self.turn_predictor.service(deadline)
+        if self.sampler is not None:
+            self.sampler.service(deadline)
+        self.ticks += 1
+        state = self.robot.robot_state.name()
+        if state != self.state:
+            self.__time_turn(self.state, state)
+            self.state = state
+            self.transitions.append((self.elapsed(), state))
+        if self.turn_acquired is not None:
+            self.__settle_turn(state)
+        if self.sampler is None and self.turn_predictor is None:
+            time.sleep(tick)
+        else:
+            time.sleep((deadline - clock.now_ns) / 1_000_000_000)
+        return state
+
+    def __time_turn(self, previous, state):
+        """
+        Note when a turn starts and when it finds its line.
+        """
+        if state in self.TURN_STATES:
+            self.turn_started = self.elapsed()
+            self.turn_sign = 1 if state == "TL" else -1
+        elif previous in self.TURN_STATES and self.turn_started is not None:
+            self.turn_acquired = self.elapsed()
+            self.overshoot = 0.0
+            self.heading = self.world.heading
+            self.settled = 0
+
+    def __settle_turn(self, state):
+        """
+        Track how far the car rotates past the new line and finish timing the turn once
+        it drives straight along it, or stops driving.
+        """
+        world = self.world
+        _, (x, y), _ = world.sensor_positions()
+        error = world.heading - self.track.line_heading(x, y, world.heading)
+        error = math.degrees(math.atan2(math.sin(error), math.cos(error))) * self.turn_sign
+        self.overshoot = max(self.overshoot, error)
+        rate = abs(math.degrees(world.heading - self.heading))
+        self.heading = world.heading
+        if state == "D" and abs(error) < self.SETTLE_DEG and rate < self.SETTLE_RATE_DEG and world.sensors()[1]:
+            self.settled += 1
+        else:
+            self.settled = 0
+        if self.settled >= self.SETTLE_TICKS or state != "D":
+            self.turn_times.append((self.turn_acquired - self.turn_started, self.elapsed() - self.turn_acquired,
+                                    self.overshoot))
+            self.turn_started = self.turn_acquired = None
+
+    def run(self, timeout=120.0, tick=TICK):
+        """
+        Drive until the robot reaches a terminal state or the timeout expires.
+
+        Args:
+            timeout: Simulated seconds after which the run is abandoned
+            tick: Control period in seconds
+
+        Returns:
+            Result: Outcome of the run
+        """
+        wall_start = time.perf_counter()
+        self.start()
+        with self.output():
+            while self.elapsed() < timeout:
+                if self.step(tick) in self.TERMINAL_STATES:
+                    break
+            self.robot.stop()
+        return Result(
+            finished=self.state == "F",
+            final_state=self.state,
+            lap_time=self.elapsed(),
+            ticks=self.ticks,
+            transitions=self.transitions,
+            distance=self.world.distance,
+            wall_time=time.perf_counter() - wall_start,
+            sensor_reads=self.bus.transactions.get(SensorExpander.ADDRESS, 0),
+            transients=self.robot.control_unit.line_sensors.transients,
+            turn_times=self.turn_times,
+        )
+
+    def run_code(self, path="code.py", timeout=120.0, telemetry_path=None):
+        """
+        Run the board's entry point. Button A is pressed right away and button B once
+        the display shows a terminal state or the timeout expires.
+
+        Args:
+            path: Path of the entry point script
+            timeout: Simulated seconds after which button B is pressed
+            telemetry_path: File the telemetry dump is written to, the script runs with its
+                TELEMETRY flag switched on. The script runs unmodified without it.
+        """
+        hardware = self.hardware
+        deadline = hardware.clock.now_ns + int(timeout * 1_000_000_000)
+        hardware.button_a.press()
+        hardware.button_b.trigger = lambda: (
+            hardware.clock.now_ns >= deadline
+            or bool(hardware.display.shown and hardware.display.shown[-1] in self.TERMINAL_STATES)
+        )
+        with self.output():
+            if telemetry_path is None:
+                runpy.run_path(path, run_name="__main__")
+            else:
+                import telemetry
+
+                telemetry.DUMP_PATH = telemetry_path
+                with open(path) as file:
+                    source = file.read().replace("\nTELEMETRY = False\n", "\nTELEMETRY = True\n", 1)
+                exec(compile(source, path, "exec"), {"__name__": "__main__", "__file__": path})
+        return hardware.display.shown
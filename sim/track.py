@@ -0,0 +1,190 @@
+"""
+Track maps: intersections (nodes) joined by straight line segments (edges).
+
+Maps are stored as JSON:
+
+    {"name": "loop", "nodes": {"A": [0.0, 0.0], "B": [0.4, 0.0]}, "edges": [["A", "B"], ["B", "C", 0.55]]}
+
+Node coordinates are in metres. An edge may give its driven length, e.g. for a curved
+line, otherwise the straight distance between its nodes is used.
+"""
+import json
+import math
+
+from navigation import Navigation
+
+
+class TrackMap:
+    """
+    A course made of named nodes with coordinates in metres and straight edges between them.
+    Dead-end nodes get a short perpendicular bar, like the finish line taped on the floor,
+    so the robot detects them as intersections.
+    """
+    LINE_WIDTH = 0.015
+    BAR_LENGTH = 0.12
+
+    def __init__(self, nodes, edges, line_width=LINE_WIDTH, name="track"):
+        """
+        Args:
+            nodes: Mapping of node name to (x, y) coordinates in metres
+            edges: Iterable of (node, node) or (node, node, length in metres) tuples
+            line_width: Width of the taped line in metres
+            name: Name of the track
+        """
+        self.nodes = dict(nodes)
+        self.edges = [tuple(edge[:2]) for edge in edges]
+        self.lengths = {}
+        for edge in edges:
+            if len(edge) > 2:
+                self.lengths[edge[0], edge[1]] = self.lengths[edge[1], edge[0]] = float(edge[2])
+        self.line_width = line_width
+        self.name = name
+        self.neighbours = {node: [] for node in self.nodes}
+        for a, b in self.edges:
+            if a not in self.nodes or b not in self.nodes:
+                raise ValueError("Edge {}-{} references an unknown node".format(a, b))
+            self.neighbours[a].append(b)
+            self.neighbours[b].append(a)
+        self.segments = self.__build_segments()
+
+    def __build_segments(self):
+        segments = [(self.nodes[a], self.nodes[b]) for a, b in self.edges]
+        for node, neighbours in self.neighbours.items():
+            if len(neighbours) != 1:
+                continue
+            (x, y), (nx, ny) = self.nodes[node], self.nodes[neighbours[0]]
+            length = math.hypot(nx - x, ny - y)
+            px, py = -(ny - y) / length * self.BAR_LENGTH / 2, (nx - x) / length * self.BAR_LENGTH / 2
+            segments.append(((x - px, y - py), (x + px, y + py)))
+        return segments
+
+    def edge_length(self, a, b):
+        """
+        Returns the length of the edge between two nodes in metres.
+        """
+        if (a, b) in self.lengths:
+            return self.lengths[a, b]
+        (ax, ay), (bx, by) = self.nodes[a], self.nodes[b]
+        return math.hypot(bx - ax, by - ay)
+
+    def to_dict(self):
+        """
+        Returns the map in its JSON form.
+        """
+        edges = []
+        for a, b in self.edges:
+            edges.append([a, b, self.lengths[a, b]] if (a, b) in self.lengths else [a, b])
+        return {"name": self.name, "line_width": self.line_width,
+                "nodes": {node: list(xy) for node, xy in self.nodes.items()}, "edges": edges}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a map from its JSON form.
+        """
+        return cls({node: tuple(xy) for node, xy in data["nodes"].items()}, data["edges"],
+                   line_width=data.get("line_width", cls.LINE_WIDTH), name=data.get("name", "track"))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a map from a JSON file.
+        """
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
+
+    def save(self, path):
+        """
+        Write the map to a JSON file.
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=1)
+            file.write("\n")
+
+    def heading(self, a, b):
+        """
+        Returns the heading in radians when driving from node a to node b.
+        """
+        (ax, ay), (bx, by) = self.nodes[a], self.nodes[b]
+        return math.atan2(by - ay, bx - ax)
+
+    def line_heading(self, x, y, heading):
+        """
+        Returns the heading in radians along the line under a point, in the direction closer
+        to the given heading. Of crossing lines the one closest to the heading is taken, off
+        the line the nearest one.
+        """
+        limit = (self.line_width / 2) ** 2
+        best = None
+        for (ax, ay), (bx, by) in self.segments:
+            dx, dy = bx - ax, by - ay
+            t = ((x - ax) * dx + (y - ay) * dy) / (dx * dx + dy * dy)
+            t = 0.0 if t < 0 else 1.0 if t > 1 else t
+            distance = max((ax + t * dx - x) ** 2 + (ay + t * dy - y) ** 2, limit)
+            line = math.atan2(dy, dx)
+            delta = math.atan2(math.sin(line - heading), math.cos(line - heading))
+            if abs(delta) > math.pi / 2:
+                line += math.pi
+                delta -= math.copysign(math.pi, delta)
+            if best is None or (distance, abs(delta)) < best[0]:
+                best = ((distance, abs(delta)), line)
+        return best[1]
+
+    def turn(self, previous, node, following):
+        """
+        Classify the turn at a node of a route.
+
+        Returns:
+            int: Navigation.LEFT, Navigation.RIGHT or Navigation.FORWARD
+        """
+        delta = self.heading(node, following) - self.heading(previous, node)
+        delta = math.atan2(math.sin(delta), math.cos(delta))
+        if abs(delta) < math.pi / 4:
+            return Navigation.FORWARD
+        if abs(delta) > 3 * math.pi / 4:
+            raise ValueError("U-turn at node {} is not supported".format(node))
+        return Navigation.LEFT if delta > 0 else Navigation.RIGHT
+
+    def route_turns(self, route):
+        """
+        Compile a route into the turn list consumed by Navigation.decide_turn().
+        Every node between the first and the last one is an intersection the robot stops at.
+
+        Args:
+            route: Sequence of node names, starting at the start node and ending at the goal
+
+        Returns:
+            list: Navigation turn constants, one per intermediate node
+        """
+        for a, b in zip(route, route[1:]):
+            if b not in self.neighbours[a]:
+                raise ValueError("No edge between {} and {}".format(a, b))
+        return [self.turn(route[i - 1], route[i], route[i + 1]) for i in range(1, len(route) - 1)]
+
+    def start_pose(self, a, b, offset=0.03):
+        """
+        Pose of the robot axle on the edge from a to b, a little past node a.
+
+        Returns:
+            tuple: x, y and heading in radians
+        """
+        (ax, ay) = self.nodes[a]
+        heading = self.heading(a, b)
+        return ax + offset * math.cos(heading), ay + offset * math.sin(heading), heading
+
+    def on_line(self, x, y, margin=0.0):
+        """
+        Returns True if the point lies on the taped line.
+
+        Args:
+            margin: Radius of the sensor's field of view, widening the line by as much on each side
+        """
+        limit = (self.line_width / 2 + margin) ** 2
+        for (ax, ay), (bx, by) in self.segments:
+            dx, dy = bx - ax, by - ay
+            t = ((x - ax) * dx + (y - ay) * dy) / (dx * dx + dy * dy)
+            t = 0.0 if t < 0 else 1.0 if t > 1 else t
+            ex, ey = ax + t * dx - x, ay + t * dy - y
+            if ex * ex + ey * ey <= limit:
+                return True
+        return False
@@ -0,0 +1,123 @@
+"""
+Differential-drive kinematic model of the car driving over a track map.
+"""
+import math
+
+
+class CarModel:
+    """
+    Physical parameters of the simulated car.
+    """
+
+    def __init__(self, wheel_base=0.1, max_speed=0.5, deadband=20, time_constant=0.1,
+                 sensor_lookahead=0.07, sensor_spacing=0.016, sensor_radius=0.0, nominal_voltage=7.4):
+        """
+        Args:
+            wheel_base: Distance between the wheels in metres
+            max_speed: Wheel speed at full duty and nominal voltage in m/s
+            deadband: Duty below which a wheel does not turn
+            time_constant: First order lag of the wheel speed in seconds
+            sensor_lookahead: Distance of the line sensors ahead of the axle in metres
+            sensor_spacing: Lateral distance between neighbouring line sensors in metres
+            sensor_radius: Radius of a sensor's field of view on the floor in metres
+            nominal_voltage: Battery voltage at which max_speed is reached
+        """
+        self.wheel_base = wheel_base
+        self.max_speed = max_speed
+        self.deadband = deadband
+        self.time_constant = time_constant
+        self.sensor_lookahead = sensor_lookahead
+        self.sensor_spacing = sensor_spacing
+        self.sensor_radius = sensor_radius
+        self.nominal_voltage = nominal_voltage
+
+
+class World:
+    """
+    State of the car on the track: pose, wheel speeds, motor duties and battery voltage.
+    The physics is integrated in small fixed steps whenever the virtual clock advances.
+    """
+    STEP_NS = 2_000_000
+
+    def __init__(self, track, pose, car=None, voltage=7.4, discharge_rate=0.0):
+        """
+        Args:
+            track: TrackMap the car drives on
+            pose: Initial (x, y, heading) of the axle centre
+            car: CarModel, defaults to the Joy-Car like parameters
+            voltage: Initial battery voltage
+            discharge_rate: Battery voltage drop in volts per second of driving
+        """
+        self.track = track
+        self.car = car or CarModel()
+        self.x, self.y, self.heading = pose
+        self.left_speed = 0.0
+        self.right_speed = 0.0
+        # Signed duties, positive is forward
+        self.left_duty = 0
+        self.right_duty = 0
+        self.voltage = voltage
+        self.discharge_rate = discharge_rate
+        self.time_ns = 0
+        # Called after every physics step, e.g. to sample inputs at the step rate
+        self.step_listeners = []
+        self.distance = 0.0
+
+    def set_duties(self, left, right):
+        """
+        Set the signed motor duties (-255..255) decoded from the motor controller.
+        """
+        self.left_duty = left
+        self.right_duty = right
+
+    def advance(self, delta_ns):
+        """
+        Integrate the physics over delta_ns nanoseconds.
+        """
+        while delta_ns > 0:
+            step = min(delta_ns, self.STEP_NS)
+            self.__step(step / 1_000_000_000)
+            delta_ns -= step
+            self.time_ns += step
+            for listener in self.step_listeners:
+                listener()
+
+    def __wheel_target(self, duty):
+        car = self.car
+        magnitude = abs(duty)
+        if magnitude <= car.deadband:
+            return 0.0
+        speed = (magnitude - car.deadband) / (255 - car.deadband) * car.max_speed * self.voltage / car.nominal_voltage
+        return speed if duty > 0 else -speed
+
+    def __step(self, dt):
+        car = self.car
+        blend = 1 - math.exp(-dt / car.time_constant)
+        self.left_speed += (self.__wheel_target(self.left_duty) - self.left_speed) * blend
+        self.right_speed += (self.__wheel_target(self.right_duty) - self.right_speed) * blend
+        speed = (self.left_speed + self.right_speed) / 2
+        turn_rate = (self.right_speed - self.left_speed) / car.wheel_base
+        heading = self.heading + turn_rate * dt / 2
+        self.x += speed * math.cos(heading) * dt
+        self.y += speed * math.sin(heading) * dt
+        self.heading += turn_rate * dt
+        self.distance += abs(speed) * dt
+        if self.left_duty or self.right_duty:
+            self.voltage -= self.discharge_rate * dt
+
+    def sensor_positions(self):
+        """
+        Returns the (x, y) positions of the left, center and right line sensors.
+        """
+        car = self.car
+        cos, sin = math.cos(self.heading), math.sin(self.heading)
+        fx, fy = self.x + car.sensor_lookahead * cos, self.y + car.sensor_lookahead * sin
+        lx, ly = -sin * car.sensor_spacing, cos * car.sensor_spacing
+        return (fx + lx, fy + ly), (fx, fy), (fx - lx, fy - ly)
+
+    def sensors(self):
+        """
+        Returns which of the left, center and right sensors see the line.
+        """
+        margin = self.car.sensor_radius
+        return tuple(self.track.on_line(x, y, margin) for x, y in self.sensor_positions())
@@ -1,33 +1,144 @@
-from picoed import display
-
-class State:
+class StateMachine:
     """
-    Manages the robot's current state with a lambda function to determine state persistence.
+    Table driven state machine with small integer states.
+
+    Transitions are rows of a table compiled once at startup. Firing a transition
+    enters its target state and arms its guard: when the guard passes, update()
+    moves on to the guard's follow-up state. Leaving a state runs its exit handler
+    right away, the entry handler of the new state runs in update() at the start of
+    its first tick. A transition fired by a tick handler thus does not override what
+    that tick already staged for the actuators. The state timer is a slot of the
+    TimerService, guards and handlers are preallocated callables, so dispatching a
+    tick is O(1) and allocates nothing.
     """
-    def __init__(self, default_state="driving", display_state=None):
-        self.current_state = default_state
+    NO_STATE = -1
+
+    # Built-in guards, further guards are passed to the constructor
+    GUARD_ALWAYS = 0
+    GUARD_NEVER = 1
+    GUARD_TIMER = 2
+
+    __slots__ = ("names", "transitions", "default_state", "guards", "guard_names", "renderer", "current_state",
+                 "guard", "next_state", "timers", "timer", "entry_handlers", "exit_handlers", "entering", "log_changes")
+
+    def __init__(self, names, transitions, timers, default_state=0, guards=(), guard_names=(), renderer=None,
+                 entry_handlers=None, exit_handlers=None, log_changes=False):
+        """
+        Initialize the state machine.
+
+        Args:
+            names: Display name of every state, indexed by state ID
+            transitions: Rows of (source state, trigger, target state, guard, guard target, timeout ms)
+            timers: TimerService running the state timer
+            default_state: State entered when a passing guard has no follow-up state
+            guards: Callables for the guard IDs following the built-in ones
+            guard_names: Names of the extra guards, used by dump()
+            renderer: DisplayRenderer the state is requested on whenever it changes
+            entry_handlers: Callable or None per state ID, called on the first tick in the state
+            exit_handlers: Callable or None per state ID, called when the state is left
+            log_changes: Print every change of state, for debugging only: the message is built
+                and written to the serial console inside the control tick
+        """
+        self.names = names
+        self.transitions = transitions
         self.default_state = default_state
-        self.state_condition = lambda: True  # Default condition that always returns True
-        self.next_state = None
-        self.display_state = display_state
+        self.guards = (self.__always, self.__never, self.__timer_expired) + tuple(guards)
+        self.guard_names = ("always", "never", "timer") + tuple(guard_names)
+        self.renderer = renderer
+        self.current_state = default_state
+        self.guard = StateMachine.GUARD_ALWAYS
+        self.next_state = StateMachine.NO_STATE
+        self.timers = timers
+        self.timer = timers.register("state")
+        no_handlers = (None,) * len(names)
+        self.entry_handlers = no_handlers if entry_handlers is None else tuple(entry_handlers)
+        self.exit_handlers = no_handlers if exit_handlers is None else tuple(exit_handlers)
+        # Set until update() ran the entry handler of the current state
+        self.entering = False
+        self.log_changes = log_changes
+
+    def __always(self):
+        return True
+
+    def __never(self):
+        return False
+
+    def __timer_expired(self):
+        return self.timers.expired(self.timer)
 
-    def set_state(self, new_state, condition=lambda: True, next_state=None):
-        if self.current_state != new_state:
-            print(f"State changed from {self.current_state} to {new_state}")
+    def name(self, state=None):
         """
-        Set a new state with a condition lambda function.
-        The state will persist until the condition returns True.
+        Returns the display name of the given state, or of the current one.
         """
+        return self.names[self.current_state if state is None else state]
+
+    def fire(self, transition):
+        """
+        Take a transition from the table: enter its target state and arm its guard.
+
+        Args:
+            transition: Index of the row in the transition table
+        """
+        row = self.transitions[transition]
+        self.timers.start(self.timer, row[5])
+        self.set_state(row[2], row[3], row[4])
+
+    def set_state(self, new_state, guard=GUARD_ALWAYS, next_state=NO_STATE):
+        """
+        Enter a state. It is kept until the guard passes, then next_state is entered.
+        A change of state runs the exit handler of the previous state and leaves the
+        entry handler of the new one to update(), re-entering the current state runs neither.
+
+        Args:
+            new_state: State to enter
+            guard: Guard ID deciding when to leave the state
+            next_state: State entered once the guard passes, NO_STATE for the default state
+        """
+        previous = self.current_state
+        if previous != new_state:
+            if self.log_changes:
+                print("State changed from " + self.names[previous] + " to " + self.names[new_state])
+            if self.renderer is not None:
+                self.renderer.request(self.names[new_state])
+            handler = self.exit_handlers[previous]
+            if handler is not None:
+                handler()
+            self.entering = True
         self.current_state = new_state
-        self.state_condition = condition
+        self.guard = guard
         self.next_state = next_state
-        if self.display_state:
-            display.show(self.current_state)
-
 
     def update(self):
         """
-        Check if the state condition is met, and if so, revert to 'driving'.
+        Check the armed guard and leave the state once it passes, then run the entry
+        handler if this is the first tick in the state.
+        """
+        if self.guards[self.guard]():
+            self.set_state(self.default_state if self.next_state == StateMachine.NO_STATE else self.next_state)
+        if self.entering:
+            self.entering = False
+            handler = self.entry_handlers[self.current_state]
+            if handler is not None:
+                handler()
+
+    def dump(self):
+        """
+        Describe the transition graph, one edge per line.
+
+        Returns:
+            list: Lines such as "D --intersection--> B" and "B --timer 500 ms--> MTI"
         """
-        if self.state_condition():
-            self.set_state(self.next_state or self.default_state)
+        lines = []
+        for source, trigger, target, guard, guard_target, timeout in self.transitions:
+            lines.append(self.names[source] + " --" + trigger + "--> " + self.names[target])
+            if guard == StateMachine.GUARD_NEVER:
+                continue
+            label = self.guard_names[guard]
+            if guard == StateMachine.GUARD_TIMER:
+                label += " " + str(timeout) + " ms"
+            if guard_target == StateMachine.NO_STATE:
+                guard_target = self.default_state
+            line = self.names[target] + " --" + label + "--> " + self.names[guard_target]
+            if line not in lines:
+                lines.append(line)
+        return lines
@@ -0,0 +1,122 @@
+from array import array
+from binascii import hexlify
+import struct
+
+# Dump layout: header, state names, then the columns oldest sample first
+MAGIC = b"JCT1"
+VERSION = 2
+HEADER = "<4sHHIH"  # magic, version, samples in the dump, samples recorded, length of the names
+SERIAL_BEGIN = "--- telemetry begin ---"
+SERIAL_END = "--- telemetry end ---"
+DUMP_PATH = "/telemetry.bin"
+# The sample times are supervisor.ticks_ms() readings, wrapping at this period
+TICKS_PERIOD = 1 << 29
+
+
+class Telemetry:
+    """
+    Records one sample per control tick into a fixed-size ring buffer.
+
+    All storage is preallocated in typed arrays, one per column, so recording a
+    sample only stores integers and creates no objects. The times are ticks_ms()
+    readings, small ints on the board, where monotonic_ns() readings and their
+    differences would be heap allocated big ints. When the buffer is full the
+    oldest samples are overwritten. The buffer is written out after the run.
+    """
+    CAPACITY = 1500  # 30 seconds at 50 Hz, 12 bytes per sample
+
+    def __init__(self, capacity=CAPACITY, names=()):
+        """
+        Initialize the recorder.
+
+        Args:
+            capacity: Number of samples kept
+            names: State names indexed by state ID, stored in the dump for the decoder
+        """
+        self.capacity = capacity
+        self.names = names
+        self.times = array("I", [0] * capacity)  # ticks_ms() at the start of the tick
+        self.tick_ms = array("H", [0] * capacity)  # Duration of the tick
+        self.sensors = bytearray(capacity)  # Raw sensor expander byte
+        self.states = bytearray(capacity)  # State ID after the tick
+        self.duties = bytearray(4 * capacity)  # PWM registers 0x02..0x05 as staged by Motors.move
+        self.head = 0
+        self.recorded = 0
+
+    def record(self, now, raw, state, frame, tick_ms):
+        """
+        Store one sample.
+
+        Args:
+            now: ticks_ms() timestamp of the tick
+            raw: Raw sensor byte of the tick
+            state: State ID after the tick
+            frame: Motors frame buffer, bytes 1-4 are the PWM duties
+            tick_ms: Duration of the tick in milliseconds
+        """
+        index = self.head
+        self.times[index] = now
+        self.tick_ms[index] = tick_ms if tick_ms < 0xFFFF else 0xFFFF
+        self.sensors[index] = raw
+        self.states[index] = state
+        duty = index * 4
+        self.duties[duty] = frame[1]
+        self.duties[duty + 1] = frame[2]
+        self.duties[duty + 2] = frame[3]
+        self.duties[duty + 3] = frame[4]
+        index += 1
+        self.head = index if index < self.capacity else 0
+        self.recorded += 1
+
+    def count(self):
+        """
+        Returns the number of samples in the buffer.
+        """
+        return self.recorded if self.recorded < self.capacity else self.capacity
+
+    def write(self, stream):
+        """
+        Write the dump to a binary stream.
+
+        Args:
+            stream: Object with a write() method taking bytes
+        """
+        count = self.count()
+        # The oldest sample is at the head once the buffer wrapped
+        first = self.head if self.recorded > self.capacity else 0
+        names = ",".join(self.names).encode()
+        stream.write(struct.pack(HEADER, MAGIC, VERSION, count, self.recorded, len(names)))
+        stream.write(names)
+        for column, width in ((self.times, 1), (self.tick_ms, 1), (self.sensors, 1), (self.states, 1), (self.duties, 4)):
+            stream.write(bytes(column[first * width:count * width]))
+            stream.write(bytes(column[:first * width]))
+
+    def save(self, path=None):
+        """
+        Write the dump to a file, or as hex lines over serial when the filesystem
+        is read-only because it is mounted over USB.
+
+        Args:
+            path: File to write, DUMP_PATH when omitted
+        """
+        if path is None:
+            path = DUMP_PATH
+        try:
+            with open(path, "wb") as file:
+                self.write(file)
+            print("Telemetry written to " + path)
+        except OSError:
+            print(SERIAL_BEGIN)
+            self.write(HexWriter())
+            print(SERIAL_END)
+
+
+class HexWriter:
+    """
+    Stream printing everything written to it as lines of hex digits.
+    """
+    LINE_BYTES = 48
+
+    def write(self, data):
+        for start in range(0, len(data), HexWriter.LINE_BYTES):
+            print(hexlify(data[start:start + HexWriter.LINE_BYTES]).decode())
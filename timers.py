@@ -0,0 +1,177 @@
+from micropython import const
+from time import monotonic_ns
+from supervisor import ticks_ms
+
+# supervisor.ticks_ms() counts milliseconds modulo 2**29, small ints on the board
+_TICKS_MASK = const((1 << 29) - 1)
+_TICKS_HALF = const(1 << 28)
+
+
+def ticks_add(ticks, delta):
+    """
+    Returns the millisecond tick delta milliseconds after ticks, wrapped like ticks_ms().
+    """
+    return (ticks + delta) & _TICKS_MASK
+
+
+def ticks_diff(end, start):
+    """
+    Returns the signed milliseconds from start to end, correct across the wrap of
+    ticks_ms() as long as they are less than about three days apart.
+    """
+    return ((end - start + _TICKS_HALF) & _TICKS_MASK) - _TICKS_HALF
+
+
+class TimerService:
+    """
+    Central service for all deadlines of the robot.
+
+    Timers are registered once at startup and addressed by small integer IDs
+    afterwards, their deadlines live in preallocated slots. tick() reads the clock
+    once per control tick and every query in that tick answers from that reading.
+    Time is counted in supervisor.ticks_ms() milliseconds: they wrap at 2**29 and
+    stay small ints on the board, where monotonic_ns() values and sums are heap
+    allocated big ints. So starting, cancelling and querying timers allocates nothing.
+
+    The nanosecond clock is kept for measuring and for the sensor polling between
+    ticks, the control tick itself does not read it.
+    """
+    CAPACITY = 8
+    NOT_RUNNING = -1
+
+    __slots__ = ("clock", "ticks", "names", "deadlines", "callbacks", "capacity", "count", "now", "next_callback")
+
+    def __init__(self, capacity=CAPACITY, clock=None, ticks=None):
+        """
+        Initialize the timer service.
+
+        Args:
+            capacity: Number of timer slots
+            clock: Function returning nanoseconds, monotonic_ns() when omitted
+            ticks: Function returning wrapping milliseconds, supervisor.ticks_ms() when omitted
+        """
+        self.clock = monotonic_ns if clock is None else clock
+        self.ticks = ticks_ms if ticks is None else ticks
+        self.names = []
+        self.deadlines = [TimerService.NOT_RUNNING] * capacity
+        self.callbacks = [None] * capacity
+        self.capacity = capacity
+        self.count = 0
+        self.now = self.ticks()
+        # Earliest deadline with a callback, tick() only scans the slots once it passed
+        self.next_callback = TimerService.NOT_RUNNING
+
+    def register(self, name, callback=None):
+        """
+        Reserve a timer slot. Call at startup only.
+
+        Args:
+            name: Name of the timer, for debugging
+            callback: Function called once when the timer expires, it stays expired without one
+
+        Returns:
+            int: ID of the timer
+        """
+        if self.count >= self.capacity:
+            raise RuntimeError("No free timer slot for " + name)
+        timer = self.count
+        self.count += 1
+        self.names.append(name)
+        self.callbacks[timer] = callback
+        return timer
+
+    def tick(self, now=None):
+        """
+        Advance the service to the current time and run the callbacks of expired timers.
+
+        Args:
+            now: Millisecond tick, read from ticks_ms() when omitted
+
+        Returns:
+            int: The millisecond tick of this tick
+        """
+        if now is None:
+            now = self.ticks()
+        self.now = now
+        if self.next_callback != TimerService.NOT_RUNNING and ticks_diff(now, self.next_callback) >= 0:
+            self.__run_callbacks()
+        return now
+
+    def start(self, timer, duration_ms):
+        """
+        (Re)start a timer, measured from the current tick.
+
+        Args:
+            timer: Timer ID
+            duration_ms: Milliseconds until the timer expires, 0 expires right away
+        """
+        deadline = (self.now + duration_ms) & _TICKS_MASK
+        self.deadlines[timer] = deadline
+        if self.callbacks[timer] is not None:
+            if self.next_callback == TimerService.NOT_RUNNING or ticks_diff(deadline, self.next_callback) < 0:
+                self.next_callback = deadline
+
+    def cancel(self, timer):
+        """
+        Stop a timer, it is neither running nor expired afterwards.
+        """
+        self.deadlines[timer] = TimerService.NOT_RUNNING
+
+    def running(self, timer):
+        """
+        Returns True if the timer was started and not cancelled, expired or not.
+        """
+        return self.deadlines[timer] != TimerService.NOT_RUNNING
+
+    def expired(self, timer):
+        """
+        Returns True if the timer was started and its deadline has passed.
+        """
+        deadline = self.deadlines[timer]
+        return deadline != TimerService.NOT_RUNNING and ticks_diff(self.now, deadline) >= 0
+
+    def remaining_ms(self, timer):
+        """
+        Returns the milliseconds left until the timer expires, 0 once it expired.
+        """
+        deadline = self.deadlines[timer]
+        if deadline == TimerService.NOT_RUNNING:
+            return 0
+        remaining = ticks_diff(deadline, self.now)
+        return remaining if remaining > 0 else 0
+
+    def __run_callbacks(self):
+        """
+        Call the callbacks of the expired timers once and find the next callback deadline.
+        """
+        now = self.now
+        upcoming = TimerService.NOT_RUNNING
+        # Callbacks restarting a timer lower next_callback through start()
+        self.next_callback = TimerService.NOT_RUNNING
+        for timer in range(self.count):
+            callback = self.callbacks[timer]
+            deadline = self.deadlines[timer]
+            if callback is None or deadline == TimerService.NOT_RUNNING:
+                continue
+            if ticks_diff(now, deadline) >= 0:
+                self.deadlines[timer] = TimerService.NOT_RUNNING
+                callback()
+            elif upcoming == TimerService.NOT_RUNNING or ticks_diff(deadline, upcoming) < 0:
+                upcoming = deadline
+        if upcoming != TimerService.NOT_RUNNING:
+            if self.next_callback == TimerService.NOT_RUNNING or ticks_diff(upcoming, self.next_callback) < 0:
+                self.next_callback = upcoming
+
+
+# Timer service shared by all subsystems unless they are given their own
+TIMERS = None
+
+
+def shared_timers():
+    """
+    Returns the timer service running on ticks_ms(), created on first use.
+    """
+    global TIMERS
+    if TIMERS is None:
+        TIMERS = TimerService()
+    return TIMERS
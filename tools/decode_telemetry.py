@@ -0,0 +1,151 @@
+"""
+Decode a telemetry dump written by telemetry.Telemetry into a table.
+
+Accepts the binary file written to flash, or a captured serial log containing the
+hex dump between the telemetry markers:
+
+    python tools/decode_telemetry.py telemetry.bin [--csv] [--summary]
+"""
+import argparse
+import binascii
+import csv
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telemetry import HEADER, MAGIC, SERIAL_BEGIN, SERIAL_END, TICKS_PERIOD, VERSION  # noqa: E402
+
+# Bits of the raw sensor byte, as in line_sensors.RAW_LEFT, RAW_CENTER and RAW_RIGHT
+RAW_LEFT = 0x04
+RAW_CENTER = 0x08
+RAW_RIGHT = 0x10
+
+COLUMNS = ["sample", "time_ms", "period_ms", "tick_ms", "sensors", "left", "center", "right",
+           "state", "left_duty", "right_duty"]
+
+
+def extract(data):
+    """
+    Returns the binary dump, unwrapping the hex lines of a serial log.
+    """
+    if data.startswith(MAGIC):
+        return data
+    text = data.decode("utf-8", "replace")
+    begin = text.find(SERIAL_BEGIN)
+    end = text.find(SERIAL_END, begin)
+    if begin < 0 or end < 0:
+        raise ValueError("neither a telemetry dump nor a serial log containing one")
+    lines = text[begin + len(SERIAL_BEGIN):end].split()
+    return binascii.unhexlify("".join(lines))
+
+
+def decode(data):
+    """
+    Decode a dump.
+
+    Returns:
+        tuple: (samples recorded during the run, list of one dict per sample in the dump)
+    """
+    data = extract(data)
+    magic, version, count, recorded, names_length = struct.unpack_from(HEADER, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("unsupported telemetry dump version")
+    offset = struct.calcsize(HEADER)
+    names = data[offset:offset + names_length].decode().split(",") if names_length else []
+    offset += names_length
+
+    def column(code, width=1):
+        nonlocal offset
+        values = struct.unpack_from("<" + str(count * width) + code, data, offset)
+        offset += struct.calcsize("<" + str(count * width) + code)
+        return values
+
+    times = column("I")
+    ticks = column("H")
+    sensors = column("B")
+    states = column("B")
+    duties = column("B", 4)
+
+    rows = []
+    for index in range(count):
+        raw = sensors[index]
+        # Registers 0x02..0x05: right backward, right forward, left backward, left forward
+        right_back, right_forward, left_back, left_forward = duties[index * 4:index * 4 + 4]
+        state = states[index]
+        rows.append({
+            "sample": recorded - count + index,
+            # ticks_ms() wraps, the differences are taken modulo its period
+            "time_ms": (times[index] - times[0]) % TICKS_PERIOD,
+            "period_ms": (times[index] - times[index - 1]) % TICKS_PERIOD if index else 0,
+            "tick_ms": ticks[index],
+            "sensors": "0x{:02x}".format(raw),
+            "left": int(bool(raw & RAW_LEFT)),
+            "center": int(bool(raw & RAW_CENTER)),
+            "right": int(bool(raw & RAW_RIGHT)),
+            "state": names[state] if state < len(names) else str(state),
+            "left_duty": left_forward - left_back,
+            "right_duty": right_forward - right_back,
+        })
+    return recorded, rows
+
+
+def summarize(rows):
+    """
+    Time spent per state and the longest stays in each state.
+
+    Returns:
+        list: One dict per state, ordered by total time
+    """
+    totals = {}
+    for index, row in enumerate(rows):
+        if index + 1 < len(rows):
+            spent = rows[index + 1]["time_ms"] - row["time_ms"]
+        else:
+            spent = row["period_ms"]
+        entry = totals.setdefault(row["state"], {"state": row["state"], "ticks": 0, "time_ms": 0.0,
+                                                  "visits": 0, "longest_ms": 0.0, "current_ms": 0.0})
+        if index == 0 or rows[index - 1]["state"] != row["state"]:
+            entry["visits"] += 1
+            entry["current_ms"] = 0.0
+        entry["ticks"] += 1
+        entry["time_ms"] += spent
+        entry["current_ms"] += spent
+        entry["longest_ms"] = max(entry["longest_ms"], entry["current_ms"])
+    summary = sorted(totals.values(), key=lambda entry: -entry["time_ms"])
+    for entry in summary:
+        del entry["current_ms"]
+        entry["time_ms"] = round(entry["time_ms"], 1)
+        entry["longest_ms"] = round(entry["longest_ms"], 1)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a telemetry dump into a table.")
+    parser.add_argument("dump", help="binary dump or serial log")
+    parser.add_argument("--csv", action="store_true", help="print CSV instead of an aligned table")
+    parser.add_argument("--summary", action="store_true", help="print the time spent per state only")
+    args = parser.parse_args()
+
+    with open(args.dump, "rb") as file:
+        recorded, rows = decode(file.read())
+
+    if args.summary:
+        print("{} samples in the dump, {} recorded".format(len(rows), recorded))
+        print("{:>6} {:>7} {:>10} {:>7} {:>11}".format("state", "ticks", "time_ms", "visits", "longest_ms"))
+        for entry in summarize(rows):
+            print("{state:>6} {ticks:>7} {time_ms:>10} {visits:>7} {longest_ms:>11}".format(**entry))
+        return
+    if args.csv:
+        writer = csv.DictWriter(sys.stdout, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    print(" ".join("{:>10}".format(name) for name in COLUMNS))
+    for row in rows:
+        print(" ".join("{:>10}".format(row[name]) for name in COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Build and deploy pipeline for the board.
+
+build cross-compiles the robot modules to .mpy bytecode with mpy-cross, so the board
+no longer compiles them from source on every power-on. The result is staged in
+build/circuitpy/ the way it lands on the drive, code.py stays source because the board
+only starts code.py, the modules go to lib/. The staged tree is bundled with its
+manifest of SHA-256 content hashes into build/joycar.zip.
+
+deploy builds and syncs the staged tree to the CIRCUITPY drive. The drive keeps the
+manifest of what was last written, only files whose hash changed are copied. Stale
+modules are removed, including .py copies in the drive root that would shadow the
+.mpy files in lib/, e.g. left behind by the copy-on-save of .vscode/copy.sh. Files
+passed with --extra are tracked too, leaving one out of a later deploy removes it.
+
+    python tools/deploy.py build [--mpy-cross PATH] [--extra route.bin]
+    python tools/deploy.py deploy [--drive /Volumes/CIRCUITPY] [--dry-run]
+
+mpy-cross must match the CircuitPython version on the board, download it from the
+CircuitPython release page. --source deploys the modules as .py files without it.
+"""
+import argparse
+import fnmatch
+import getpass
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BUILD = os.path.join(ROOT, "build")
+STAGE = os.path.join(BUILD, "circuitpy")
+BUNDLE = os.path.join(BUILD, "joycar.zip")
+IGNORE_FILE = os.path.join(ROOT, ".vscode", ".ignoreCopy")
+# Manifest of the staged tree, also written to the drive after a sync
+MANIFEST = ".deploy.json"
+ENTRY_POINT = "code.py"
+LIB = "lib"
+DRIVES = ("/Volumes/CIRCUITPY", "/media/{user}/CIRCUITPY", "/run/media/{user}/CIRCUITPY")
+
+
+def ignore_patterns():
+    """
+    Returns the patterns of .vscode/.ignoreCopy, the files that never go to the board.
+    """
+    with open(IGNORE_FILE) as file:
+        return [line.strip().replace("\\", "/") for line in file if line.strip()]
+
+
+def device_modules():
+    """
+    Returns the module sources in the repository root that run on the board, code.py excluded.
+    """
+    patterns = ignore_patterns()
+    modules = []
+    for name in sorted(os.listdir(ROOT)):
+        if not name.endswith(".py") or name == ENTRY_POINT:
+            continue
+        if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            continue
+        modules.append(name)
+    return modules
+
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def compile_module(mpy_cross, source, target):
+    """
+    Cross-compile one module to .mpy bytecode.
+    """
+    result = subprocess.run([mpy_cross, "-o", target, source], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("mpy-cross failed on {}:\n{}".format(source, result.stderr.strip()))
+
+
+def build(mpy_cross="mpy-cross", source=False, extras=()):
+    """
+    Stage the deployable tree and bundle it.
+
+    Args:
+        mpy_cross: Path of the mpy-cross binary matching the board's CircuitPython
+        source: Stage the modules as .py files instead of compiling them
+        extras: Further files copied to the drive root, e.g. a route file
+
+    Returns:
+        dict: Manifest mapping the staged paths to their SHA-256 hashes
+    """
+    if not source and shutil.which(mpy_cross) is None:
+        raise RuntimeError("{} not found, pass --mpy-cross or deploy the sources with --source".format(mpy_cross))
+    shutil.rmtree(STAGE, ignore_errors=True)
+    os.makedirs(os.path.join(STAGE, LIB))
+    for name in device_modules():
+        module = os.path.splitext(name)[0]
+        if source:
+            shutil.copyfile(os.path.join(ROOT, name), os.path.join(STAGE, LIB, name))
+        else:
+            compile_module(mpy_cross, os.path.join(ROOT, name), os.path.join(STAGE, LIB, module + ".mpy"))
+    shutil.copyfile(os.path.join(ROOT, ENTRY_POINT), os.path.join(STAGE, ENTRY_POINT))
+    for extra in extras:
+        shutil.copyfile(extra, os.path.join(STAGE, os.path.basename(extra)))
+
+    manifest = {}
+    for directory, _, files in os.walk(STAGE):
+        for name in files:
+            path = os.path.join(directory, name)
+            manifest[os.path.relpath(path, STAGE).replace(os.sep, "/")] = file_hash(path)
+    manifest = dict(sorted(manifest.items()))
+    with open(os.path.join(STAGE, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=1)
+    with zipfile.ZipFile(BUNDLE, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for path in list(manifest) + [MANIFEST]:
+            bundle.write(os.path.join(STAGE, path), path)
+    return manifest
+
+
+def find_drive():
+    """
+    Returns the mount point of the CIRCUITPY drive.
+    """
+    user = getpass.getuser()
+    for pattern in DRIVES:
+        drive = pattern.format(user=user)
+        if os.path.isdir(drive):
+            return drive
+    raise RuntimeError("CIRCUITPY drive not found, pass --drive")
+
+
+def read_manifest(drive):
+    try:
+        with open(os.path.join(drive, MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def sync(manifest, drive, dry_run=False):
+    """
+    Copy the staged files whose hash differs from the drive's manifest and remove stale modules.
+
+    Args:
+        manifest: Manifest of the staged tree
+        drive: Mount point of the CIRCUITPY drive
+        dry_run: Only print what would change
+
+    Returns:
+        tuple: (copied paths, removed paths)
+    """
+    deployed = read_manifest(drive)
+    copied = []
+    for path, digest in manifest.items():
+        target = os.path.join(drive, path)
+        if deployed.get(path) == digest and os.path.exists(target):
+            continue
+        copied.append(path)
+        if not dry_run:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(STAGE, path), target)
+
+    stale = [path for path in deployed if path not in manifest]
+    # Sources in the root shadow the modules in lib/, sources in lib/ the compiled modules next to them
+    for path in manifest:
+        directory, name = os.path.split(path)
+        if directory == LIB:
+            module = os.path.splitext(name)[0] + ".py"
+            stale.extend(candidate for candidate in (module, LIB + "/" + module) if candidate not in manifest)
+    removed = []
+    for path in sorted(set(stale)):
+        target = os.path.join(drive, path)
+        if os.path.exists(target):
+            removed.append(path)
+            if not dry_run:
+                os.remove(target)
+
+    if not dry_run and (copied or removed or deployed != manifest):
+        with open(os.path.join(drive, MANIFEST), "w") as file:
+            json.dump(manifest, file, indent=1)
+        if hasattr(os, "sync"):
+            os.sync()
+    return copied, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the robot's modules and deploy them to the board.")
+    parser.add_argument("command", choices=("build", "deploy"))
+    parser.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross binary matching the board's CircuitPython")
+    parser.add_argument("--source", action="store_true", help="deploy the modules as .py files, without mpy-cross")
+    parser.add_argument("--extra", action="append", default=[], help="further file for the drive root, e.g. route.bin")
+    parser.add_argument("--drive", help="mount point of the CIRCUITPY drive, searched when omitted")
+    parser.add_argument("--dry-run", action="store_true", help="only print what deploy would change")
+    args = parser.parse_args()
+
+    try:
+        manifest = build(args.mpy_cross, args.source, args.extra)
+        print("Built {} files into {}".format(len(manifest), BUNDLE))
+        if args.command == "deploy":
+            drive = args.drive or find_drive()
+            copied, removed = sync(manifest, drive, args.dry_run)
+            prefix = "Would copy" if args.dry_run else "Copied"
+            for path in copied:
+                print("{} {}".format(prefix, path))
+            for path in removed:
+                print("{} {}".format("Would remove" if args.dry_run else "Removed", path))
+            print("{} changed, {} removed, {} unchanged on {}".format(
+                len(copied), len(removed), len(manifest) - len(copied), drive))
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Offline route planner: compiles a start -> waypoints -> goal request on a track map into
+the turn list Navigation.decide_turn() consumes and writes it as a route file the board
+loads at startup, so no planning happens on the device.
+
+    python tools/plan_route.py --course default --start 1,1 2,1 --goal 4,4 --output route.bin
+    python tools/plan_route.py --map mat.json --start A B --via C D --any-order --goal A --check
+
+The route with the shortest estimated time wins: driving time from the edge lengths plus
+a fixed cost for stopping at every intersection and a cost per turn.
+"""
+import argparse
+import heapq
+import itertools
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim.courses import COURSES  # noqa: E402  # registers the micropython stand-in
+from sim.track import TrackMap  # noqa: E402
+from navigation import Navigation, encode_turns  # noqa: E402
+
+
+class CostModel:
+    """
+    Time estimates for driving a route, defaults measured on the simulated lap.
+    """
+
+    def __init__(self, speed=0.145, stop=0.9, turns=None):
+        """
+        Args:
+            speed: Line following speed in m/s
+            stop: Seconds lost at every intersection, braking and moving onto it
+            turns: Extra seconds per turn constant, turning on the spot takes about 0.45 s
+        """
+        self.speed = speed
+        self.stop = stop
+        self.turns = turns or {Navigation.FORWARD: 0.0, Navigation.LEFT: 0.45, Navigation.RIGHT: 0.45}
+
+    def edge(self, track, a, b):
+        return track.edge_length(a, b) / self.speed
+
+    def intersection(self, turn):
+        return self.stop + self.turns[turn]
+
+
+def plan(track, start, goal, via=(), costs=None):
+    """
+    Find the fastest route with Dijkstra over (previous node, node, waypoints reached) states,
+    so the direction the robot arrives from is part of the state and turns are costed right.
+
+    Args:
+        track: TrackMap to plan on
+        start: (node, next node) pair, the robot starts on this edge heading to the next node
+        goal: Node the route ends at
+        via: Nodes to pass in this order before the goal
+        costs: CostModel, the defaults when omitted
+
+    Returns:
+        tuple: (estimated seconds, list of nodes from the start node to the goal)
+    """
+    costs = costs or CostModel()
+    targets = list(via) + [goal]
+    first, second = start
+    if second not in track.neighbours[first]:
+        raise ValueError("No edge between {} and {}".format(first, second))
+
+    def reached(node, count):
+        return count + 1 if count < len(targets) and node == targets[count] else count
+
+    initial = (first, second, reached(second, 0))
+    best = {initial: costs.edge(track, first, second)}
+    parents = {initial: None}
+    queue = [(best[initial], 0, initial)]
+    counter = itertools.count(1)
+    while queue:
+        cost, _, state = heapq.heappop(queue)
+        if cost > best[state]:
+            continue
+        previous, node, count = state
+        if count == len(targets):
+            route = []
+            while state is not None:
+                route.append(state[1])
+                state = parents[state]
+            route.append(first)
+            return cost, route[::-1]
+        for following in track.neighbours[node]:
+            try:
+                turn = track.turn(previous, node, following)
+            except ValueError:
+                continue  # U-turns are not possible
+            candidate = (node, following, reached(following, count))
+            total = cost + costs.intersection(turn) + costs.edge(track, node, following)
+            if total < best.get(candidate, math.inf):
+                best[candidate] = total
+                parents[candidate] = state
+                heapq.heappush(queue, (total, next(counter), candidate))
+    raise ValueError("No route from {} to {} via {}".format(first, goal, ", ".join(via) or "nothing"))
+
+
+def plan_tour(track, start, goal, via, costs=None):
+    """
+    Like plan(), but visits the waypoints in the fastest order.
+    Tries every order, meant for the handful of waypoints of a course.
+    """
+    best = None
+    for order in itertools.permutations(via):
+        try:
+            result = plan(track, start, goal, order, costs)
+        except ValueError:
+            continue
+        if best is None or result[0] < best[0]:
+            best = result
+    if best is None:
+        raise ValueError("No route visits all waypoints")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a route request into a route file.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--map", help="track map JSON file")
+    source.add_argument("--course", choices=sorted(COURSES), help="built-in simulator course")
+    parser.add_argument("--start", nargs=2, required=True, metavar=("NODE", "NEXT"),
+                        help="start node and the node the robot is heading to")
+    parser.add_argument("--goal", required=True, help="node the route ends at")
+    parser.add_argument("--via", nargs="*", default=[], help="waypoints to pass")
+    parser.add_argument("--any-order", action="store_true", help="visit the waypoints in the fastest order")
+    parser.add_argument("--speed", type=float, default=0.145, help="line following speed in m/s")
+    parser.add_argument("--stop", type=float, default=0.9, help="seconds lost per intersection")
+    parser.add_argument("--turn", type=float, default=0.45, help="extra seconds per left or right turn")
+    parser.add_argument("--output", help="write the route file here")
+    parser.add_argument("--export-map", help="write the track map as JSON here")
+    parser.add_argument("--check", action="store_true", help="drive the planned route in the simulator")
+    args = parser.parse_args()
+
+    track = TrackMap.load(args.map) if args.map else COURSES[args.course][0]
+    if args.export_map:
+        track.save(args.export_map)
+    costs = CostModel(args.speed, args.stop, {Navigation.FORWARD: 0.0, Navigation.LEFT: args.turn,
+                                              Navigation.RIGHT: args.turn})
+    planner = plan_tour if args.any_order else plan
+    estimate, route = planner(track, tuple(args.start), args.goal, args.via, costs)
+    turns = track.route_turns(route)
+
+    print("Route: " + " -> ".join(route))
+    print("Turns: " + ", ".join(Navigation.NAMES[turn] for turn in turns))
+    print("Estimated time: {:.1f} s".format(estimate))
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(encode_turns(turns))
+        print("Wrote {} turns to {}".format(len(turns), args.output))
+    if args.check:
+        from sim.simulation import Simulation
+
+        result = Simulation(track, route).run()
+        print("Simulated: {} in {:.1f} s".format(result.final_state, result.lap_time))
+
+
+if __name__ == "__main__":
+    main()
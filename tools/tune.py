@@ -0,0 +1,313 @@
+"""
+Parameter sweep tuner: drives the full robot stack headlessly over a course for every
+candidate set of tuning constants and ranks them by lap time and intersection errors.
+
+    python tools/tune.py [--course default] [--grid duty_cruise=80,90,100 break_ms=250,500]
+    python tools/tune.py --random 60 --halving --voltages 7.4 6.8 8.0 --noise 0.01 --seeds 2
+
+The runs are spread over a process pool using every core. Grid search tries every
+combination of the --grid values, random search draws configurations from the ranges
+in PARAMETERS. With --halving every configuration is first scored on one condition
+(battery voltage and noise seed), only the best third goes on to three times as many
+conditions, and so on. The winner is written as a config module for code.py:
+
+    python tools/tune.py --config build/tuned.py
+    python tools/deploy.py deploy --extra build/tuned.py
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim.hardware import install, uninstall  # noqa: E402
+
+# The robot modules bind the virtual clock when imported, the pool workers inherit them
+install()
+
+from sim.courses import COURSES  # noqa: E402
+from sim.track import TrackMap  # noqa: E402
+from control_unit import ControlUnit  # noqa: E402
+from robot import Robot  # noqa: E402
+
+# The pool itself waits on the real clock
+uninstall()
+
+# Tuning constant -> (class it is passed to, default, grid values, random search range)
+PARAMETERS = {
+    "speed_multiplier": ("control_unit", float(ControlUnit.SPEED_MULTIPLIER), (1.0, 1.2, 1.4), (0.7, 1.6)),
+    "duty_slow": ("control_unit", ControlUnit.DUTY_SLOW, (ControlUnit.DUTY_SLOW,), (0, 70)),
+    "duty_cruise": ("control_unit", ControlUnit.DUTY_CRUISE, (80, 90, 100), (60, 130)),
+    "duty_turn": ("control_unit", ControlUnit.DUTY_TURN, (ControlUnit.DUTY_TURN,), (80, 150)),
+    "controller": ("control_unit", ControlUnit.BANG_BANG, (ControlUnit.BANG_BANG,),
+                   (ControlUnit.BANG_BANG, ControlUnit.PROPORTIONAL)),
+    "gain_p": ("control_unit", ControlUnit.GAIN_P, (ControlUnit.GAIN_P,), (5, 40)),
+    "gain_d": ("control_unit", ControlUnit.GAIN_D, (ControlUnit.GAIN_D,), (0, 50)),
+    "curve_slowdown": ("control_unit", ControlUnit.CURVE_SLOWDOWN, (ControlUnit.CURVE_SLOWDOWN,), (0, 30)),
+    "break_ms": ("robot", Robot.BREAK_MS, (250, 500), (100, 600)),
+    "move_through_ms": ("robot", Robot.MOVE_THROUGH_MS, (300, 400), (150, 600)),
+    "lost_line_ms": ("robot", Robot.LOST_LINE_MS, (Robot.LOST_LINE_MS,), (1000, 5000)),
+}
+# A stop counts for an intersection while the center sensor is within this distance of it
+MATCH_M = 0.04
+# Score penalties in seconds
+MISSED_PENALTY = 10.0
+FALSE_PENALTY = 5.0
+UNFINISHED_PENALTY = 120.0
+
+
+def split(config):
+    """
+    Returns the ControlUnit and the Robot keyword arguments of a configuration.
+    """
+    control_unit = {name: value for name, value in config.items() if PARAMETERS[name][0] == "control_unit"}
+    robot = {name: value for name, value in config.items() if PARAMETERS[name][0] == "robot"}
+    return control_unit, robot
+
+
+def drive(task):
+    """
+    Drive one lap with one configuration under one condition. Runs in a pool worker.
+
+    Args:
+        task: (track, route, config, (voltage, noise, seed), timeout, sampling) tuple
+
+    Returns:
+        dict: Lap time, whether the lap was completed, detected, missed and false intersections
+    """
+    from sim.simulation import Simulation
+
+    track, route, config, (voltage, noise, seed), timeout, sampling = task
+    control_unit_args, robot_args = split(config)
+    simulation = Simulation(track, route, voltage=voltage, sensor_noise=noise, seed=seed, sampling=sampling,
+                            control_unit_args=control_unit_args, robot_args=robot_args)
+    simulation.start()
+    world = simulation.world
+    # Every node after the start is an intersection or the finish bar the robot stops at
+    stops = [track.nodes[node] for node in route[1:]]
+    reached = missed = false_positives = 0
+    state = simulation.state
+    with simulation.output():
+        while simulation.elapsed() < timeout:
+            previous, state = state, simulation.step()
+            if state == "B" and previous != "B":
+                x, y = world.sensor_positions()[1]
+                for index in range(reached, len(stops)):
+                    if math.hypot(stops[index][0] - x, stops[index][1] - y) <= MATCH_M:
+                        missed += index - reached
+                        reached = index + 1
+                        break
+                else:
+                    false_positives += 1
+            if state in Simulation.TERMINAL_STATES:
+                break
+        simulation.robot.stop()
+    return {
+        # Stopping at a false intersection uses up a turn, the lap only counts if F was entered at the goal
+        "finished": state == "F" and reached == len(stops),
+        "lap_time": simulation.elapsed(),
+        "detected": reached - missed,
+        "missed": missed,
+        "false_positives": false_positives,
+    }
+
+
+def score(runs):
+    """
+    Combine the runs of one configuration into its score, lower is better.
+
+    Returns:
+        dict: Mean lap time, summed errors, finished runs and the score
+    """
+    count = len(runs)
+    lap_time = sum(run["lap_time"] for run in runs) / count
+    missed = sum(run["missed"] for run in runs)
+    false_positives = sum(run["false_positives"] for run in runs)
+    unfinished = sum(1 for run in runs if not run["finished"])
+    return {
+        "score": round(lap_time + (MISSED_PENALTY * missed + FALSE_PENALTY * false_positives
+                                   + UNFINISHED_PENALTY * unfinished) / count, 3),
+        "lap_time": round(lap_time, 3),
+        "finished": count - unfinished,
+        "runs": count,
+        "missed": missed,
+        "false_positives": false_positives,
+    }
+
+
+def grid_configs(grid, fixed):
+    """
+    Returns every combination of the grid values, the other parameters at their fixed value.
+    """
+    names = sorted(grid)
+    return [dict(fixed, **dict(zip(names, values))) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def random_configs(count, names, fixed, rng):
+    """
+    Returns configurations with the named parameters drawn uniformly from their ranges.
+    """
+    configs = []
+    for _ in range(count):
+        config = dict(fixed)
+        for name in names:
+            low, high = PARAMETERS[name][3]
+            config[name] = round(rng.uniform(low, high), 2) if isinstance(low, float) else rng.randint(low, high)
+        configs.append(config)
+    return configs
+
+
+def evaluate(pool, track, route, configs, conditions, timeout, sampling=False):
+    """
+    Score every configuration on every condition, the runs spread over the pool.
+
+    Returns:
+        list: (score dict, config) pairs, best first
+    """
+    tasks = [(track, route, config, condition, timeout, sampling) for config in configs for condition in conditions]
+    results = pool.map(drive, tasks, chunksize=1)
+    ranked = []
+    for index, config in enumerate(configs):
+        runs = results[index * len(conditions):(index + 1) * len(conditions)]
+        ranked.append((score(runs), config))
+    ranked.sort(key=lambda entry: entry[0]["score"])
+    return ranked
+
+
+def successive_halving(pool, track, route, configs, conditions, timeout, sampling=False, eta=3):
+    """
+    Score all configurations on one condition, keep the best 1/eta for eta times as many
+    conditions and repeat until one configuration is left or all conditions are used.
+
+    Returns:
+        list: (score dict, config) pairs of the last round, best first, followed by the
+        ones dropped earlier in the order they were ranked when dropped
+    """
+    budget = 1
+    dropped = []
+    while True:
+        ranked = evaluate(pool, track, route, configs, conditions[:budget], timeout, sampling)
+        if len(ranked) <= 1 or budget >= len(conditions):
+            return ranked + dropped
+        keep = max(1, len(ranked) // eta)
+        dropped = ranked[keep:] + dropped
+        configs = [config for _, config in ranked[:keep]]
+        budget = min(budget * eta, len(conditions))
+
+
+def parse_assignments(items, multiple):
+    """
+    Parse name=value or name=v1,v2 arguments into a dict of values or tuples of values.
+    """
+    result = {}
+    for item in items:
+        name, _, text = item.partition("=")
+        if name not in PARAMETERS or not text:
+            raise SystemExit("Expected name=value with name one of " + ", ".join(PARAMETERS))
+        cast = type(PARAMETERS[name][3][0])
+        values = tuple(cast(float(value)) if cast is int else float(value) for value in text.split(","))
+        result[name] = values if multiple else values[0]
+    return result
+
+
+def write_config(path, config, entry, course):
+    """
+    Write the winning configuration as a module code.py imports.
+    """
+    control_unit, robot = split(config)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        file.write('"""\nTuning constants written by tools/tune.py on the {} course.\n'.format(course))
+        file.write("Score {score}, lap {lap_time} s, {finished} of {runs} runs finished, "
+                   "{missed} missed and {false_positives} false intersections.\n\"\"\"\n".format(**entry))
+        file.write("# ControlUnit keyword arguments\n")
+        file.write("CONTROL_UNIT = " + json.dumps(control_unit, sort_keys=True) + "\n")
+        file.write("# Robot keyword arguments\n")
+        file.write("ROBOT = " + json.dumps(robot, sort_keys=True) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the tuning constants over the simulated course.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--course", choices=sorted(COURSES), default="default", help="built-in simulator course")
+    source.add_argument("--map", help="track map JSON file, needs --route")
+    parser.add_argument("--route", nargs="+", help="nodes of the route on the --map")
+    parser.add_argument("--grid", nargs="+", default=[], metavar="NAME=V1,V2",
+                        help="values to sweep, replaces the default grid")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE", help="fixed parameter values")
+    parser.add_argument("--random", type=int, metavar="N", help="random search over N configurations instead")
+    parser.add_argument("--vary", nargs="+", choices=sorted(PARAMETERS), help="parameters random search varies")
+    parser.add_argument("--halving", action="store_true", help="successive halving over the conditions")
+    parser.add_argument("--eta", type=int, default=3, help="halving keeps the best 1/eta per round")
+    parser.add_argument("--voltages", type=float, nargs="+", default=[7.4], help="battery voltages to drive at")
+    parser.add_argument("--noise", type=float, default=0.0, help="probability of a line sensor bit being misread")
+    parser.add_argument("--seeds", type=int, default=1, help="noise seeds per voltage")
+    parser.add_argument("--sampling", action="store_true", help="debounce the sensors as with SENSOR_SAMPLING")
+    parser.add_argument("--timeout", type=float, default=90.0, help="simulated seconds per lap")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=15, help="rows of the ranked table")
+    parser.add_argument("--output", help="write all ranked results as JSON to this file")
+    parser.add_argument("--config", default=os.path.join("build", "tuned.py"), help="config module for the board")
+    args = parser.parse_args()
+
+    if args.map:
+        if not args.route:
+            parser.error("--map needs --route")
+        track, route, course = TrackMap.load(args.map), args.route, args.map
+    else:
+        track, route = COURSES[args.course]
+        course = args.course
+    fixed = {name: spec[1] for name, spec in PARAMETERS.items()}
+    fixed.update(parse_assignments(args.set, multiple=False))
+    if args.random:
+        names = args.vary or [name for name, spec in PARAMETERS.items() if len(spec[2]) > 1]
+        configs = random_configs(args.random, names, fixed, random.Random(args.random_seed))
+    else:
+        grid = parse_assignments(args.grid, multiple=True) if args.grid else {
+            name: spec[2] for name, spec in PARAMETERS.items() if len(spec[2]) > 1}
+        configs = grid_configs(grid, fixed)
+    # Without noise the seeds drive the same lap
+    seeds = range(args.seeds if args.noise else 1)
+    conditions = [(voltage, args.noise, seed) for seed in seeds for voltage in args.voltages]
+
+    runs = len(configs) * (1 if args.halving else len(conditions))
+    print("{} configurations, {} conditions, {} workers{}".format(
+        len(configs), len(conditions), args.jobs, ", successive halving" if args.halving else
+        ", {} laps".format(runs)))
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.jobs) as pool:
+        if args.halving:
+            ranked = successive_halving(pool, track, route, configs, conditions, args.timeout, args.sampling,
+                                        args.eta)
+        else:
+            ranked = evaluate(pool, track, route, configs, conditions, args.timeout, args.sampling)
+    print("Done in {:.1f} s".format(time.perf_counter() - start))
+
+    names = [name for name in PARAMETERS if len({config[name] for _, config in ranked}) > 1] or list(PARAMETERS)
+    header = ["rank", "score", "lap_s", "done", "missed", "false"] + names
+    rows = [[str(rank + 1), "{:.2f}".format(entry["score"]), "{:.2f}".format(entry["lap_time"]),
+             "{}/{}".format(entry["finished"], entry["runs"]), str(entry["missed"]), str(entry["false_positives"])]
+            + [str(config[name]) for name in names] for rank, (entry, config) in enumerate(ranked[:args.top])]
+    widths = [max(len(row[index]) for row in [header] + rows) for index in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump([dict(entry, config=config) for entry, config in ranked], file, indent=1)
+    best_entry, best = ranked[0]
+    write_config(args.config, best, best_entry, course)
+    print("Wrote the best configuration to " + args.config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+from micropython import const
+from time import monotonic_ns
+import struct
+from profiler import patch
+from control_unit import ControlUnit
+from telemetry import HexWriter
+
+# Trace layout: header, the tuning constants, the turn codes of the route, then the records
+MAGIC = b"JCS1"
+VERSION = 2
+# magic, version, flags, sensor byte before the first record, speed scale, turns, record bytes, dropped records,
+# monotonic_ns() at attach()
+HEADER = "<4sHBBHHIIQ"
+# The constants the robot was built with, replayed instead of the defaults: ControlUnit's duty_slow,
+# duty_cruise, duty_turn, duty_deadband, gain_p, gain_d and curve_slowdown, Robot's break_ms, move_through_ms
+# and lost_line_ms
+CONSTANTS = "<4B3h3H"
+SERIAL_BEGIN = "--- trace begin ---"
+SERIAL_END = "--- trace end ---"
+DUMP_PATH = "/trace.bin"
+
+# Header flags
+FLAG_SAMPLING = 0x01  # A SensorSampler read the sensors between ticks
+FLAG_FULL = 0x02  # The buffer ran full, records after that were dropped
+FLAG_BATTERY = 0x04  # A BatteryMonitor sampled the battery
+FLAG_PROPORTIONAL = 0x08  # The proportional controller followed the line
+FLAG_TURN_PREDICTION = 0x10  # A TurnPredictor tapered the turns, with its defaults, and polled between ticks
+
+# Record kinds, the top three bits of a record's first byte. Inputs carry the time since
+# the previous input as a varint of nanoseconds, outputs belong to the tick they follow.
+KIND_MASK = 0xE0
+TICK = 0x00  # TimerService.tick() of a control tick
+READ = 0x20  # Sensor byte returned by LineSensors.read_raw()
+BATTERY = 0x40  # Battery ADC reading, 16 bit
+BUTTON = 0x60  # Button press, the low bits are the button
+STATE = 0x80  # State the robot entered, the low bits are the state ID
+MOTORS = 0xA0  # PWM duties of registers 0x02..0x05 the motor controller received
+SAME = 0x01  # Flag of a READ record without a sensor byte, the previous read's byte repeated
+# Longest record: kind, 64 bit time varint, 16 bit payload
+_RECORD_MAX = const(16)
+
+
+class TraceRecorder:
+    """
+    Records what the robot sensed and did into a compact binary trace, so a run
+    can be replayed on the host by sim/replay.py.
+
+    Inputs are the sensor bytes, battery readings, button presses and the clock of
+    every control tick, each with its timestamp. Outputs are the states entered and
+    the duties sent to the motor controller, the replay compares against them. The
+    tuning constants the robot was built with are stored too, the replay builds its
+    robot with them.
+
+    Like the profiler, attach() replaces methods of the robot's objects once, a
+    robot without a recorder runs the same code as before. Records go into a
+    preallocated buffer, recording stops when it is full.
+    """
+    CAPACITY = 32768  # About 60 seconds at 50 Hz, 15 with a sampler reading every 2 ms
+    BUTTON_A = 0
+    BUTTON_B = 1
+
+    def __init__(self, capacity=CAPACITY, clock=monotonic_ns):
+        """
+        Initialize the recorder.
+
+        Args:
+            capacity: Size of the record buffer in bytes
+            clock: Function returning nanoseconds, timestamps the inputs
+        """
+        self.clock = clock
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.length = 0
+        self.records = 0
+        self.dropped = 0
+        self.flags = 0
+        self.initial_raw = 0
+        self.speed_scale = 256
+        self.constants = None
+        self.turns = b""
+        self.start_ns = 0
+        self.last_ns = 0
+        self.last_raw = -1
+        self.duties = bytearray(4)
+        self.duties_known = False
+
+    def attach(self, robot):
+        """
+        Start recording the inputs and outputs of a robot.
+        Robot.drive keeps working unwrapped, the tick is recorded from the timer service.
+
+        Args:
+            robot: Robot to record, with its sampler already attached to the line sensors
+        """
+        control_unit = robot.control_unit
+        line_sensors = control_unit.line_sensors
+        motors = control_unit.motors
+        robot_state = robot.robot_state
+        monitor = control_unit.battery_monitor
+        self.turns = bytes(robot.navigation.turns)
+        self.initial_raw = line_sensors.raw
+        self.speed_scale = control_unit.base_scale
+        transitions = robot_state.transitions
+        self.constants = control_unit.duties + (control_unit.deadband,) + control_unit.gains + (
+            transitions[robot.TRANSITION_BREAK][5], transitions[robot.TRANSITION_MOVE_THROUGH][5], robot.lost_line_ms)
+        if line_sensors.sampler is not None:
+            self.flags |= FLAG_SAMPLING
+        if control_unit.controller == ControlUnit.PROPORTIONAL:
+            self.flags |= FLAG_PROPORTIONAL
+        if control_unit.turn_predictor is not None:
+            self.flags |= FLAG_TURN_PREDICTION
+        self.start_ns = self.clock()
+        self.last_ns = self.start_ns
+
+        tick = robot.timers.tick
+
+        def recorded_tick(now=None):
+            now = tick(now)
+            self.__begin(TICK, self.clock())
+            return now
+
+        read_raw = line_sensors.read_raw
+
+        def recorded_read_raw():
+            raw = read_raw()
+            if raw == self.last_raw:
+                self.__begin(READ | SAME, self.clock())
+            elif self.__begin(READ, self.clock()):
+                self.__byte(raw)
+                self.last_raw = raw
+            return raw
+
+        flush = motors.flush
+
+        def recorded_flush():
+            flush()
+            shadow = motors.shadow
+            duties = self.duties
+            changed = not self.duties_known
+            for index in range(4):
+                if duties[index] != shadow[index + 1]:
+                    changed = True
+            if changed and self.__begin(MOTORS, -1):
+                for index in range(4):
+                    duties[index] = shadow[index + 1]
+                    self.__byte(duties[index])
+                self.duties_known = True
+
+        set_state = robot_state.set_state
+
+        def recorded_set_state(*args):
+            previous = robot_state.current_state
+            set_state(*args)
+            if robot_state.current_state != previous:
+                self.__begin(STATE | robot_state.current_state, -1)
+
+        patch(robot.timers, "tick", recorded_tick)
+        patch(line_sensors, "read_raw", recorded_read_raw)
+        patch(motors, "flush", recorded_flush)
+        patch(robot_state, "set_state", recorded_set_state)
+        if monitor is not None:
+            self.flags |= FLAG_BATTERY
+            read_analog = monitor.pin.read_analog
+
+            def recorded_read_analog():
+                value = read_analog()
+                if self.__begin(BATTERY, self.clock()):
+                    self.__byte(value & 0xFF)
+                    self.__byte(value >> 8)
+                return value
+
+            patch(monitor.pin, "read_analog", recorded_read_analog)
+
+    def button(self, button):
+        """
+        Record a button press.
+
+        Args:
+            button: BUTTON_A or BUTTON_B
+        """
+        self.__begin(BUTTON | button, self.clock())
+
+    def __begin(self, kind, now):
+        """
+        Start a record, with the time since the previous input unless now is negative.
+
+        Returns:
+            bool: False if the buffer is full and the record was dropped
+        """
+        length = self.length
+        if length + _RECORD_MAX > self.capacity:
+            self.flags |= FLAG_FULL
+            self.dropped += 1
+            return False
+        buffer = self.buffer
+        buffer[length] = kind
+        length += 1
+        if now >= 0:
+            delta = now - self.last_ns
+            if delta < 0:
+                delta = 0
+            else:
+                self.last_ns = now
+            while delta >= 0x80:
+                buffer[length] = (delta & 0x7F) | 0x80
+                delta >>= 7
+                length += 1
+            buffer[length] = delta
+            length += 1
+        self.length = length
+        self.records += 1
+        return True
+
+    def __byte(self, value):
+        self.buffer[self.length] = value
+        self.length += 1
+
+    def write(self, stream):
+        """
+        Write the trace to a binary stream.
+
+        Args:
+            stream: Object with a write() method taking bytes
+        """
+        stream.write(struct.pack(HEADER, MAGIC, VERSION, self.flags, self.initial_raw, self.speed_scale,
+                                 len(self.turns), self.length, self.dropped, self.start_ns))
+        stream.write(struct.pack(CONSTANTS, *self.constants))
+        stream.write(self.turns)
+        stream.write(memoryview(self.buffer)[:self.length])
+
+    def save(self, path=None):
+        """
+        Write the trace to a file, or as hex lines over serial when the filesystem
+        is read-only because it is mounted over USB.
+
+        Args:
+            path: File to write, DUMP_PATH when omitted
+        """
+        if path is None:
+            path = DUMP_PATH
+        try:
+            with open(path, "wb") as file:
+                self.write(file)
+            print("Trace written to " + path)
+        except OSError:
+            print(SERIAL_BEGIN)
+            self.write(HexWriter())
+            print(SERIAL_END)
+
+    def stats(self):
+        """
+        Returns the number of records, the bytes they take and the records dropped when the buffer was full.
+        """
+        return {"records": self.records, "bytes": self.length, "dropped": self.dropped}
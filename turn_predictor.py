@@ -0,0 +1,203 @@
+from time import sleep
+from timers import shared_timers
+from line_sensors import LineSensors, RAW_LEFT, RAW_RIGHT
+
+
+class TurnPredictor:
+    """
+    Learns how long the turns at intersections take and ends them with less overshoot.
+
+    A turn spins on the spot until the sensor on the turning side finds the new line.
+    The tick notices that up to a control period late and the wheels keep turning for
+    a while after the spin is stopped, so the car overshoots and DRIVING spends several
+    ticks steering back. The predictor counts the progress of a turn in ticks at the
+    full turn duty, progress in 1/256 steps, and learns how much progress it takes to
+    find the line per battery level. Once the expected acquisition is less than the
+    window away, the duty tapers down to duty_min and service() polls the sensors in
+    the slack between ticks, stopping the spin the moment the line is found. The next
+    tick's turn guard passes on that find. A line later than expected is searched for
+    at full duty again, polling on.
+
+    The robot calls begin() when it enters a turn state.
+
+    The first turn at a battery level uses what the latest turn learned, the very first
+    turn of a run spins at full duty like a robot without a predictor.
+    """
+    PERIOD_MS = 2
+    WINDOW_TICKS = 6
+    DUTY_MIN = 60
+    LEARN_SHIFT = 1  # A new turn weighs 1/2
+    # Battery levels the progress is learned for, LEVEL_MV wide from BASE_MV up
+    BASE_MV = 6000
+    LEVEL_MV = 300
+    LEVELS = 8
+
+    __slots__ = ("control_unit", "line_sensors", "clock", "period_ns", "window", "duty_min", "shift", "expected",
+                 "latest", "level", "direction", "raw_bit", "progress", "target", "polling", "found", "turns",
+                 "polls", "polled_finds")
+
+    def __init__(self, control_unit, timers=None, period_ms=PERIOD_MS, window_ticks=WINDOW_TICKS, duty_min=DUTY_MIN,
+                 learn_shift=LEARN_SHIFT):
+        """
+        Initialize the predictor and attach it to the control unit.
+
+        Args:
+            control_unit: ControlUnit whose turns are predicted, create the Robot afterwards so it uses the guards
+            timers: TimerService whose clock paces the polling, the shared one when omitted
+            period_ms: Milliseconds between polls in the final window
+            window_ticks: Ticks at full turn duty before the expected acquisition the final window starts
+            duty_min: Nominal duty the turn tapers down to
+            learn_shift: Weight of a new turn is 1 / 2**learn_shift
+        """
+        self.control_unit = control_unit
+        self.line_sensors = control_unit.line_sensors
+        self.clock = (shared_timers() if timers is None else timers).clock
+        self.period_ns = period_ms * 1_000_000
+        self.window = window_ticks << 8
+        self.duty_min = duty_min
+        self.shift = learn_shift
+        # Learned progress until the line is found per battery level, 0 until a turn was made there
+        self.expected = [0] * TurnPredictor.LEVELS
+        self.latest = 0
+        self.level = 0
+        self.direction = 0
+        self.raw_bit = 0
+        self.progress = 0
+        self.target = 0
+        self.polling = False
+        self.found = False
+        self.turns = 0
+        self.polls = 0
+        self.polled_finds = 0
+        control_unit.turn_predictor = self
+
+    def duty(self):
+        """
+        Returns the duty of this tick of the turn begin() started, called once per tick while turning.
+        """
+        control_unit = self.control_unit
+        full = control_unit.compensate(control_unit.turn_duty)
+        duty = full
+        target = self.target
+        if target:
+            remaining = target - self.progress
+            if remaining < self.window:
+                # Past the expected acquisition the line is late, it is searched for at full duty
+                if remaining > 0:
+                    low = control_unit.speed(self.duty_min)
+                    duty = low + (full - low) * remaining // self.window
+                self.polling = not self.found
+        self.progress += (duty << 8) // full if full else 256
+        return duty
+
+    def begin(self, direction):
+        """
+        Start a turn: forget the previous one and pick the expectation for the battery level.
+
+        Args:
+            direction: LineSensors.LEFT or LineSensors.RIGHT, the sensor that ends the turn
+        """
+        self.direction = direction
+        self.raw_bit = RAW_LEFT if direction == LineSensors.LEFT else RAW_RIGHT
+        self.progress = 0
+        self.polling = False
+        self.found = False
+        monitor = self.control_unit.battery_monitor
+        level = 0
+        if monitor is not None:
+            level = (monitor.millivolts() - TurnPredictor.BASE_MV) // TurnPredictor.LEVEL_MV
+            level = min(max(level, 0), TurnPredictor.LEVELS - 1)
+        self.level = level
+        self.target = self.expected[level] or self.latest
+
+    def service(self, deadline):
+        """
+        Poll the sensors until the deadline while the final window of a turn is open,
+        stops the spin as soon as the line is found. Returns right away otherwise.
+
+        Args:
+            deadline: monotonic_ns() timestamp by which the call returns
+        """
+        if not self.polling:
+            return
+        clock = self.clock
+        period = self.period_ns
+        last = deadline - period // 2
+        next_poll = clock()
+        while next_poll < last:
+            now = clock()
+            if now < next_poll:
+                sleep((next_poll - now) / 1_000_000_000)
+                now = next_poll
+            if self.poll(now):
+                return
+            next_poll = now + period
+
+    def poll(self, now):
+        """
+        Read the sensors once and stop the spin if the turning side found the line.
+        With a SensorSampler the read is one of its samples, it takes over its period.
+
+        Args:
+            now: Timestamp of the read in nanoseconds
+
+        Returns:
+            bool: True if the line was found
+        """
+        self.polls += 1
+        sampler = self.line_sensors.sampler
+        if sampler is None:
+            found = self.line_sensors.read_raw() & self.raw_bit
+        else:
+            sampler.sample(now)
+            sampler.next_sample = now + sampler.period_ns
+            found = sampler.stable & self.raw_bit
+        if not found:
+            return False
+        self.found = True
+        self.polling = False
+        self.polled_finds += 1
+        # Right away, the tick noticing the line would stop the spin up to a period later
+        self.control_unit.motors.stop()
+        return True
+
+    def found_left(self):
+        """
+        Guard of a left turn: True once the left sensor or the polling found the line.
+        """
+        return self.__finish(self.found or self.line_sensors.is_left())
+
+    def found_right(self):
+        """
+        Guard of a right turn: True once the right sensor or the polling found the line.
+        """
+        return self.__finish(self.found or self.line_sensors.is_right())
+
+    def __finish(self, found):
+        """
+        Learn from a turn that found its line.
+        """
+        if not found:
+            return False
+        if not self.direction:
+            # The line was there before the turn even started
+            return True
+        progress = self.progress
+        expected = self.expected[self.level]
+        if expected:
+            progress = expected + ((progress - expected) >> self.shift)
+        self.expected[self.level] = progress
+        self.latest = progress
+        self.turns += 1
+        self.direction = 0
+        self.polling = False
+        self.found = False
+        return True
+
+    def stats(self):
+        """
+        Returns the turns learned from, the polls and how many turns the polling ended,
+        and the learned progress per battery level in ticks at full turn duty.
+        """
+        return {"turns": self.turns, "polls": self.polls, "polled_finds": self.polled_finds,
+                "expected_ticks": [round(expected / 256, 2) for expected in self.expected]}